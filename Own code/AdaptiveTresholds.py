@@ -0,0 +1,86 @@
+import numpy as np
+
+from SleeveHandler import SleeveHandler
+
+
+class AdaptiveTresholds:
+    """
+    Derives the danger tresholds online from streaming statistics of the cell values.
+
+    The statistics are exponentially decayed histograms of the (binned) cell values,
+    one per cell and one for the whole environment, so the memory and the cost of an
+    update are constant (cells x bins), no frames are stored.
+
+    Environment: the soft treshold follows a low quantile of all cell values, such that
+    the model warns earlier in open spaces and later in narrow spaces. It is limited to
+    `scale_limits` times the base treshold, the medium and intense tresholds are scaled
+    with the same factor.
+
+    Cells: a cell that always sees something close (e.g. the floor in the bottom rows)
+    should not warn continuously. The tresholds of a cell are lowered to `cell_margin`
+    bins below the typical value (median) of that cell, but never below `min_scale`
+    times the scaled tresholds, such that close obstacles are always reported.
+    """
+
+    def __init__(self, cell_count, base_tresholds=(20, 10, 6), bin_count=64,
+                 half_life=300, env_half_life=900, env_quantile=0.25, cell_quantile=0.5,
+                 cell_margin=2, scale_limits=(0.5, 1.5), min_scale=0.5):
+        self.base_tresholds = np.array(base_tresholds, dtype=np.float64)
+        self.bin_count = bin_count
+        self.cell_decay = 0.5 ** (1 / half_life)
+        self.env_decay = 0.5 ** (1 / env_half_life)
+        self.env_quantile = env_quantile
+        self.cell_quantile = cell_quantile
+        self.cell_margin = cell_margin
+        self.scale_limits = scale_limits
+        self.min_scale = min_scale
+
+        self.cell_histogram = np.zeros((cell_count, bin_count))
+        self.env_histogram = np.zeros(bin_count)
+        self.cells = np.arange(cell_count)
+
+        # Start with the base tresholds for every cell, shape (3, cells): soft, medium, intense
+        self.tresholds = np.repeat(self.base_tresholds[:, None], cell_count, axis=1)
+        self.scale = 1.0
+
+    # Add the values of a frame to the statistics and update the tresholds
+    def update(self, values):
+        values = np.asarray(values)
+        valid = values >= 0
+        binned = np.minimum(values, self.bin_count - 1)
+
+        # Decay the histograms and add the new values
+        self.cell_histogram *= self.cell_decay
+        self.cell_histogram[self.cells[valid], binned[valid]] += 1
+        self.env_histogram *= self.env_decay
+        self.env_histogram += np.bincount(binned[valid], minlength=self.bin_count)
+
+        # Scale the tresholds to the environment
+        env_value = self.quantile(self.env_histogram[None], self.env_quantile)[0]
+        if env_value >= 0:
+            self.scale = np.clip(env_value / self.base_tresholds[0], *self.scale_limits)
+        scaled = self.base_tresholds * self.scale
+
+        # Lower the tresholds of cells with a close typical value
+        cell_values = self.quantile(self.cell_histogram, self.cell_quantile)
+        cell_soft = np.where(cell_values >= 0, cell_values - self.cell_margin, np.inf)
+        cell_scale = np.clip(cell_soft / scaled[0], self.min_scale, 1)
+        self.tresholds = scaled[:, None] * cell_scale[None, :]
+
+    # Get the bin containing the quantile of each histogram (-1 for empty histograms)
+    @staticmethod
+    def quantile(histograms, q):
+        cumulative = np.cumsum(histograms, axis=1)
+        total = cumulative[:, -1]
+        bins = np.argmax(cumulative >= q * total[:, None], axis=1)
+        return np.where(total > 0, bins, -1)
+
+    # Convert the values into danger levels (same rules as setGridSignals, with the tresholds per cell)
+    def getDangerLevels(self, values):
+        values = np.asarray(values)
+        soft, medium, intense = self.tresholds
+        levels = np.full(len(values), SleeveHandler.SOFT)
+        levels[values < medium] = SleeveHandler.MEDIUM
+        levels[values < intense] = SleeveHandler.INTENSE
+        levels[(values < 0) | (values > soft)] = SleeveHandler.OFF
+        return levels
@@ -0,0 +1,204 @@
+import argparse
+import json
+import platform
+import time
+import tracemalloc
+
+import numpy as np
+
+from GridModel import GridModel, splitGroups
+from FrameSource import RecordedFrameSource, syntheticFrames
+
+'''
+Benchmark of the depth model
+  Times every stage of the model (cell statistics, classification and output signal) on synthetic and
+  recorded depth frames, for a range of resolutions, grid sizes and bin sizes, and measures the peak memory.
+  The output commands are checked against the original implementation (blockshaped/measure), or against a
+  golden file of commands created with --save-golden, such that optimizations can not change the output (settings
+  missing in the golden file fail the check).
+  The results are stored as JSON, to compare different runs.
+'''
+
+RESOLUTIONS = {
+    "400p": (640, 400),
+    "720p": (1280, 720),
+    "800p": (1280, 800),
+}
+
+parser = argparse.ArgumentParser(description="Benchmark the stages of the depth model")
+parser.add_argument("recordings", nargs="*", help="Recorded depth frames (.drec recordings or np.save format)")
+parser.add_argument("--resolutions", default="400p,720p,800p", help="Comma separated resolutions ({})".format(",".join(RESOLUTIONS)))
+parser.add_argument("--grids", default="5x8,4x8,10x16", help="Comma separated grid sizes (ROWSxCOLUMNS)")
+parser.add_argument("--bin-sizes", default="125,50,250", help="Comma separated bin sizes")
+parser.add_argument("--frames", type=int, default=30, help="Number of synthetic frames per resolution")
+parser.add_argument("--repeat", type=int, default=3, help="Number of times the frames are processed")
+parser.add_argument("--no-reference", action="store_true", help="Skip timing the original blockshaped/measure implementation")
+parser.add_argument("--output", default="benchmark.json", help="File to store the results in (JSON)")
+parser.add_argument("--golden", help="Compare the output commands with this golden file")
+parser.add_argument("--save-golden", help="Store the output commands of the original implementation in this file")
+args = parser.parse_args()
+
+
+############################## Helper Functions ##############################
+
+# Resample frames to a different resolution (nearest neighbour)
+def resampleFrames(frames, resolution):
+    width, height = resolution
+    rows = np.arange(height) * frames.shape[1] // height
+    columns = np.arange(width) * frames.shape[2] // width
+    return frames[:, rows[:, None], columns[None, :]]
+
+# Get the statistics of a list of timings (in milliseconds)
+def summarize(timings):
+    timings = np.array(timings) * 1000
+    return {
+        "mean_ms": float(timings.mean()),
+        "p50_ms": float(np.percentile(timings, 50)),
+        "p95_ms": float(np.percentile(timings, 95)),
+        "max_ms": float(timings.max()),
+    }
+
+# Time the stages of the model on all frames
+def timeStages(model, frames, repeat):
+    stages = {"cell_statistics": [], "classification": [], "output_signal": [], "total": []}
+    for _ in range(repeat):
+        for depthFrame in frames:
+            t0 = time.perf_counter()
+            values = model.getValues(depthFrame)
+            t1 = time.perf_counter()
+            danger_levels = model.getDangerLevels(values)
+            t2 = time.perf_counter()
+            model.getOutputSignal(danger_levels)
+            t3 = time.perf_counter()
+
+            stages["cell_statistics"].append(t1 - t0)
+            stages["classification"].append(t2 - t1)
+            stages["output_signal"].append(t3 - t2)
+            stages["total"].append(t3 - t0)
+    return stages
+
+# Get the peak memory (in KiB) allocated while processing a single frame
+def peakMemory(model, depthFrame, reference=False):
+    tracemalloc.start()
+    model.process(depthFrame, reference=reference)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 1024
+
+# Get the output of the original implementation, the golden output
+def referenceOutput(model, depthFrame):
+    blocks = model.getBlocks(depthFrame)
+    danger_levels = [model.setGridSignals(model.measure(block)) for block in blocks]
+    command, intensity, endpoint = model.getReferenceOutputSignal(danger_levels)
+    return [command, int(intensity), [int(endpoint[0]), int(endpoint[1])]]
+
+
+############################## Running the Benchmark ##############################
+
+# Collect the frame sets (name, frames) for each resolution
+recorded = None
+if args.recordings:
+    frameSource = RecordedFrameSource(args.recordings)
+    recorded = np.stack([frame for frame, _ in frameSource])
+
+frame_sets = []
+for name in args.resolutions.split(","):
+    resolution = RESOLUTIONS[name]
+    frame_sets.append(("synthetic", name, syntheticFrames(resolution, args.frames)))
+    if recorded is not None:
+        frame_sets.append(("recorded", name, resampleFrames(recorded, resolution)))
+
+grids = [tuple(map(int, grid.split("x"))) for grid in args.grids.split(",")]
+bin_sizes = list(map(int, args.bin_sizes.split(",")))
+
+golden = {}
+if args.golden:
+    with open(args.golden, "r") as file:
+        golden = json.load(file)
+
+results = []
+golden_output = {}
+mismatches_total = 0
+missing_keys = []
+
+for source, name, frames in frame_sets:
+    height, width = frames.shape[1:]
+    for grid_rows, grid_columns in grids:
+        if height % grid_rows != 0 or width % grid_columns != 0:
+            print("Skipping {}x{} grid for {} ({}x{})".format(grid_rows, grid_columns, name, width, height))
+            continue
+
+        for bin_size in bin_sizes:
+            key = "{}-{}-{}x{}-{}".format(source, name, grid_rows, grid_columns, bin_size)
+            model = GridModel((width, height), grid_rows, grid_columns,
+                              splitGroups(grid_columns), splitGroups(grid_rows), bin_size)
+
+            # Check the output against the golden output, a golden file should contain every setting and frame
+            missing = args.golden is not None and key not in golden
+            if missing: missing_keys.append(key)
+            expected = golden[key] if key in golden else [referenceOutput(model, depthFrame) for depthFrame in frames]
+            output = [model.process(depthFrame)[2:] for depthFrame in frames]
+            output = [[command, int(intensity), [int(endpoint[0]), int(endpoint[1])]] for command, intensity, endpoint in output]
+            mismatches = sum(out != exp for out, exp in zip(output, expected)) + abs(len(output) - len(expected))
+            mismatches_total += mismatches
+            golden_output[key] = expected
+
+            result = {
+                "source": source,
+                "resolution": name,
+                "width": width,
+                "height": height,
+                "grid_rows": grid_rows,
+                "grid_columns": grid_columns,
+                "bin_size": bin_size,
+                "frames": len(frames),
+                "golden_mismatches": mismatches,
+                "golden_missing": missing,
+                "stages": {stage: summarize(timings) for stage, timings in timeStages(model, frames, args.repeat).items()},
+                "peak_memory_kib": peakMemory(model, frames[0]),
+            }
+
+            if not args.no_reference:
+                timings = []
+                for depthFrame in frames:
+                    t = time.perf_counter()
+                    model.process(depthFrame, reference=True)
+                    timings.append(time.perf_counter() - t)
+                result["reference"] = summarize(timings)
+                result["reference"]["peak_memory_kib"] = peakMemory(model, frames[0], reference=True)
+
+            results.append(result)
+
+            total = result["stages"]["total"]
+            print("{:40s} total: {:7.3f}ms (p95 {:7.3f}ms)  cells: {:7.3f}ms  classify: {:7.3f}ms  signal: {:7.3f}ms  peak: {:8.1f}KiB  {}".format(
+                key, total["mean_ms"], total["p95_ms"],
+                result["stages"]["cell_statistics"]["mean_ms"],
+                result["stages"]["classification"]["mean_ms"],
+                result["stages"]["output_signal"]["mean_ms"],
+                result["peak_memory_kib"],
+                "MISSING IN GOLDEN" if missing else "OK" if mismatches == 0 else "MISMATCH ({} frames)".format(mismatches)))
+
+
+# Store the results
+with open(args.output, "w") as file:
+    json.dump({
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "results": results,
+    }, file, indent=2)
+print("\nResults stored in:", args.output)
+
+if args.save_golden:
+    with open(args.save_golden, "w") as file:
+        json.dump(golden_output, file)
+    print("Golden output stored in:", args.save_golden)
+
+failures = []
+if mismatches_total > 0:
+    failures.append("Output differs from the golden output in {} frames".format(mismatches_total))
+if missing_keys:
+    failures.append("Missing in the golden file: {}".format(", ".join(missing_keys)))
+if failures:
+    raise SystemExit("\n".join(failures))
@@ -0,0 +1,206 @@
+import argparse
+import time
+
+import numpy as np
+
+from CellStatistics import CellStatistics
+
+'''
+Registry of the cell measures of the depth model
+  A cell measure reduces the valid (non-zero) depth values of every cell to a single value, in bins of BIN_SIZE
+  millimeters (the unit of the tresholds), or -1 for an empty cell. Every measure works on the whole frame at once and
+  declares its cost relative to the mode (the original measure). Select a measure with the CELL_MEASURE setting of
+  Depth Model.py (or cycle through them with 'm'), and time them on the current frame size with 'b' or:
+    python "Own code/CellMeasures.py" [recordings]
+'''
+
+# Registered measures by name, in order of registration
+MEASURES = {}
+
+
+def registerMeasure(measure):
+    MEASURES[measure.name] = measure
+    return measure
+
+
+class CellMeasure:
+    """
+    Base class of the cell measures.
+
+    values returns the measure of every cell (or of the given subset of cells), see
+    IncrementalCellStatistics. `cost` is the declared cost per frame relative to the
+    mode, the actual cost on a frame size is measured by benchmarkMeasures.
+    """
+
+    name = None
+    cost = None
+    description = ""
+
+    def __init__(self, cellStatistics):
+        self.cellStatistics = cellStatistics
+
+    def values(self, frame, cells=None):
+        raise NotImplementedError
+
+    # Get the histogram of every cell (or of the given subset of cells)
+    def histogram(self, frame, cells=None):
+        if cells is None: return self.cellStatistics.histogram(frame)
+        return self.cellStatistics.cellHistogram(frame, cells)
+
+
+@registerMeasure
+class ModeMeasure(CellMeasure):
+    name = "mode"
+    cost = 1.0
+    description = "Bin containing the most values (original measure)"
+
+    def values(self, frame, cells=None):
+        return self.cellStatistics.modes(frame, cells)
+
+
+class RankMeasure(CellMeasure):
+    """
+    Bin of the value with a given rank in every cell (an order statistic), read from
+    the cumulative histogram. The result is exact, as the value with that rank lies in
+    the first bin whose cumulative count reaches the rank.
+    """
+
+    cost = 1.1
+
+    # Get the rank (starting at 1) of the measured value in every cell, given the number of valid values
+    def getRanks(self, counts):
+        raise NotImplementedError
+
+    def values(self, frame, cells=None):
+        counts = self.histogram(frame, cells)
+        cumulative = np.cumsum(counts, axis=1)
+        totals = cumulative[:, -1]
+        ranks = self.getRanks(totals)
+
+        values = np.argmax(cumulative >= ranks[:, None], axis=1)
+        values[totals == 0] = -1
+        return values
+
+
+@registerMeasure
+class MedianMeasure(RankMeasure):
+    name = "median"
+    description = "Bin of the (lower) median value"
+
+    def getRanks(self, counts):
+        return (counts + 1) // 2
+
+
+@registerMeasure
+class PercentileMeasure(RankMeasure):
+    name = "percentile"
+    description = "Bin of a low percentile (the closest obstacle covering a part of the cell)"
+
+    def __init__(self, cellStatistics, percentile=10):
+        super().__init__(cellStatistics)
+        self.percentile = percentile
+
+    def getRanks(self, counts):
+        return np.maximum(np.ceil(counts * self.percentile / 100), 1).astype(counts.dtype)
+
+
+@registerMeasure
+class TrimmedMinimumMeasure(RankMeasure):
+    name = "trimmed_min"
+    description = "Bin of the minimum, after dropping the closest `trim` values (noise)"
+
+    def __init__(self, cellStatistics, trim=20):
+        super().__init__(cellStatistics)
+        self.trim = trim
+
+    def getRanks(self, counts):
+        return np.minimum(self.trim + 1, np.maximum(counts, 1))
+
+
+@registerMeasure
+class MeanMeasure(CellMeasure):
+    name = "mean"
+    cost = 0.5
+    description = "Bin of the mean value (no histogram)"
+
+    def values(self, frame, cells=None):
+        blocks = self.cellStatistics.getCells(frame)
+        if cells is None:
+            blocks = blocks.reshape(self.cellStatistics.cell_count, blocks.shape[2], blocks.shape[3])
+        else:
+            blocks = blocks[cells // self.cellStatistics.grid_columns, cells % self.cellStatistics.grid_columns]
+
+        counts = np.count_nonzero(blocks, axis=(1, 2))
+        sums = blocks.sum(axis=(1, 2), dtype=np.int64)
+        values = sums // np.maximum(counts, 1) // self.cellStatistics.bin_size
+        values[counts == 0] = -1
+        return values
+
+
+# Create a registered measure, raises ValueError for unknown measures
+def createMeasure(name, cellStatistics, **parameters):
+    if name not in MEASURES:
+        raise ValueError("Unknown cell measure: {} (available: {})".format(name, ", ".join(MEASURES)))
+    return MEASURES[name](cellStatistics, **parameters)
+
+# Get the name of the next registered measure (to cycle through the measures)
+def getNextMeasure(name):
+    names = list(MEASURES)
+    return names[(names.index(name) + 1) % len(names)]
+
+
+############################## Self-Benchmark ##############################
+
+# Time every measure on the frames, returns per measure: the mean time per frame (ms), the declared cost,
+# and the fraction of the cells whose value is within `tolerance` bins of the reference measure
+def benchmarkMeasures(cellStatistics, frames, repeat=3, reference="mode", tolerance=1):
+    frames = [frames] if np.ndim(frames) == 2 else frames
+    expected = [createMeasure(reference, cellStatistics).values(frame) for frame in frames]
+
+    results = {}
+    for name in MEASURES:
+        measure = createMeasure(name, cellStatistics)
+        values = [measure.values(frame) for frame in frames]
+
+        start_time = time.perf_counter()
+        for _ in range(repeat):
+            for frame in frames:
+                measure.values(frame)
+        elapsed = time.perf_counter() - start_time
+
+        agreement = np.mean([np.mean(np.abs(value - exp) <= tolerance) for value, exp in zip(values, expected)])
+        results[name] = {"time": elapsed * 1000 / (repeat * len(frames)), "cost": measure.cost, "agreement": agreement}
+    return results
+
+def getBenchmarkReport(results, reference="mode"):
+    reference_time = results[reference]["time"]
+    lines = ["{:12s} {:>9s} {:>9s} {:>9s} {:>10s}".format("Measure", "Time", "Measured", "Declared", "Agreement")]
+    for name, result in results.items():
+        lines.append("{:12s} {:7.3f}ms {:9.2f} {:9.2f} {:10.1%}".format(
+            name, result["time"], result["time"] / reference_time, result["cost"], result["agreement"]))
+    lines.append("Measured/declared: cost relative to {}, agreement: cells within 1 bin of {}".format(reference, reference))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    from FrameSource import RecordedFrameSource, syntheticFrames
+
+    parser = argparse.ArgumentParser(description="Time the cell measures on recorded or synthetic frames")
+    parser.add_argument("recordings", nargs="*", help="Recorded depth frames (.drec recordings or np.save format), synthetic frames are used when omitted")
+    parser.add_argument("--frames", type=int, default=30, help="Number of synthetic frames")
+    parser.add_argument("--grid", default="5x8", help="Grid size (rows x columns)")
+    parser.add_argument("--bin-size", type=int, default=125, help="Bin size (in millimeters)")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of times the frames are measured for the timing")
+    args = parser.parse_args()
+
+    if args.recordings:
+        frameSource = RecordedFrameSource(args.recordings)
+        frames = np.stack([frame for frame, _ in frameSource])
+        frameSource.close()
+    else:
+        frames = syntheticFrames(count=args.frames)
+
+    grid_rows, grid_columns = map(int, args.grid.split("x"))
+    print("Frames: {} ({}x{}), grid {}x{}, bin size {}\n".format(len(frames), frames.shape[2], frames.shape[1], grid_rows, grid_columns, args.bin_size))
+    cellStatistics = CellStatistics(frames.shape[1:], grid_rows, grid_columns, args.bin_size)
+    print(getBenchmarkReport(benchmarkMeasures(cellStatistics, frames, args.repeat)))
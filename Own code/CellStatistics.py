@@ -0,0 +1,156 @@
+import numpy as np
+
+
+# Largest value a depth frame can contain (uint16 millimeters)
+MAX_DEPTH = np.iinfo(np.uint16).max
+
+
+class CellStatistics:
+    """
+    Computes the model statistics for every cell of the grid in a single pass.
+
+    Each pixel is assigned a combined (cell, bin) index, which is precomputed
+    for the frame shape. A single bincount over these indices results in the
+    histogram of every cell. Zero values end up in the first bin of their cell,
+    so they are counted per cell and subtracted from that bin afterwards.
+    The mode of each cell is the (first) bin with the highest count, which is
+    identical to the original np.unique based measure.
+    """
+
+    def __init__(self, shape, grid_rows, grid_columns, bin_size, max_depth=MAX_DEPTH):
+        h, w = shape
+        assert h % grid_rows == 0, f"{h} rows is not evenly divisible by {grid_rows}"
+        assert w % grid_columns == 0, f"{w} cols is not evenly divisible by {grid_columns}"
+
+        self.shape = shape
+        self.grid_rows = grid_rows
+        self.grid_columns = grid_columns
+        self.cell_count = grid_rows * grid_columns
+        self.cell_height, self.cell_width = h // grid_rows, w // grid_columns
+        self.bin_size = bin_size
+        self.bin_count = max_depth // bin_size + 1
+
+        # Precompute the offset of the first bin of the cell for each pixel
+        cell_rows = np.arange(h) // self.cell_height
+        cell_columns = np.arange(w) // self.cell_width
+        cell_index = cell_rows[:, None] * grid_columns + cell_columns[None, :]
+        self.cell_offset = (cell_index * self.bin_count).astype(np.intp)
+
+    # Get a view of the frame with shape (rows, columns, cell height, cell width)
+    def getCells(self, frame):
+        return (frame.reshape(self.grid_rows, self.cell_height, self.grid_columns, self.cell_width)
+                     .swapaxes(1, 2))
+
+    # Get the histogram of every cell, shape (cells, bins)
+    def histogram(self, frame):
+        assert frame.shape == self.shape, f"Expected frame of shape {self.shape}, got {frame.shape}"
+
+        indices = np.add(frame // self.bin_size, self.cell_offset)
+        counts = np.bincount(indices.ravel(), minlength=self.cell_count * self.bin_count)
+        counts = counts.reshape(self.cell_count, self.bin_count)
+
+        # Drop all zeroes from the data
+        zeros = (frame == 0).reshape(self.grid_rows, self.cell_height, self.grid_columns, self.cell_width)
+        counts[:, 0] -= zeros.sum(axis=(1, 3)).ravel()
+        return counts
+
+    # Get the histogram of a subset of the cells (indices), shape (len(cells), bins)
+    def cellHistogram(self, frame, cells):
+        assert frame.shape == self.shape, f"Expected frame of shape {self.shape}, got {frame.shape}"
+
+        # Copy only the selected cells, shape (len(cells), cell height * cell width)
+        blocks = self.getCells(frame)[cells // self.grid_columns, cells % self.grid_columns]
+        blocks = blocks.reshape(len(cells), -1)
+
+        offsets = np.arange(len(cells))[:, None] * self.bin_count
+        counts = np.bincount((blocks // self.bin_size + offsets).ravel(), minlength=len(cells) * self.bin_count)
+        counts = counts.reshape(len(cells), self.bin_count)
+
+        # Drop all zeroes from the data
+        counts[:, 0] -= (blocks == 0).sum(axis=1)
+        return counts
+
+    # Get the value of the largest bin of every cell (-1 if the cell is empty)
+    def modes(self, frame, cells=None):
+        counts = self.histogram(frame) if cells is None else self.cellHistogram(frame, cells)
+        return self.countsToModes(counts)
+
+    @staticmethod
+    def countsToModes(counts):
+        values = np.argmax(counts, axis=1)
+        values[counts[np.arange(len(counts)), values] == 0] = -1
+        return values
+
+
+class IncrementalCellStatistics:
+    """
+    Computes the modes of the cells incrementally, only the cells whose depth changed are recomputed.
+
+    Change detection uses a coarse summary of every cell: the number of valid pixels
+    and their mean depth, on a strided sample of the cell (every `sample_step` pixel
+    in both directions). A cell is dirty when its mean moved more than `mean_tolerance`
+    (in millimeters) or its valid count changed more than `count_tolerance` (fraction of
+    the sampled pixels of a cell), compared to the summary at the last recompute. Every cell is recomputed at least
+    once every `refresh_interval` frames, so the cache never drifts.
+    The cells are measured with `measure` (a CellMeasure, see CellMeasures.py), the mode by default.
+    """
+
+    def __init__(self, cellStatistics, sample_step=4, mean_tolerance=None, count_tolerance=0.05, refresh_interval=15, measure=None):
+        self.cellStatistics = cellStatistics
+        self.measure = cellStatistics.modes if measure is None else measure.values
+        self.sample_step = sample_step
+        self.mean_tolerance = cellStatistics.bin_size / 4 if mean_tolerance is None else mean_tolerance
+        self.count_tolerance = count_tolerance
+        self.refresh_interval = refresh_interval
+
+        # Number of sampled pixels of every cell (the valid count tolerance is relative to it)
+        self.sample_size = len(range(0, cellStatistics.cell_height, sample_step)) * len(range(0, cellStatistics.cell_width, sample_step))
+
+        cell_count = cellStatistics.cell_count
+        self.values = np.full(cell_count, -1)
+        self.means = np.zeros(cell_count)
+        self.counts = np.zeros(cell_count)
+        self.ages = np.zeros(cell_count, dtype=int)
+        self.first = True
+
+        # Statistics
+        self.frames = self.recomputed = 0
+
+    # Get the coarse summary (valid count, mean depth) of every cell
+    def summarize(self, frame):
+        sample = self.cellStatistics.getCells(frame)[:, :, ::self.sample_step, ::self.sample_step]
+        counts = np.count_nonzero(sample, axis=(2, 3)).ravel()
+        sums = sample.sum(axis=(2, 3), dtype=np.int64).ravel()
+        return counts, sums / np.maximum(counts, 1)
+
+    def modes(self, frame):
+        counts, means = self.summarize(frame)
+        self.ages += 1
+
+        # Find the cells that changed (or need a refresh)
+        dirty = (np.abs(means - self.means) > self.mean_tolerance) \
+              | (np.abs(counts - self.counts) > self.count_tolerance * self.sample_size) \
+              | (self.ages >= self.refresh_interval)
+        if self.first: dirty[:] = True
+
+        cells = np.flatnonzero(dirty)
+        if len(cells) == len(dirty):
+            self.values = self.measure(frame)
+        elif len(cells) > 0:
+            self.values[cells] = self.measure(frame, cells)
+
+        # Store the summary of the recomputed cells
+        self.means[cells], self.counts[cells], self.ages[cells] = means[cells], counts[cells], 0
+
+        # Stagger the forced refreshes of the cells over the frames
+        if self.first:
+            self.ages = np.arange(len(self.ages)) % self.refresh_interval
+            self.first = False
+
+        self.frames += 1
+        self.recomputed += len(cells)
+        return self.values.copy()
+
+    # Get the fraction of the cells that were recomputed
+    def getRecomputeRate(self):
+        return self.recomputed / max(self.frames * len(self.values), 1)
@@ -0,0 +1,90 @@
+import argparse
+import time
+
+import numpy as np
+
+from GridModel import GridModel
+from FrameSource import RecordedFrameSource, syntheticFrames
+
+'''
+Comparison of the decimated model with the full resolution model
+  Runs the same depth frames through the full resolution model and through the decimated model, for a range of
+  decimation factors, and reports how often the sleeve command (and its intensity) differs from the full model,
+  and how much time per frame is saved.
+  Two modes are compared for every factor:
+    host:   the full frame is received and the model only uses every n-th pixel of each cell (GridModel decimation)
+    device: the camera sends frames decimated by pixel skipping (decimationFilter), the model runs on the smaller frame
+'''
+
+parser = argparse.ArgumentParser(description="Compare the output and speed of the decimated model with the full resolution model")
+parser.add_argument("recordings", nargs="*", help="Recorded depth frames (.drec recordings or np.save format), synthetic frames are used when omitted")
+parser.add_argument("--factors", default="2,3,4", help="Comma separated decimation factors")
+parser.add_argument("--frames", type=int, default=300, help="Number of synthetic frames")
+parser.add_argument("--repeat", type=int, default=3, help="Number of times the frames are processed for the timing")
+args = parser.parse_args()
+
+
+############################## Helper Functions ##############################
+
+# Run the model on all frames, returns the output (command, intensity) and the mean time per frame (in milliseconds)
+def runModel(model, frames, repeat):
+    output = [model.process(depthFrame)[2:4] for depthFrame in frames]
+
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        for depthFrame in frames:
+            model.process(depthFrame)
+    elapsed = time.perf_counter() - start_time
+    return output, elapsed * 1000 / (repeat * len(frames))
+
+# Compare the output of a model with the output of the full resolution model
+def compareOutput(output, expected):
+    commands = np.array([command != exp_command for (command, _), (exp_command, _) in zip(output, expected)])
+    intensities = np.array([intensity - exp_intensity for (_, intensity), (_, exp_intensity) in zip(output, expected)])
+    return {
+        "command": commands.mean(),
+        "intensity": (intensities != 0).mean(),
+        "weaker": (intensities < 0).mean(),
+    }
+
+
+############################## Running the Comparison ##############################
+
+if args.recordings:
+    frameSource = RecordedFrameSource(args.recordings)
+    frames = np.stack([frame for frame, _ in frameSource])
+    frameSource.close()
+else:
+    frames = syntheticFrames(count=args.frames)
+height, width = frames.shape[1:]
+
+full_model = GridModel((width, height))
+expected, full_time = runModel(full_model, frames, args.repeat)
+print("Frames: {} ({}x{}), full resolution: {:.3f}ms per frame\n".format(len(frames), width, height, full_time))
+print("{:6s} {:>6s} {:>10s} {:>10s} {:>10s} {:>10s} {:>10s} {:>8s}".format(
+    "Mode", "Factor", "Size", "Command", "Intensity", "Weaker", "Time", "Saved"))
+
+for factor in map(int, args.factors.split(",")):
+    modes = [("host", GridModel((width, height), decimation=factor), frames)]
+
+    # The decimation filter of the camera skips pixels, the frame has to fit the grid
+    sampled_width, sampled_height = width // factor, height // factor
+    if sampled_height % full_model.grid_rows == 0 and sampled_width % full_model.grid_columns == 0:
+        modes.append(("device", GridModel((sampled_width, sampled_height)), frames[:, :sampled_height * factor:factor, :sampled_width * factor:factor]))
+    else:
+        modes.append(("device", None, None))
+
+    for mode, model, mode_frames in modes:
+        if model is None:
+            print("{:6s} {:6d} {:>10s} skipped, the frames do not fit the grid".format(mode, factor, "{}x{}".format(sampled_width, sampled_height)))
+            continue
+
+        output, mode_time = runModel(model, mode_frames, args.repeat)
+        difference = compareOutput(output, expected)
+        print("{:6s} {:6d} {:>10s} {:9.1%} {:10.1%} {:10.1%} {:8.3f}ms {:7.1%}".format(
+            mode, factor, "{}x{}".format(*model.cellStatistics.shape[::-1]),
+            difference["command"], difference["intensity"], difference["weaker"],
+            mode_time, 1 - mode_time / full_time))
+
+print("\nCommand/Intensity: frames with a different sleeve command/intensity than the full resolution model")
+print("Weaker: frames with a lower intensity than the full resolution model (missed danger)")
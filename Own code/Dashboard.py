@@ -0,0 +1,156 @@
+import argparse
+import subprocess
+import sys
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+'''
+Live dashboard of the depth model
+  Shows the histogram of the depth values of every cell, in a separate process, such that plotting never slows down the model.
+  The model process publishes the pre-binned counts in shared memory (DashboardPublisher), the dashboard reads the newest
+  counts at its own rate. Started by Depth Model.py when PLOT_DATA is enabled, or manually with the name of the shared memory:
+    python "Own code/Dashboard.py" <name>
+'''
+
+# Layout of the header: sequence number, frame number, grid rows, grid columns, bin count, bin size
+HEADER_SIZE = 6
+# Danger level colors (matplotlib), equal to the colors of the visualization
+LEVEL_COLORS = ["white", "green", "orange", "red", "magenta"]
+
+
+# Create numpy views of the shared memory: header, values, danger levels, counts
+def getArrays(buffer, cell_count, bin_count):
+    header = np.ndarray(HEADER_SIZE, dtype=np.int64, buffer=buffer)
+    values = np.ndarray(cell_count, dtype=np.int64, buffer=buffer, offset=header.nbytes)
+    danger_levels = np.ndarray(cell_count, dtype=np.int64, buffer=buffer, offset=header.nbytes + values.nbytes)
+    counts = np.ndarray((cell_count, bin_count), dtype=np.uint32, buffer=buffer, offset=header.nbytes + 2 * values.nbytes)
+    return header, values, danger_levels, counts
+
+def getSize(cell_count, bin_count):
+    return 8 * (HEADER_SIZE + 2 * cell_count) + 4 * cell_count * bin_count
+
+
+class DashboardPublisher:
+    """
+    Publishes the per cell histograms of the model in shared memory, for the dashboard process.
+
+    The memory is protected by a sequence lock: the sequence number is odd while the
+    publisher writes, so the reader retries when the number is odd or changed during
+    its copy. The publisher never waits for the reader. Only the bins up to `max_depth`
+    millimeters are published, at most `publish_rate` times per second.
+    """
+
+    def __init__(self, grid_rows, grid_columns, bin_size, max_depth=10000, publish_rate=5, name=None):
+        self.cell_count = grid_rows * grid_columns
+        self.bin_count = -(-max_depth // bin_size)
+        self.publish_interval = 1 / publish_rate if publish_rate else 0
+        self.next_publish = 0
+        self.process = None
+
+        self.memory = shared_memory.SharedMemory(name=name, create=True, size=getSize(self.cell_count, self.bin_count))
+        self.header, self.values, self.danger_levels, self.counts = getArrays(self.memory.buf, self.cell_count, self.bin_count)
+        self.header[:] = [0, 0, grid_rows, grid_columns, self.bin_count, bin_size]
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    # Start the dashboard in a separate process
+    def startDashboard(self):
+        self.process = subprocess.Popen([sys.executable, __file__, self.name])
+
+    # Check whether the next frame should be published
+    def isDue(self):
+        return time.monotonic() >= self.next_publish
+
+    # Publish the histogram counts (cells, bins) of a frame, with the value and danger level of every cell
+    def publish(self, counts, values, danger_levels):
+        self.next_publish = max(self.next_publish + self.publish_interval, time.monotonic())
+
+        self.header[0] += 1
+        self.values[:] = values
+        self.danger_levels[:] = danger_levels
+        self.counts[:] = counts[:, :self.bin_count]
+        self.header[1] += 1
+        self.header[0] += 1
+
+    def close(self):
+        if self.process is not None: self.process.terminate()
+        del self.header, self.values, self.danger_levels, self.counts
+        self.memory.close()
+        self.memory.unlink()
+
+
+class DashboardReader:
+    """
+    Reads the newest consistent copy of the histograms published by a DashboardPublisher.
+    """
+
+    def __init__(self, name):
+        self.memory = shared_memory.SharedMemory(name=name)
+        # The memory is owned (and removed) by the publisher
+        resource_tracker.unregister(self.memory._name, "shared_memory")
+
+        header = np.ndarray(HEADER_SIZE, dtype=np.int64, buffer=self.memory.buf)
+        _, _, self.grid_rows, self.grid_columns, self.bin_count, self.bin_size = (int(value) for value in header)
+        self.cell_count = self.grid_rows * self.grid_columns
+        self.header, self.values, self.danger_levels, self.counts = getArrays(self.memory.buf, self.cell_count, self.bin_count)
+        self.last_frame = -1
+
+    # Get a copy of (frame, values, danger levels, counts), None if there is no new frame or the publisher was writing
+    def read(self, retries=3):
+        for _ in range(retries):
+            sequence = int(self.header[0])
+            if sequence % 2 == 1: continue
+
+            frame = int(self.header[1])
+            data = (frame, self.values.copy(), self.danger_levels.copy(), self.counts.copy())
+            if int(self.header[0]) == sequence:
+                if frame == self.last_frame: return None
+                self.last_frame = frame
+                return data
+        return None
+
+    def close(self):
+        del self.header, self.values, self.danger_levels, self.counts
+        self.memory.close()
+
+
+############################## Running the Dashboard ##############################
+
+def runDashboard(name, refresh_rate=5):
+    import matplotlib.pyplot as plt
+
+    reader = DashboardReader(name)
+    fig, axes = plt.subplots(nrows=reader.grid_rows, ncols=reader.grid_columns, sharex=True, sharey=True, squeeze=False)
+    fig.canvas.manager.set_window_title("Depth Model Dashboard")
+    axes = axes.ravel()
+
+    # Histogram of every cell (fraction of the valid pixels per bin, depth in meters)
+    edges = np.arange(reader.bin_count + 1) * reader.bin_size / 1000
+    plots = [ax.stairs(np.zeros(reader.bin_count), edges, fill=True) for ax in axes]
+    axes[0].set_ylim(0, 1)
+
+    while plt.fignum_exists(fig.number):
+        data = reader.read()
+        if data is not None:
+            frame, values, danger_levels, counts = data
+            fractions = counts / np.maximum(counts.sum(axis=1, keepdims=True), 1)
+            for i, ax in enumerate(axes):
+                plots[i].set_data(fractions[i])
+                plots[i].set_color(LEVEL_COLORS[danger_levels[i]] if danger_levels[i] > 0 else "gray")
+                ax.set_title(str(values[i]), fontsize=8)
+            fig.suptitle("Frame {}".format(frame))
+        plt.pause(1 / refresh_rate)
+
+    reader.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show the live histograms of the depth model")
+    parser.add_argument("name", help="Name of the shared memory of the model")
+    parser.add_argument("--refresh-rate", type=float, default=5, help="Number of refreshes per second")
+    args = parser.parse_args()
+    runDashboard(args.name, args.refresh_rate)
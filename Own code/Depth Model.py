@@ -1,231 +1,124 @@
-from itertools import chain
+import os
+import threading
 import time
 
 import depthai as dai
 import cv2
 import numpy as np
 
-import matplotlib.pyplot as plt
-import seaborn as sns
-
 from SleeveHandler import SleeveHandler
+from FrameSource import DepthAIFrameSource
+from DepthRecording import DepthRecorder, EXTENSION
+from ModelPipeline import ModelPipeline, ModelResult
+from Renderer import Renderer
+from Dashboard import DashboardPublisher
+from LatencyMonitor import LatencyMonitor
+from Settings import Settings
+from FrameRing import FrameRing
+from CellMeasures import getNextMeasure, benchmarkMeasures, getBenchmarkReport
+from ModelSetup import DEFAULT_SETTINGS, checkDeviceDecimation, createDepthPipeline, createModel as createSessionModel, getCommands, getDeviceDecimation, getDeviceResolution
 
 
 ############################## Settings ##############################
 
-# Camera Settings
-USB_2_MODE = True
+# The camera, sleeve, grid and model settings are shared with the other entry points, see DEFAULT_SETTINGS in ModelSetup.py
+
+# Pipeline settings
+THREADED_PIPELINE = True
+FRAME_RING_SIZE = 8     # Number of preallocated frame buffers shared by the model, recorder and visualization (0 copies every frame)
+SHARE_FRAMES = False    # Allocate the frame buffers in shared memory, for diagnostics processes (see FrameRing.py)
 
 # Output settings
-LEFT_HANDED = False
 VISUALIZE_MODEL = True
+RENDER_RATE = 15        # Maximum frame rate of the visualization (independent of the model)
 FULL_SCREEN_MODE = True
 SHOW_GRID = False
 PLOT_DATA = False
 CREATE_SNAPSHOT = False
+RECORD_SESSION = False
+RECORD_COMPRESSION = True
+# Latency settings
+SHOW_LATENCY = False
+LATENCY_REPORT_INTERVAL = 10    # Seconds between the printed latency reports
+LATENCY_EXPORT = None           # File to export the latency to periodically (.csv or Prometheus text file), e.g. "latency.prom"
 # Arrow settings
 SHOW_ARROW = True
-ARROW_LENGTH = 100
-
-# Grid settings
-GRID_ROWS = 5
-GRID_COLUMNS = 8
-# Horizontal grouping
-H_LEFT_GROUP = [0,1,2]
-H_CENTER_GROUP = [3,4]
-H_RIGHT_GROUP = [5,6,7]
-# Vertical grouping
-V_TOP_GROUP = [0,1]
-V_CENTER_GROUP = [2]
-V_BOTTOM_GROUP = [3,4]
-
-# Model settings
-BIN_SIZE = 125
-SOFT_TRESHOLD       = 20
-MEDIUM_TRESHOLD     = 10
-INTENSE_TRESHOLD    = 6
-
-# Define the measure used by the model
-def measure(block):
-    if len(block) == 0: return -1
-
-    # Aggregate the values in bins
-    vals, counts = np.unique(block//BIN_SIZE, return_counts=True)
-    # Return the value of the largest bin (containing most data)
-    return vals[np.argmax(counts)]
+
+# Settings file (JSON), overrides the settings above and is reloaded while running (keybind 'l' or when the file changes)
+SETTINGS_FILE = "settings.json"
+
+
+############################## Settings File ##############################
+
+# Override the settings with the settings file
+settings = Settings(dict(DEFAULT_SETTINGS, **{name: value for name, value in globals().items()
+                                              if name.isupper() and name not in ("EXTENSION", "SETTINGS_FILE", "DEFAULT_SETTINGS")}), SETTINGS_FILE)
+globals().update(settings.values)
+# Settings of ModelSetup.py used directly by this script (all model settings are passed to createModel, see below)
+USB_2_MODE = settings["USB_2_MODE"]
+MAX_FRAME_AGE = settings["MAX_FRAME_AGE"]
+LEFT_HANDED = settings["LEFT_HANDED"]
+SLEEVE_COMMANDS_DIR = settings["SLEEVE_COMMANDS_DIR"]
+GRID_ROWS = settings["GRID_ROWS"]
+GRID_COLUMNS = settings["GRID_COLUMNS"]
+BIN_SIZE = settings["BIN_SIZE"]
+DECIMATE_ON_DEVICE = settings["DECIMATE_ON_DEVICE"]
+# The frames decimated by the camera should fit the grid (raises ValueError)
+checkDeviceDecimation(settings)
+
+# These settings are only used at startup (the device, pipeline and window are not recreated)
+RESTART_SETTINGS = {"USB_2_MODE", "THREADED_PIPELINE", "FRAME_RING_SIZE", "SHARE_FRAMES", "VISUALIZE_MODEL", "FULL_SCREEN_MODE", "DECIMATE_ON_DEVICE"}
+if DECIMATE_ON_DEVICE: RESTART_SETTINGS.add("DECIMATION_FACTOR")
 
 
 ############################## Constants ##############################
 
-resolution = (640, 400) # Used to properly create grid, does not influence camera
 white = (255, 255, 255)
 green = (0, 255, 0)
 yellow = (0, 204, 255)
 red = (0, 0, 255)
+magenta = (255, 0, 255)
 
 colormap = {
-    SleeveHandler.OFF:     white,
-    SleeveHandler.SOFT:    green,
-    SleeveHandler.MEDIUM:  yellow,
-    SleeveHandler.INTENSE: red
+    SleeveHandler.OFF:       white,
+    SleeveHandler.SOFT:      green,
+    SleeveHandler.MEDIUM:    yellow,
+    SleeveHandler.INTENSE:   red,
+    SleeveHandler.STEP_DOWN: magenta
 }
 
-############################## Helper Functions ##############################
-
-# Define helper functions
-def blockshaped(arr, nrows, ncols):
-    """
-    This function was obtained from stack-overflow:
-    https://stackoverflow.com/a/16858283
-
-    Return an array of shape (n, nrows, ncols) where
-    n * nrows * ncols = arr.size
-
-    If arr is a 2D array, the returned array should look like n subblocks with
-    each subblock preserving the "physical" layout of arr.
-    """
-    h, w = arr.shape
-    assert h % nrows == 0, f"{h} rows is not evenly divisible by {nrows}"
-    assert w % ncols == 0, f"{w} cols is not evenly divisible by {ncols}"
-    return (arr.reshape(h//nrows, nrows, -1, ncols)
-               .swapaxes(1,2)
-               .reshape(-1, nrows, ncols))
-
-# Function to convert measure into output signal
-def setGridSignals(value):
-    if   (value < 0 or value > SOFT_TRESHOLD): return SleeveHandler.OFF
-    elif (value < INTENSE_TRESHOLD): return SleeveHandler.INTENSE
-    elif (value < MEDIUM_TRESHOLD):  return SleeveHandler.MEDIUM
-    else:                            return SleeveHandler.SOFT
-
-# Function to convert danger_levels into a single output command
-def getOutputSignal(danger_levels, center_point):
-    intensity = max(danger_levels)
-
-    # Aggregate the cell values into predefined regions
-    h_sum, h_count = [0 for _ in range(3)], [0 for _ in range(3)]
-    v_sum, v_count = [0 for _ in range(3)], [0 for _ in range(3)]
-    for i, level in enumerate(danger_levels):
-        if level > SleeveHandler.OFF:
-            row = i // GRID_COLUMNS
-            column = i % GRID_COLUMNS
-            
-            if row in V_TOP_GROUP:
-                v_sum[0] += level
-                v_count[0] += 1
-            elif row in V_CENTER_GROUP:
-                v_sum[1] += level
-                v_count[1] += 1
-            elif row in V_BOTTOM_GROUP:
-                v_sum[2] += level
-                v_count[2] += 1            
-            
-            if column in H_LEFT_GROUP:
-                h_sum[0] += level
-                h_count[0] += 1
-            elif column in H_CENTER_GROUP:
-                h_sum[1] += level
-                h_count[1] += 1
-            elif column in H_RIGHT_GROUP:
-                h_sum[2] += level
-                h_count[2] += 1
-
-    # Get the mean value of each horizontal and vertical region
-    convertToMeans = lambda sums, counts: [s/c if c > 0 else 0 for s,c in zip(sums, counts)]
-    h_means = convertToMeans(h_sum, h_count)
-    v_means = convertToMeans(v_sum, v_count)
-    
-    # Disable all regions
-    left = h_center = right = bottom = v_center = top = False
-    # Set the horizontal and vertical region, based on the highest mean
-    h_max, v_max = max(h_means), max(v_means)
-    left, h_center, right = [m == h_max for m in h_means]
-    top, v_center, bottom = [m == v_max for m in v_means]
-
-    # Create the output signal arrow and command
-    end_point_x, end_point_y = center_point
-    command = SleeveHandler.BASE_COMMAND + SleeveHandler.TAP
-
-    if (left and right) or h_center:
-        command += SleeveHandler.H_CENTER
-    elif left:
-        command += SleeveHandler.LEFT
-        end_point_x -= ARROW_LENGTH
-    elif right:
-        command += SleeveHandler.RIGHT
-        end_point_x += ARROW_LENGTH
-
-    if (top and bottom) or v_center:
-        command += SleeveHandler.V_CENTER
-    elif top:
-        command += SleeveHandler.TOP
-        end_point_y -= ARROW_LENGTH
-    elif bottom:
-        command += SleeveHandler.BOTTOM
-        end_point_y += ARROW_LENGTH
-
-    if intensity == SleeveHandler.SOFT:
-        command += SleeveHandler.DECREASE + "10"
-    elif intensity == SleeveHandler.MEDIUM:
-        command += SleeveHandler.DECREASE + "5"
-    elif intensity == SleeveHandler.INTENSE:
-        command += SleeveHandler.DECREASE + "0"
-    elif intensity == SleeveHandler.OFF:
-        command = ""
-
-    return command, intensity, (end_point_x, end_point_y)
-
 ############################## Camera Pipelines & Settings ##############################
 
-# Setup camera pipelines
-pipeline = dai.Pipeline()
-left = pipeline.create(dai.node.MonoCamera)
-left.setBoardSocket(dai.CameraBoardSocket.LEFT)
-left.setResolution(dai.MonoCameraProperties.SensorResolution.THE_400_P)
-right = pipeline.create(dai.node.MonoCamera)
-right.setResolution(dai.MonoCameraProperties.SensorResolution.THE_400_P)
-right.setBoardSocket(dai.CameraBoardSocket.RIGHT)
-
-# Setup stereodepth pipeline (with left and right camera as input)
-stereo = pipeline.create(dai.node.StereoDepth)
-left.out.link(stereo.left)
-right.out.link(stereo.right)
-
-# Set settings to get a better depth image
-stereo.setLeftRightCheck(True)
-stereo.setExtendedDisparity(False)
-stereo.setSubpixel(False)
-stereo.setDefaultProfilePreset(dai.node.StereoDepth.PresetMode.HIGH_ACCURACY)
-stereo.initialConfig.setMedianFilter(dai.MedianFilter.KERNEL_7x7)
-
-# Configure stereo pipeline
-config = stereo.initialConfig.get()
-config.postProcessing.speckleFilter.enable = False
-config.postProcessing.speckleFilter.speckleRange = 50
-config.postProcessing.temporalFilter.enable = True
-config.postProcessing.spatialFilter.enable = True
-config.postProcessing.spatialFilter.holeFillingRadius = 2
-config.postProcessing.spatialFilter.numIterations = 1
-config.postProcessing.thresholdFilter.minRange = 400
-config.postProcessing.thresholdFilter.maxRange = 15000
-config.postProcessing.decimationFilter.decimationFactor = 1
-stereo.initialConfig.set(config)
-
-# Setup output pipeline (with stereodepth as input)
-depthOut = pipeline.create(dai.node.XLinkOut)
-depthOut.setStreamName("depth")
-stereo.depth.link(depthOut.input)
+# Setup the stereo depth pipeline (see ModelSetup.py)
+pipeline = createDepthPipeline(settings)
 
 
 ############################## Setting Processing ##############################
 
-# Process the settings to create a grid
-w, h = int(resolution[0]/GRID_COLUMNS), int(resolution[1]/GRID_ROWS)
-grid = [((c*w, r*h), ((c+1)*w, (r+1)*h)) for r in range(GRID_ROWS) for c in range(GRID_COLUMNS)]
+# The decimation filter of the camera reduces the resolution of the depth frames
+device_decimation = getDeviceDecimation(settings)
+resolution = getDeviceResolution(settings)
 
-# Process the settings to create subplots
-fig, axes = plt.subplots(nrows=GRID_ROWS, ncols=GRID_COLUMNS, sharey=True, sharex=True)
-axes = list(chain.from_iterable(axes))
+# Measure the latency of every stage
+latency = LatencyMonitor(export_path=LATENCY_EXPORT)
+
+# Camera intrinsics for the step detector (read from the device, the default field of view is used until then)
+intrinsics = None
+
+# Process the settings to create the model (and grid), with the current values (e.g. the measure selected with 'm')
+def createModel():
+    model = createSessionModel({name: globals()[name] for name in DEFAULT_SETTINGS}, resolution, device_decimation, intrinsics)
+    model.latency = latency
+    return model
+
+# Start the dashboard (in a separate process) to plot the data
+def startDashboard():
+    dashboard = DashboardPublisher(GRID_ROWS, GRID_COLUMNS, BIN_SIZE)
+    dashboard.startDashboard()
+    return dashboard
+
+model = createModel()
+dashboard = startDashboard() if PLOT_DATA else None
 
 # Create the window to display depth frame
 if VISUALIZE_MODEL:
@@ -234,75 +127,183 @@ if VISUALIZE_MODEL:
         cv2.setWindowProperty("depth", cv2.WND_PROP_FULLSCREEN, cv2.WINDOW_FULLSCREEN)
     else:
         cv2.namedWindow("depth")
-center_point = (resolution[0] // 2, resolution[1] // 2)
+renderer = Renderer(model, colormap, RENDER_RATE)
 
 
 ############################## Initialize SleeveHandler ##############################
 
-sleeveHandler = SleeveHandler()
+sleeveHandler = SleeveHandler(commands_dir=SLEEVE_COMMANDS_DIR)
 sleeveHandler.setLeftHandMode(LEFT_HANDED)
+sleeveHandler.latency = latency
+sleeveHandler.preloadCommands(getCommands(model))
+
+
+############################## Reloading the Settings ##############################
+
+# Reload the settings file and replace the model, renderer and command registry (between two frames)
+# The camera pipeline keeps running, the new model is used from the next frame on
+# The new model is tried on the current depth frame first, the old model is kept when it fails
+def reloadSettings(depthFrame):
+    global model, renderer, dashboard
+    previous_values = settings.values
+    try:
+        changed = settings.reload()
+    except ValueError as e:
+        print("\nSettings not reloaded: {}".format(e))
+        return
+
+    restart = changed & RESTART_SETTINGS
+    if restart:
+        print("\nSettings only used after a restart: " + ", ".join(sorted(restart)))
+    changed -= restart
+    if not changed: return
+    print("\nReloaded settings: " + ", ".join(sorted(changed)))
+    previous = {name: globals()[name] for name in changed}
+    globals().update({name: settings[name] for name in changed})
+
+    # Build the new model (grid, groups and tables) and renderer, and encode the commands, before anything is replaced
+    try:
+        newModel = createModel()
+        newModel.process(depthFrame if depthFrame is not None else np.zeros((resolution[1], resolution[0]), dtype=np.uint16))
+    except Exception as e:
+        print("Settings not applied: {!r}".format(e))
+        # Keep the running settings, the next reload is compared against them
+        globals().update(previous)
+        settings.values = previous_values
+        return
+    newRenderer = Renderer(newModel, colormap, RENDER_RATE)
+    sleeveHandler.setLeftHandMode(LEFT_HANDED)
+    sleeveHandler.reloadCommands(getCommands(newModel), SLEEVE_COMMANDS_DIR)
+
+    model, renderer = newModel, newRenderer
+    if THREADED_PIPELINE:
+        modelPipeline.max_frame_age = MAX_FRAME_AGE
+        modelPipeline.setModel(model)
+    latency.export_path = LATENCY_EXPORT
+
+    # Restart the dashboard when the histograms changed shape
+    if changed & {"PLOT_DATA", "GRID_ROWS", "GRID_COLUMNS", "BIN_SIZE"}:
+        if dashboard is not None: dashboard.close()
+        dashboard = startDashboard() if PLOT_DATA else None
+
+# Reload the settings when the settings file changed (checked at most every second)
+next_settings_check = 0
+def checkSettings(depthFrame):
+    global next_settings_check
+    current_time = time.monotonic()
+    if current_time < next_settings_check: return
+    next_settings_check = current_time + 1
+    if settings.hasChanged(): reloadSettings(depthFrame)
 
 
 ############################## Running the Model ##############################
 
 # Initialize the device and pipelines
 with dai.Device(pipeline, usb2Mode=USB_2_MODE) as device:
+    # The depth frame is aligned to the right camera
+    intrinsics = device.readCalibration().getCameraIntrinsics(dai.CameraBoardSocket.RIGHT, *resolution)
+    if model.stepDetector is not None:
+        model.stepDetector.setIntrinsics(intrinsics)
+
     # Define queue to retrieve frames from
     depthQueue = device.getOutputQueue(name="depth", maxSize=4, blocking=False)
-
-    # Initialize variable for frame counter
+    # The frames are copied once into the ring, all stages use views of the ring
+    frameRing = None
+    if FRAME_RING_SIZE > 0:
+        frameRing = FrameRing((resolution[1], resolution[0]), FRAME_RING_SIZE, SHARE_FRAMES)
+        if SHARE_FRAMES: print("Shared frames: " + frameRing.name)
+    frameSource = DepthAIFrameSource(depthQueue, frameRing)
+    # With the threaded pipeline, the capture stage keeps writing into the ring while a frame is rendered,
+    # so the main thread renders and stores a copy of the frame (see FrameRing.copyFrame)
+    renderFrame = None
+    if THREADED_PIPELINE and frameRing is not None:
+        renderFrame = np.empty((resolution[1], resolution[0]), dtype=np.uint16)
+
+    # Initialize the session recorder (started when RECORD_SESSION is enabled)
+    recorder = None
+
+    # Record the session (the frames are written in the background)
+    def recordFrame(depthFrame, timestamp):
+        activeRecorder = recorder
+        if activeRecorder is not None:
+            activeRecorder.write(depthFrame, timestamp)
+
+    # Run the capture, model and sleeve stages in separate threads, the results are rendered here
+    if THREADED_PIPELINE:
+        modelPipeline = ModelPipeline(frameSource, model, sleeveHandler, MAX_FRAME_AGE, latency, frameRing)
+        modelPipeline.captureHandlers.append(recordFrame)
+        modelPipeline.start()
+
+    # Initialize variables for frame counters
+    frame_index = 0
     frame_count = 0
     start_time = time.monotonic()
-    
+    torn_frames = 0
+    depthFrame = None
 
     while True:
-        # Get new frame
-        depth = depthQueue.get()
-        depthFrame = np.array(depth.getFrame())
+        if THREADED_PIPELINE:
+            # Get the newest result of the model (at the render rate)
+            if VISUALIZE_MODEL: renderer.wait()
+            result = modelPipeline.getResult(timeout=1)
+            if result is None:
+                # The pipeline stopped after a stage failed (the error is printed by the pipeline)
+                if modelPipeline.error is not None: break
+                # Keep the window responsive and the settings checked while there are no new results
+                if VISUALIZE_MODEL:
+                    key = cv2.waitKey(1)
+                    if key == ord('q'): break
+                    elif key == ord('l'): reloadSettings(depthFrame)
+                checkSettings(depthFrame)
+                continue
+        else:
+            # Get new frame
+            depthFrame, timestamp = frameSource.read()
+            latency.record("capture", frameSource.now() - timestamp)
+            recordFrame(depthFrame, timestamp)
+
+            # Process the frame into danger values (per cell) and get the output signal and arrow
+            result = ModelResult(depthFrame, timestamp, *model.process(depthFrame))
+
+            if result.command != "":
+                sleeveHandler.processSignal(result.command, result.intensity)
+                latency.record("end_to_end", frameSource.now() - timestamp)
+
+        depthFrame, timestamp, values, danger_levels, command, intensity, endpoint = result
+
+        # Copy the frame out of the ring, drop it when its slot was already overwritten by the capture stage
+        if renderFrame is not None:
+            if not frameRing.copyFrame(depthFrame, timestamp, renderFrame):
+                torn_frames += 1
+                continue
+            depthFrame = renderFrame
 
         # Store a snapshot of the data after 100 frames
-        if CREATE_SNAPSHOT and frame_count >= 100:
+        if CREATE_SNAPSHOT and frame_index >= 100:
             with open("stored_depthFrame.bin", "wb") as file:
                 np.save(file, depthFrame, allow_pickle=True)
-            time.sleep(1)
             CREATE_SNAPSHOT = False
 
-
-        # Process the data into blocks
-        blocks = blockshaped(depthFrame, h, w)
-        # Drop all zeroes from data
-        blocks = np.array(list(map(lambda block: block[block > 0], blocks)), dtype=object)
-        # Process the blocks into singular danger values (per block)
-        values = list(map(measure, blocks))
-
-        # Get output signal and arrow
-        danger_levels = list(map(setGridSignals, values))
-        command, intensity, endpoint = getOutputSignal(danger_levels, center_point)
-
-        if command != "":
-            sleeveHandler.processSignal(command, intensity)
-
-
-        if VISUALIZE_MODEL:
-            # Process the frame to be shown
-            depthFrameColor = cv2.normalize(depthFrame, None, 255, 0, cv2.NORM_INF, cv2.CV_8UC1)
-            depthFrameColor = cv2.equalizeHist(depthFrameColor)
-            depthFrameColor = cv2.applyColorMap(depthFrameColor, cv2.COLORMAP_OCEAN)
-
-            # Display the grid layout and information
-            if SHOW_GRID:
-                for i, (pos, size) in enumerate(grid):
-                    color = colormap[danger_levels[i]]
-                    cv2.putText(depthFrameColor, str(values[i]), (pos[0]+5, size[1]-5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color)
-                    cv2.rectangle(depthFrameColor, pos, size, color, cv2.FONT_HERSHEY_SIMPLEX)
-
-            # Display the depthframe
-            if SHOW_ARROW:
-                if endpoint != center_point:
-                    cv2.arrowedLine(depthFrameColor, center_point, endpoint, colormap[intensity], 3)
-                elif command != "":
-                    cv2.circle(depthFrameColor, center_point, 10, colormap[intensity], 3)
+        # Start or stop recording the session
+        if RECORD_SESSION and recorder is None:
+            os.makedirs("./recordings", exist_ok=True)
+            filename = "./recordings/session-" + str(time.strftime("%d_%m_%Y-%H_%M_%S")) + EXTENSION
+            print("\nRecording Session:\n" + filename)
+            recorder = DepthRecorder(filename, depthFrame.shape, compress=RECORD_COMPRESSION)
+        elif not RECORD_SESSION and recorder is not None:
+            print("\nStopped Recording ({} frames dropped)".format(recorder.dropped))
+            threading.Thread(target=recorder.close).start()
+            recorder = None
+
+
+        if VISUALIZE_MODEL and renderer.isDue():
+            # Render the frame with the grid layout and information, and the output arrow
+            render_start = time.perf_counter()
+            depthFrameColor = renderer.render(depthFrame, values, danger_levels, command, intensity, endpoint, SHOW_GRID, SHOW_ARROW)
+            if SHOW_LATENCY:
+                renderer.drawLines(depthFrameColor, latency.getOverlayLines())
             cv2.imshow("depth", depthFrameColor)
+            latency.record("render", time.perf_counter() - render_start)
 
             # Wait for 'q' keypress on the depth frame window to close
             key = cv2.waitKey(1)
@@ -314,6 +315,18 @@ with dai.Device(pipeline, usb2Mode=USB_2_MODE) as device:
                 SHOW_GRID = not SHOW_GRID
             elif key == ord('s'):               # Save snapshot of camera data
                 CREATE_SNAPSHOT = not CREATE_SNAPSHOT
+            elif key == ord('r'):               # Toggle recording of the session
+                RECORD_SESSION = not RECORD_SESSION
+            elif key == ord('t'):               # Toggle latency overlay
+                SHOW_LATENCY = not SHOW_LATENCY
+            elif key == ord('l'):               # Reload the settings file
+                reloadSettings(depthFrame)
+            elif key == ord('m'):               # Select the next cell measure
+                CELL_MEASURE = getNextMeasure(model.measure_name)
+                model.setMeasure(CELL_MEASURE)
+                print("\nCell measure: " + CELL_MEASURE)
+            elif key == ord('b'):               # Time the cell measures on the current frame
+                print("\n" + getBenchmarkReport(benchmarkMeasures(model.cellStatistics, model.decimate(depthFrame), repeat=10, reference=model.measure_name), model.measure_name))
             elif key == ord('p'):               # Save screenshot
                 filename = "./screenshots/screenshot-" + str(time.strftime("%d_%m_%Y-%H_%M_%S")) + ".png"
                 print("\nSaving Screenshot:\n" + filename)
@@ -321,20 +334,36 @@ with dai.Device(pipeline, usb2Mode=USB_2_MODE) as device:
                 time.sleep(1)
 
 
-        if PLOT_DATA:
-            # Plot the density graph per box
-            for i, block in enumerate(blocks):
-                sns.kdeplot(np.array(block), ax=axes[i])
-
-            # Wait 1 second before plotting new values
-            plt.pause(1)
+        if PLOT_DATA and dashboard.isDue():
+            # Publish the histogram of every cell to the dashboard
+            dashboard.publish(model.cellStatistics.histogram(model.decimate(depthFrame)), values, danger_levels)
 
 
-        # Update frame counter
+        # Update frame counters
+        frame_index += 1
         frame_count += 1
 
-        # Print frame rate
+        # Print the frame rate and latency report, and export the latency
         current_time = time.monotonic()
-        if (current_time - start_time) > 1 and (frame_count % 10 == 0):
-            print("FPS: {:.2f}".format(10 / (current_time - start_time)), end="\r")
-            start_time = current_time
\ No newline at end of file
+        if (current_time - start_time) > LATENCY_REPORT_INTERVAL:
+            print("\nFPS: {:.2f}".format(frame_count / (current_time - start_time)), end="")
+            if THREADED_PIPELINE:
+                print(" (model: {processed}, dropped: {dropped}, stale: {stale}, torn: {torn}, torn before rendering: {render_torn})".format(
+                    render_torn=torn_frames, **modelPipeline.getStatistics()), end="")
+            print("\n" + latency.getReport())
+            frame_count = 0
+            start_time = current_time
+        latency.update()
+
+        checkSettings(depthFrame)
+
+    # Stop the pipeline and finish the recording of the session
+    if THREADED_PIPELINE:
+        modelPipeline.stop()
+        if modelPipeline.error is not None: print("\nStopped: " + modelPipeline.error)
+    if recorder is not None:
+        recorder.close()
+    if dashboard is not None:
+        dashboard.close()
+    if frameRing is not None:
+        frameRing.close()
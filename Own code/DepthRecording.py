@@ -0,0 +1,257 @@
+import queue
+import struct
+import threading
+import zlib
+
+import numpy as np
+
+'''
+Recording format for depth sessions (.drec)
+
+  The file starts with a header, followed by chunks of frames and ends with an index:
+    header:  magic, version, frame height, frame width, frames per chunk
+    chunk:   magic, frame count, compression, payload size, timestamps (float64), payload
+    index:   magic, chunk count, (offset, frame count, compression, payload size) per chunk
+    footer:  index offset, magic
+
+  The payload contains the uint16 frames of the chunk, either raw or compressed with zlib (lossless).
+  Raw payloads are aligned, such that the frames can be read directly from the memory-mapped file.
+  When the index is missing (e.g. the recording was interrupted), it is rebuilt by scanning the chunks.
+'''
+
+EXTENSION = ".drec"
+
+HEADER = struct.Struct("<8sHIII")
+HEADER_MAGIC = b"DEPTHREC"
+VERSION = 1
+
+CHUNK = struct.Struct("<4sIIQ")
+CHUNK_MAGIC = b"CHNK"
+
+INDEX = struct.Struct("<4sI")
+INDEX_ENTRY = struct.Struct("<QIIQ")
+INDEX_MAGIC = b"INDX"
+
+FOOTER = struct.Struct("<Q8s")
+FOOTER_MAGIC = b"DRECINDX"
+
+# Compression modes
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+
+ALIGNMENT = 64
+DTYPE = np.dtype("<u2")
+
+
+def _padding(offset):
+    return -offset % ALIGNMENT
+
+
+class DepthRecorder:
+    """
+    Records depth frames into a chunked recording file.
+
+    Frames are copied into preallocated chunk buffers, full chunks are handed to a
+    background writer thread, so write never blocks the frame loop and does not allocate.
+    At most `max_pending` frames wait for the writer, if the writer can not keep up, the
+    frame is dropped and counted in `dropped`.
+    """
+
+    def __init__(self, path, shape, chunk_size=30, compress=False, compression_level=1, max_pending=64):
+        self.path = path
+        self.shape = shape
+        self.chunk_size = chunk_size
+        self.compression = COMPRESSION_ZLIB if compress else COMPRESSION_NONE
+        self.compression_level = compression_level
+
+        self.file = open(path, "wb")
+        self.file.write(HEADER.pack(HEADER_MAGIC, VERSION, shape[0], shape[1], chunk_size))
+        self.chunks = []
+
+        self.written = 0
+        self.dropped = 0
+
+        # Chunk buffers (frames and timestamps), the current chunk is filled by write
+        chunk_count = max(-(-max_pending // chunk_size), 1) + 1
+        self.buffers = queue.Queue()
+        for _ in range(chunk_count):
+            self.buffers.put((np.empty((chunk_size,) + tuple(shape), dtype=DTYPE), np.empty(chunk_size, dtype="<f8")))
+        self.chunk = None
+        self.chunk_frames = 0
+        # The recording may be closed from another thread than the frame loop
+        self.lock = threading.Lock()
+        self.closing = False
+
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name="DepthRecorder", daemon=True)
+        self.thread.start()
+
+    # Add a frame to the recording (without blocking)
+    def write(self, frame, timestamp):
+        assert frame.shape == self.shape, f"Expected frame of shape {self.shape}, got {frame.shape}"
+        with self.lock:
+            if self.closing: return
+            if self.chunk is None:
+                try:
+                    self.chunk = self.buffers.get_nowait()
+                except queue.Empty:
+                    self.dropped += 1
+                    return
+
+            frames, timestamps = self.chunk
+            np.copyto(frames[self.chunk_frames], frame, casting="unsafe")
+            timestamps[self.chunk_frames] = timestamp
+            self.chunk_frames += 1
+            if self.chunk_frames == self.chunk_size:
+                self._flushChunk()
+
+    # Hand the current chunk to the writer thread
+    def _flushChunk(self):
+        if self.chunk is None: return
+        self.queue.put((self.chunk, self.chunk_frames))
+        self.chunk = None
+        self.chunk_frames = 0
+
+    # Finish the recording, writes all pending frames and the index
+    def close(self):
+        with self.lock:
+            if self.closing: return
+            self.closing = True
+            self._flushChunk()
+            self.queue.put(None)
+        self.thread.join()
+
+        # Write the index and footer
+        index_offset = self.file.tell()
+        self.file.write(INDEX.pack(INDEX_MAGIC, len(self.chunks)))
+        for entry in self.chunks:
+            self.file.write(INDEX_ENTRY.pack(*entry))
+        self.file.write(FOOTER.pack(index_offset, FOOTER_MAGIC))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Writer thread, writes the full chunks and returns their buffers
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None: return
+
+            (frames, timestamps), count = item
+            self._writeChunk(frames[:count], timestamps[:count])
+            self.buffers.put((frames, timestamps))
+
+    def _writeChunk(self, frames, timestamps):
+        # The frames are written from the chunk buffer (contiguous), without an intermediate copy
+        payload = memoryview(frames).cast("B")
+        if self.compression == COMPRESSION_ZLIB:
+            payload = zlib.compress(payload, self.compression_level)
+
+        offset = self.file.tell()
+        self.file.write(CHUNK.pack(CHUNK_MAGIC, len(frames), self.compression, len(payload)))
+        self.file.write(timestamps.tobytes())
+        self.file.write(bytes(_padding(self.file.tell())))
+        self.file.write(payload)
+        self.file.flush()
+
+        self.chunks.append((offset, len(frames), self.compression, len(payload)))
+        self.written += len(frames)
+
+
+class DepthRecording:
+    """
+    Random-access reader for a chunked recording file.
+
+    The file is memory-mapped, so only the accessed frames are loaded. Frames of
+    raw chunks are returned as read-only views of the file, compressed chunks are
+    decompressed when accessed (the last chunk is cached).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.data = np.memmap(path, dtype=np.uint8, mode="r")
+
+        magic, version, height, width, self.chunk_size = HEADER.unpack_from(self.data, 0)
+        assert magic == HEADER_MAGIC, f"{path} is not a depth recording"
+        assert version == VERSION, f"Unsupported recording version {version}"
+        self.shape = (height, width)
+
+        self.chunks = self._readIndex()
+        if self.chunks is None: self.chunks = self._scanChunks()
+
+        # Build the frame index: timestamps and the chunk of every frame
+        timestamps, chunk_of_frame = [], []
+        self.payload_offsets = []
+        for i, (offset, count, compression, size) in enumerate(self.chunks):
+            start = offset + CHUNK.size
+            timestamps.append(np.frombuffer(self.data, dtype="<f8", count=count, offset=start))
+            chunk_of_frame.append(np.full(count, i))
+            start += count * 8
+            self.payload_offsets.append(start + _padding(start))
+        self.timestamps = np.concatenate(timestamps) if timestamps else np.zeros(0)
+        self.chunk_of_frame = np.concatenate(chunk_of_frame).astype(np.intp) if chunk_of_frame else np.zeros(0, np.intp)
+        self.first_frame = np.cumsum([0] + [chunk[1] for chunk in self.chunks])
+
+        self.cached_chunk = None, None
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    # Get a single frame, by index
+    def __getitem__(self, index):
+        if index < 0: index += len(self)
+        if not 0 <= index < len(self): raise IndexError("frame index out of range")
+
+        chunk = self.chunk_of_frame[index]
+        return self._readChunk(chunk)[index - self.first_frame[chunk]]
+
+    # Get the index of the first frame at (or after) the timestamp
+    def seek(self, timestamp):
+        return int(np.searchsorted(self.timestamps, timestamp))
+
+    def close(self):
+        self.cached_chunk = None, None
+        self.data = None
+
+    def _readChunk(self, chunk):
+        offset, count, compression, size = self.chunks[chunk]
+        start = self.payload_offsets[chunk]
+        shape = (count,) + self.shape
+
+        if compression == COMPRESSION_NONE:
+            return np.ndarray(shape, dtype=DTYPE, buffer=self.data, offset=start)
+
+        if self.cached_chunk[0] != chunk:
+            payload = zlib.decompress(self.data[start:start + size])
+            frames = np.frombuffer(payload, dtype=DTYPE).reshape(shape)
+            self.cached_chunk = chunk, frames
+        return self.cached_chunk[1]
+
+    def _readIndex(self):
+        if len(self.data) < HEADER.size + FOOTER.size: return None
+        index_offset, magic = FOOTER.unpack_from(self.data, len(self.data) - FOOTER.size)
+        if magic != FOOTER_MAGIC: return None
+
+        magic, count = INDEX.unpack_from(self.data, index_offset)
+        if magic != INDEX_MAGIC: return None
+        return [INDEX_ENTRY.unpack_from(self.data, index_offset + INDEX.size + i * INDEX_ENTRY.size) for i in range(count)]
+
+    # Rebuild the index of an incomplete recording, stops at the first incomplete chunk
+    def _scanChunks(self):
+        chunks = []
+        offset = HEADER.size
+        while offset + CHUNK.size <= len(self.data):
+            magic, count, compression, size = CHUNK.unpack_from(self.data, offset)
+            if magic != CHUNK_MAGIC: break
+
+            start = offset + CHUNK.size + count * 8
+            end = start + _padding(start) + size
+            if end > len(self.data): break
+
+            chunks.append((offset, count, compression, size))
+            offset = end
+        return chunks
@@ -0,0 +1,93 @@
+import numpy as np
+
+from SleeveHandler import SleeveHandler
+
+'''
+Fusion of spatial object detections into the danger levels of the grid model
+  The YOLO spatial detection network reports a bounding box (normalized to the letterboxed network input) and the
+  spatial coordinates (in millimeters) of every detection. The fusion maps all boxes onto the cells of the grid at
+  once, converts the distance of each detection into a danger level (with the tresholds of the model, boosted per
+  class, e.g. a person is treated as closer than an obstacle at the same distance) and raises the danger level of the
+  covered cells. Set it as the detectionFusion of a GridModel and pass the detections to process.
+'''
+
+# Columns of the detection arrays (the spatial coordinates are in millimeters)
+XMIN, YMIN, XMAX, YMAX, DEPTH, LABEL, SPATIAL_X, SPATIAL_Y, CONFIDENCE = range(9)
+
+
+# Convert DepthAI spatial detections into an array (one row per detection, see the columns above)
+def toArray(detections):
+    array = np.empty((len(detections), 9))
+    for i, detection in enumerate(detections):
+        coords = detection.spatialCoordinates
+        array[i] = (detection.xmin, detection.ymin, detection.xmax, detection.ymax, coords.z, detection.label, coords.x, coords.y, detection.confidence)
+    return array
+
+
+class DetectionFusion:
+    """
+    Raises the danger levels of the grid cells covered by a detection.
+
+    The distance of a detection is converted into a cell value (in bins), minus the boost
+    of its class (in bins), and into a danger level with the level table of the model.
+    Every cell gets the highest of its own danger level and the levels of the detections
+    covering it. A box covers a cell when it overlaps at least `min_overlap` of the cell
+    (in both directions). With `letterbox` (the resolution of the frame before it was
+    squeezed into the square network input), the black bars are removed from the boxes.
+    Detections without depth (z of 0) are ignored. The boxes are mapped directly onto the
+    grid, so the depth frames have to be aligned to the rgb camera (setDepthAlign), with
+    the same aspect ratio as the rgb frame.
+    """
+
+    def __init__(self, model, class_boosts=None, labels=None, letterbox=None, min_overlap=0.25, label_count=80):
+        self.model = model
+        self.min_overlap = min_overlap
+
+        # Boost (in bins) of every label, the classes can be given by name when the labels are given
+        self.boosts = np.zeros(label_count, dtype=np.int64)
+        for label, boost in (class_boosts or {}).items():
+            self.boosts[labels.index(label) if isinstance(label, str) else label] = boost
+
+        # Offset and scale of the letterboxed axis (x for portrait, y for landscape frames)
+        self.axis, self.offset, self.scale = None, 0.0, 1.0
+        if letterbox is not None:
+            width, height = letterbox
+            self.axis = (YMIN, YMAX) if width > height else (XMIN, XMAX)
+            self.scale = min(width, height) / max(width, height)
+            self.offset = (1 - self.scale) / 2
+
+        # Edges of the cells (normalized), the overlap is compared to min_overlap of a cell
+        self.column_edges = np.arange(model.grid_columns + 1) / model.grid_columns
+        self.row_edges = np.arange(model.grid_rows + 1) / model.grid_rows
+
+    # Get the fraction of each cell (per axis) covered by each box, shape (detections, cells along the axis)
+    def getOverlap(self, low, high, edges):
+        overlap = np.minimum(high[:, None], edges[None, 1:]) - np.maximum(low[:, None], edges[None, :-1])
+        return np.maximum(overlap, 0) * (len(edges) - 1)
+
+    # Get the mask of the cells covered by each detection, shape (detections, cells)
+    def getCoverage(self, detections):
+        boxes = detections[:, :4]
+        if self.axis is not None:
+            boxes = boxes.copy()
+            boxes[:, self.axis] = np.clip((boxes[:, self.axis] - self.offset) / self.scale, 0, 1)
+
+        columns = self.getOverlap(boxes[:, XMIN], boxes[:, XMAX], self.column_edges) >= self.min_overlap
+        rows = self.getOverlap(boxes[:, YMIN], boxes[:, YMAX], self.row_edges) >= self.min_overlap
+        return (rows[:, :, None] & columns[:, None, :]).reshape(len(detections), -1)
+
+    # Get the danger level of each detection
+    def getDetectionLevels(self, detections):
+        model = self.model
+        values = detections[:, DEPTH].astype(np.int64) // model.bin_size - self.boosts[detections[:, LABEL].astype(np.int64)]
+        values = np.clip(values, 0, model.cellStatistics.bin_count - 1)
+        levels = model.level_table[values + 1]
+        levels[detections[:, DEPTH] <= 0] = SleeveHandler.OFF
+        return levels
+
+    # Raise the danger levels of the cells covered by the detections (an array, see toArray), returns the fused levels
+    def fuse(self, danger_levels, detections):
+        if len(detections) == 0: return danger_levels
+        coverage = self.getCoverage(detections)
+        levels = np.where(coverage, self.getDetectionLevels(detections)[:, None], SleeveHandler.OFF).max(axis=0)
+        return np.maximum(danger_levels, levels)
@@ -7,6 +7,8 @@ import depthai as dai
 import numpy as np
 import time
 
+from StreamSync import StreamSync
+
 '''
 Spatial Tiny-yolo example
   Performs inference on RGB camera and retrieves spatial location coordinates: x,y,z relative to the center of depth map.
@@ -130,15 +132,24 @@ with dai.Device(pipeline, usb2Mode=True) as device:
     xoutBoundingBoxDepthMappingQueue = device.getOutputQueue(name="boundingBoxDepthMapping", maxSize=4, blocking=False)
     depthQueue = device.getOutputQueue(name="depth", maxSize=4, blocking=False)
 
+    # Match the messages of the queues by timestamp (the bounding box mapping is only sent when there are detections)
+    streamSync = StreamSync(
+        {"detections": detectionNNQueue, "rgb": previewQueue, "depth": depthQueue, "boundingBoxDepthMapping": xoutBoundingBoxDepthMappingQueue},
+        conditional={"boundingBoxDepthMapping": lambda bundle: len(bundle["detections"].detections) != 0})
+
     startTime = time.monotonic()
     counter = 0
     fps = 0
     color = (255, 255, 255)
 
     while True:
-        inPreview = previewQueue.get()
-        inDet = detectionNNQueue.get()
-        depth = depthQueue.get()
+        bundle = streamSync.get(timeout=0.1)
+        if bundle is None:
+            # Keep the windows responsive while waiting for matching messages
+            if cv2.waitKey(1) == ord('q'):
+                break
+            continue
+        inPreview, inDet, depth = bundle["rgb"], bundle["detections"], bundle["depth"]
 
         frame = inPreview.getCvFrame()
         depthFrame = depth.getFrame() # depthFrame values are in millimeters
@@ -156,7 +167,7 @@ with dai.Device(pipeline, usb2Mode=True) as device:
 
         detections = inDet.detections
         if len(detections) != 0:
-            boundingBoxMapping = xoutBoundingBoxDepthMappingQueue.get()
+            boundingBoxMapping = bundle["boundingBoxDepthMapping"]
             roiDatas = boundingBoxMapping.getConfigData()
 
             for roiData in roiDatas:
@@ -214,3 +225,5 @@ with dai.Device(pipeline, usb2Mode=True) as device:
 
         if cv2.waitKey(1) == ord('q'):
             break
+
+    print(streamSync.getReport())
@@ -0,0 +1,189 @@
+import argparse
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+'''
+Ring of preallocated depth frame buffers, shared by the stages of the depth model
+  The capture stage copies every frame once into the next slot of the ring, the model, recorder, renderer and snapshot
+  all read that slot through a (read-only) view, instead of allocating a copy of every frame. With shared memory,
+  diagnostics in other processes can read the newest frame as well, e.g.:
+    python "Own code/FrameRing.py" <name>
+'''
+
+# Layout of the header: slot count, frame height, frame width, number of written frames
+HEADER_SIZE = 4
+DTYPE = np.uint16
+
+
+# Create numpy views of the buffer: header, frame number of every slot, timestamp of every slot, frames
+def getArrays(buffer, size, shape):
+    header = np.ndarray(HEADER_SIZE, dtype=np.int64, buffer=buffer)
+    numbers = np.ndarray(size, dtype=np.int64, buffer=buffer, offset=header.nbytes)
+    timestamps = np.ndarray(size, dtype=np.float64, buffer=buffer, offset=header.nbytes + numbers.nbytes)
+    frames = np.ndarray((size,) + tuple(shape), dtype=DTYPE, buffer=buffer, offset=header.nbytes + 2 * numbers.nbytes)
+    return header, numbers, timestamps, frames
+
+def getSize(size, shape):
+    return 8 * (HEADER_SIZE + 2 * size) + size * int(np.prod(shape)) * np.dtype(DTYPE).itemsize
+
+
+class FrameRing:
+    """
+    Preallocated ring of `size` depth frame buffers, optionally in shared memory.
+
+    write copies a frame into the oldest slot and returns a read-only view of the slot,
+    which is passed to all consumers instead of a copy. A slot is reused after `size`
+    frames, so the ring should be larger than the number of frames in flight (queued or
+    being processed, see ModelPipeline). Consumers that keep a frame longer (e.g. the
+    recorder) copy it into their own preallocated buffers. Every slot stores the number
+    of its frame (-1 while it is written), so isValid tells whether a frame was
+    overwritten and readers in other processes can detect torn copies. The model stage
+    checks the number of its frame (getNumber) again after processing and discards the
+    result when the slot was overwritten. The renderer uses a frame while the capture
+    stage keeps writing, so it takes a copy with copyFrame, which reports frames that
+    were overwritten (torn copies are dropped).
+    """
+
+    def __init__(self, shape, size=8, shared=False, name=None):
+        self.shape = tuple(shape)
+        self.size = size
+
+        self.memory = None
+        if shared or name is not None:
+            self.memory = shared_memory.SharedMemory(name=name, create=True, size=getSize(size, self.shape))
+            buffer = self.memory.buf
+        else:
+            buffer = bytearray(getSize(size, self.shape))
+        self.header, self.numbers, self.timestamps, self.frames = getArrays(buffer, size, self.shape)
+        self.header[:] = [size, self.shape[0], self.shape[1], 0]
+        self.numbers[:] = -1
+
+        # Read-only views of the slots, handed to the consumers
+        self.views = self.frames.view()
+        self.views.flags.writeable = False
+
+    @property
+    def name(self):
+        return None if self.memory is None else self.memory.name
+
+    # Number of the newest frame (-1 if there are no frames yet)
+    @property
+    def latest(self):
+        return int(self.header[3]) - 1
+
+    # Copy a frame into the next slot, returns the view of the slot
+    def write(self, frame, timestamp):
+        number = int(self.header[3])
+        slot = number % self.size
+
+        self.numbers[slot] = -1
+        np.copyto(self.frames[slot], frame, casting="unsafe")
+        self.timestamps[slot] = timestamp
+        self.numbers[slot] = number
+        self.header[3] = number + 1
+        return self.views[slot]
+
+    # Check whether the frame is still stored in the ring (not overwritten)
+    def isValid(self, number):
+        return number >= 0 and int(self.numbers[number % self.size]) == number
+
+    # Get the view and timestamp of a frame, None if it was overwritten
+    def getFrame(self, number):
+        if not self.isValid(number): return None
+        slot = number % self.size
+        return self.views[slot], float(self.timestamps[slot])
+
+    # Get the slot of a view returned by write
+    def getSlot(self, view):
+        return (view.ctypes.data - self.frames.ctypes.data) // self.frames[0].nbytes
+
+    # Get the number of the frame in a view returned by write (with its timestamp), -1 if the slot was overwritten
+    def getNumber(self, view, timestamp):
+        slot = self.getSlot(view)
+        number = int(self.numbers[slot])
+        if number < 0 or float(self.timestamps[slot]) != timestamp: return -1
+        return number
+
+    # Copy a frame (a view returned by write, with its timestamp) into out, returns False if the slot was overwritten
+    # before or during the copy (the copy is then torn and should be dropped)
+    def copyFrame(self, view, timestamp, out):
+        number = self.getNumber(view, timestamp)
+        if number < 0: return False
+        np.copyto(out, view)
+        return self.isValid(number)
+
+    def close(self):
+        if self.memory is None: return
+        del self.header, self.numbers, self.timestamps, self.frames, self.views
+        self.memory.unlink()
+        try:
+            self.memory.close()
+        except BufferError:
+            # Views of the frames are still in use, the memory is released together with them
+            pass
+        self.memory = None
+
+
+class FrameRingReader:
+    """
+    Reads the newest frame of a FrameRing in shared memory (from another process).
+    """
+
+    def __init__(self, name):
+        self.memory = shared_memory.SharedMemory(name=name)
+        # The memory is owned (and removed) by the FrameRing
+        resource_tracker.unregister(self.memory._name, "shared_memory")
+
+        header = np.ndarray(HEADER_SIZE, dtype=np.int64, buffer=self.memory.buf)
+        self.size, height, width, _ = (int(value) for value in header)
+        self.shape = (height, width)
+        self.header, self.numbers, self.timestamps, self.frames = getArrays(self.memory.buf, self.size, self.shape)
+        self.last_frame = -1
+
+    # Get a copy of the newest frame (number, frame, timestamp), None if there is no new frame or it was being written
+    def read(self, retries=3):
+        for _ in range(retries):
+            number = int(self.header[3]) - 1
+            if number < 0 or number == self.last_frame: return None
+
+            slot = number % self.size
+            frame, timestamp = self.frames[slot].copy(), float(self.timestamps[slot])
+            if int(self.numbers[slot]) == number:
+                self.last_frame = number
+                return number, frame, timestamp
+        return None
+
+    def close(self):
+        del self.header, self.numbers, self.timestamps, self.frames
+        self.memory.close()
+
+
+############################## Frame Diagnostics ##############################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print statistics of the frames in a shared FrameRing")
+    parser.add_argument("name", help="Name of the shared memory of the FrameRing")
+    parser.add_argument("--interval", type=float, default=1, help="Seconds between the printed statistics")
+    args = parser.parse_args()
+
+    reader = FrameRingReader(args.name)
+    print("Attached to {} ({} slots of {}x{})".format(args.name, reader.size, reader.shape[1], reader.shape[0]))
+    try:
+        last_number = int(reader.header[3]) - 1
+        while True:
+            time.sleep(args.interval)
+            data = reader.read()
+            if data is None: continue
+            number, frame, timestamp = data
+            valid = frame[frame > 0]
+            if len(valid) == 0: valid = np.zeros(1, dtype=frame.dtype)
+            print("Frame {:7d}: {:5.1f} fps, valid {:5.1%}, depth min {:5d} median {:5.0f} max {:5d}".format(
+                number, (number - last_number) / args.interval, np.count_nonzero(frame) / frame.size,
+                valid.min(), np.median(valid), valid.max()))
+            last_number = number
+    except KeyboardInterrupt:
+        pass
+    finally:
+        reader.close()
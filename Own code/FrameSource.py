@@ -0,0 +1,196 @@
+import time
+
+import numpy as np
+
+from DepthRecording import DepthRecording, EXTENSION
+
+
+class FrameSource:
+    """
+    Base class for the sources of depth frames used by the model.
+
+    A frame source returns a (depthFrame, timestamp) tuple for every call to
+    read, or None when there are no frames left. The timestamp is given in
+    seconds, using the same clock as the now function of the source.
+    """
+
+    def read(self):
+        raise NotImplementedError
+
+    # Get the current time on the clock used for the timestamps
+    def now(self):
+        return time.monotonic()
+
+    def close(self):
+        pass
+
+    def __iter__(self):
+        while True:
+            frame = self.read()
+            if frame is None: return
+            yield frame
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class DepthAIFrameSource(FrameSource):
+    """
+    Frame source reading depth messages from a (live) DepthAI output queue.
+    With a FrameRing, the frames are copied into the ring (no allocation per frame)
+    and a view of the ring is returned.
+    """
+
+    def __init__(self, queue, frameRing=None):
+        import depthai as dai
+        self.clock = dai.Clock
+        self.queue = queue
+        self.frameRing = frameRing
+
+    def read(self):
+        depth = self.queue.get()
+        timestamp = depth.getTimestamp().total_seconds()
+        if self.frameRing is not None:
+            return self.frameRing.write(depth.getFrame(), timestamp), timestamp
+        return np.array(depth.getFrame()), timestamp
+
+    def now(self):
+        return self.clock.now().total_seconds()
+
+
+class ArrayFrameSource(FrameSource):
+    """
+    Frame source replaying in-memory frames, a single frame (h, w) or a stack of frames (n, h, w).
+    The frames are replayed `repeat` times, or endlessly if repeat is None.
+    """
+
+    def __init__(self, frames, repeat=1):
+        if isinstance(frames, np.ndarray) and frames.ndim == 2: frames = frames[None]
+        self.frames = frames
+        self.shape = frames[0].shape
+        self.repeat = repeat
+        self.index = 0
+
+    def read(self):
+        if self.repeat is not None and self.index >= len(self.frames) * self.repeat:
+            return None
+
+        frame = self.frames[self.index % len(self.frames)]
+        self.index += 1
+        return frame, self.now()
+
+
+class RecordedFrameSource(ArrayFrameSource):
+    """
+    Frame source replaying recorded frames, without loading the recordings into memory.
+    Supports chunked recordings (.drec) and frames stored with np.save, such as the
+    snapshots created by Depth Model.py (stored_depthFrame.bin).
+    """
+
+    def __init__(self, paths, repeat=1):
+        if isinstance(paths, str): paths = [paths]
+        self.recordings = [self.openRecording(path) for path in paths]
+        super().__init__(ConcatenatedFrames(self.recordings), repeat)
+
+    @staticmethod
+    def openRecording(path):
+        if path.endswith(EXTENSION): return DepthRecording(path)
+
+        # Memory map the data if possible (np.save format without pickled objects)
+        try:
+            data = np.load(path, mmap_mode="r")
+        except ValueError:
+            with open(path, "rb") as file:
+                data = np.load(file, allow_pickle=True)
+        return data[None] if data.ndim == 2 else data
+
+    def close(self):
+        for recording in self.recordings:
+            if isinstance(recording, DepthRecording): recording.close()
+
+
+class ConcatenatedFrames:
+    """
+    Sequence of the frames of multiple recordings, frames are only read when accessed.
+    """
+
+    def __init__(self, recordings):
+        self.recordings = recordings
+        self.offsets = np.cumsum([0] + [len(recording) for recording in recordings])
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def __getitem__(self, index):
+        recording = np.searchsorted(self.offsets, index, side="right") - 1
+        return self.recordings[recording][index - self.offsets[recording]]
+
+
+# Generate depth frames of a simple scene (floor, back wall and moving obstacles), for testing without recordings
+def syntheticFrames(resolution=(640, 400), count=30, seed=0):
+    width, height = resolution
+    rng = np.random.default_rng(seed)
+
+    # Static background: a back wall with a floor in the lower half of the view
+    rows = np.arange(height, dtype=np.float64)[:, None]
+    horizon = height * 0.45
+    floor = 1400 * height / np.maximum(rows - horizon, 1)
+    background = np.minimum(np.broadcast_to(floor, (height, width)), rng.uniform(4000, 9000))
+
+    # Obstacles moving towards the camera
+    obstacles = rng.uniform(0, 1, size=(4, 4)) * [width, height, width / 4, height / 3]
+    distances = rng.uniform(1500, 6000, size=4)
+    speeds = rng.uniform(0, 60, size=4)
+
+    frames = np.empty((count, height, width), dtype=np.uint16)
+    for i in range(count):
+        frame = background.copy()
+        for (x, y, w, h), distance in zip(obstacles.astype(int), distances - i * speeds):
+            view = frame[y:y + h + 10, x:x + w + 10]
+            np.minimum(view, max(distance, 400), out=view)
+
+        # Add measurement noise and invalid pixels
+        frame *= rng.normal(1, 0.02, size=frame.shape)
+        frame[rng.random(frame.shape) < 0.1] = 0
+        frames[i] = np.clip(frame, 0, 15000)
+    return frames
+
+
+class SyntheticFrameSource(ArrayFrameSource):
+    """
+    Frame source replaying generated depth frames, see syntheticFrames.
+    """
+
+    def __init__(self, resolution=(640, 400), count=30, seed=0, repeat=1):
+        super().__init__(syntheticFrames(resolution, count, seed), repeat)
+
+
+class PacedFrameSource(FrameSource):
+    """
+    Frame source delivering the frames of another source at a fixed frame rate, like a
+    camera, e.g. to run synthetic or recorded frames through the pipeline in real time.
+    """
+
+    def __init__(self, source, rate=30):
+        self.source = source
+        self.shape = getattr(source, "shape", None)
+        self.interval = 1 / rate
+        self.next_time = None
+
+    def read(self):
+        now = self.source.now()
+        if self.next_time is None or now - self.next_time > self.interval:
+            # Do not catch up on frames that were missed (the reader was too slow)
+            self.next_time = now
+        time.sleep(max(self.next_time - now, 0))
+        self.next_time += self.interval
+        return self.source.read()
+
+    def now(self):
+        return self.source.now()
+
+    def close(self):
+        self.source.close()
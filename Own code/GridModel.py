@@ -0,0 +1,328 @@
+import time
+
+import numpy as np
+
+from SleeveHandler import SleeveHandler
+from CellStatistics import CellStatistics, IncrementalCellStatistics
+from CellMeasures import createMeasure
+from AdaptiveTresholds import AdaptiveTresholds
+
+
+############################## Helper Functions ##############################
+
+def blockshaped(arr, nrows, ncols):
+    """
+    This function was obtained from stack-overflow:
+    https://stackoverflow.com/a/16858283
+
+    Return an array of shape (n, nrows, ncols) where
+    n * nrows * ncols = arr.size
+
+    If arr is a 2D array, the returned array should look like n subblocks with
+    each subblock preserving the "physical" layout of arr.
+    """
+    h, w = arr.shape
+    assert h % nrows == 0, f"{h} rows is not evenly divisible by {nrows}"
+    assert w % ncols == 0, f"{w} cols is not evenly divisible by {ncols}"
+    return (arr.reshape(h//nrows, nrows, -1, ncols)
+               .swapaxes(1,2)
+               .reshape(-1, nrows, ncols))
+
+
+# Check that the frames can be split into equally sized cells, raises ValueError otherwise
+def checkGrid(resolution, grid_rows, grid_columns):
+    width, height = resolution
+    if grid_rows < 1 or grid_columns < 1:
+        raise ValueError("The grid needs at least one row and column, got {}x{}".format(grid_rows, grid_columns))
+    if width % grid_columns != 0 or height % grid_rows != 0:
+        raise ValueError("Frames of {}x{} can not be split into a grid of {} rows and {} columns".format(width, height, grid_rows, grid_columns))
+
+
+# Split a number of rows/columns into three groups (the default groups for a 5x8 grid)
+def splitGroups(count):
+    side = round(count * 0.375)
+    return list(range(side)), list(range(side, count - side)), list(range(count - side, count))
+
+
+# Region selected for each combination of regions with the highest mean (bit 0: first, bit 1: center, bit 2: last region)
+# Equal to: center if (first and last) or center, else first or last (-1 selects the empty entry of the tables)
+REGION_SELECTION = np.array([-1, 0, 1, 1, 2, 1, 1, 1])
+REGION_BITS = np.array([1, 2, 4])
+
+
+############################## Grid Model ##############################
+
+class GridModel:
+    """
+    The danger model of the depth camera, separated from the camera and the sleeve.
+
+    The model settings are passed to the constructor (the defaults are equal to
+    DEFAULT_SETTINGS in ModelSetup.py), such that the model can be run on any frame
+    source, for example recorded data without a connected device.
+    """
+
+    def __init__(self, resolution=(640, 400), grid_rows=5, grid_columns=8,
+                 h_groups=([0,1,2], [3,4], [5,6,7]), v_groups=([0,1], [2], [3,4]),
+                 bin_size=125, soft_treshold=20, medium_treshold=10, intense_treshold=6,
+                 arrow_length=100, incremental=False, refresh_interval=15, adaptive=False, decimation=1, measure="mode"):
+        self.resolution = resolution
+        self.grid_rows = grid_rows
+        self.grid_columns = grid_columns
+        self.h_left_group, self.h_center_group, self.h_right_group = h_groups
+        self.v_top_group, self.v_center_group, self.v_bottom_group = v_groups
+        self.bin_size = bin_size
+        self.soft_treshold = soft_treshold
+        self.medium_treshold = medium_treshold
+        self.intense_treshold = intense_treshold
+        self.arrow_length = arrow_length
+        self.decimation = decimation
+        self.use_incremental = incremental
+        self.refresh_interval = refresh_interval
+
+        # Process the settings to create a grid
+        checkGrid(resolution, grid_rows, grid_columns)
+        self.cell_width = int(resolution[0] / grid_columns)
+        self.cell_height = int(resolution[1] / grid_rows)
+        w, h = self.cell_width, self.cell_height
+        self.grid = [((c*w, r*h), ((c+1)*w, (r+1)*h)) for r in range(grid_rows) for c in range(grid_columns)]
+        self.center_point = (resolution[0] // 2, resolution[1] // 2)
+
+        # The cells are measured on every decimation-th pixel (in both directions) of the frame
+        d = decimation
+        sampled_shape = (grid_rows * -(-h // d), grid_columns * -(-w // d))
+        self.cellStatistics = CellStatistics(sampled_shape, grid_rows, grid_columns, bin_size)
+        # Measure of the cells (see CellMeasures.py), only recompute the cells that changed when incremental
+        self.setMeasure(measure)
+        # Derive the tresholds online from the cell values (the settings are used as base tresholds)
+        self.adaptive = AdaptiveTresholds(grid_rows * grid_columns, (soft_treshold, medium_treshold, intense_treshold)) if adaptive else None
+        # Detector of missing floor ahead (StepDetector), set by the caller as it depends on the camera intrinsics
+        self.stepDetector = None
+        # Fusion of the object detections into the danger levels (DetectionFusion), set by the caller
+        self.detectionFusion = None
+        # Monitor of the latency of the stages (LatencyMonitor), set by the caller
+        self.latency = None
+        self.compileTables()
+
+    # Compile the settings into tables, such that the output signal is computed using array operations
+    def compileTables(self):
+        # Danger level of every possible cell value (value -1 is stored at index 0)
+        values = np.arange(-1, self.cellStatistics.bin_count)
+        self.level_table = np.array([self.setGridSignals(value) for value in values])
+
+        # Membership of each cell to the horizontal (left, center, right) and vertical (top, center, bottom) regions
+        # A row/column belongs to the first group containing it
+        rows = np.arange(self.grid_rows * self.grid_columns) // self.grid_columns
+        columns = np.arange(self.grid_rows * self.grid_columns) % self.grid_columns
+        self.region_membership = np.zeros((2, 3, len(rows)))
+        for region, indices, groups in ((0, columns, (self.h_left_group, self.h_center_group, self.h_right_group)),
+                                        (1, rows, (self.v_top_group, self.v_center_group, self.v_bottom_group))):
+            assigned = np.zeros(len(indices), dtype=bool)
+            for i, group in enumerate(groups):
+                self.region_membership[region, i] = np.isin(indices, group) & ~assigned
+                assigned |= np.isin(indices, group)
+        self.region_membership = self.region_membership.reshape(6, -1)
+
+        # Command and arrow of every (horizontal region, vertical region, intensity) combination
+        h_parts = [SleeveHandler.LEFT, SleeveHandler.H_CENTER, SleeveHandler.RIGHT, ""]
+        v_parts = [SleeveHandler.TOP, SleeveHandler.V_CENTER, SleeveHandler.BOTTOM, ""]
+        intensity_parts = {
+            SleeveHandler.SOFT:    SleeveHandler.DECREASE + "10",
+            SleeveHandler.MEDIUM:  SleeveHandler.DECREASE + "5",
+            SleeveHandler.INTENSE: SleeveHandler.DECREASE + "0",
+        }
+        self.command_table = [[["" if intensity == SleeveHandler.OFF else
+                                SleeveHandler.BASE_COMMAND + SleeveHandler.TAP + h_part + v_part + intensity_parts[intensity]
+                                for intensity in range(SleeveHandler.INTENSE + 1)]
+                               for v_part in v_parts]
+                              for h_part in h_parts]
+        offsets = [-self.arrow_length, 0, self.arrow_length, 0]
+        self.arrow_table = [[(h_offset, v_offset) for v_offset in offsets] for h_offset in offsets]
+
+    # Select the measure of the cells (a registered CellMeasure), can be changed while running
+    def setMeasure(self, name):
+        cellMeasure = createMeasure(name, self.cellStatistics)
+        # All cells are refreshed every refresh_interval frames
+        incremental = IncrementalCellStatistics(self.cellStatistics, refresh_interval=self.refresh_interval, measure=cellMeasure) \
+                      if self.use_incremental else None
+        self.measure_name = name
+        self.cellMeasure, self.incremental = cellMeasure, incremental
+
+    # Define the measure used by the model
+    def measure(self, block):
+        if len(block) == 0: return -1
+
+        # Aggregate the values in bins
+        vals, counts = np.unique(block//self.bin_size, return_counts=True)
+        # Return the value of the largest bin (containing most data)
+        return vals[np.argmax(counts)]
+
+    # Split the frame into blocks (with all zeroes dropped)
+    def getBlocks(self, depthFrame):
+        blocks = blockshaped(depthFrame, self.cell_height, self.cell_width)
+        return np.array(list(map(lambda block: block[block > 0], blocks)), dtype=object)
+
+    # Function to convert measure into output signal
+    def setGridSignals(self, value):
+        if   (value < 0 or value > self.soft_treshold): return SleeveHandler.OFF
+        elif (value < self.intense_treshold): return SleeveHandler.INTENSE
+        elif (value < self.medium_treshold):  return SleeveHandler.MEDIUM
+        else:                                 return SleeveHandler.SOFT
+
+    # Function to convert danger_levels into a single output command (original implementation)
+    def getReferenceOutputSignal(self, danger_levels, center_point=None):
+        if center_point is None: center_point = self.center_point
+        intensity = max(danger_levels)
+
+        # Aggregate the cell values into predefined regions
+        h_sum, h_count = [0 for _ in range(3)], [0 for _ in range(3)]
+        v_sum, v_count = [0 for _ in range(3)], [0 for _ in range(3)]
+        for i, level in enumerate(danger_levels):
+            if level > SleeveHandler.OFF:
+                row = i // self.grid_columns
+                column = i % self.grid_columns
+
+                if row in self.v_top_group:
+                    v_sum[0] += level
+                    v_count[0] += 1
+                elif row in self.v_center_group:
+                    v_sum[1] += level
+                    v_count[1] += 1
+                elif row in self.v_bottom_group:
+                    v_sum[2] += level
+                    v_count[2] += 1
+
+                if column in self.h_left_group:
+                    h_sum[0] += level
+                    h_count[0] += 1
+                elif column in self.h_center_group:
+                    h_sum[1] += level
+                    h_count[1] += 1
+                elif column in self.h_right_group:
+                    h_sum[2] += level
+                    h_count[2] += 1
+
+        # Get the mean value of each horizontal and vertical region
+        convertToMeans = lambda sums, counts: [s/c if c > 0 else 0 for s,c in zip(sums, counts)]
+        h_means = convertToMeans(h_sum, h_count)
+        v_means = convertToMeans(v_sum, v_count)
+
+        # Disable all regions
+        left = h_center = right = bottom = v_center = top = False
+        # Set the horizontal and vertical region, based on the highest mean
+        h_max, v_max = max(h_means), max(v_means)
+        left, h_center, right = [m == h_max for m in h_means]
+        top, v_center, bottom = [m == v_max for m in v_means]
+
+        # Create the output signal arrow and command
+        end_point_x, end_point_y = center_point
+        command = SleeveHandler.BASE_COMMAND + SleeveHandler.TAP
+
+        if (left and right) or h_center:
+            command += SleeveHandler.H_CENTER
+        elif left:
+            command += SleeveHandler.LEFT
+            end_point_x -= self.arrow_length
+        elif right:
+            command += SleeveHandler.RIGHT
+            end_point_x += self.arrow_length
+
+        if (top and bottom) or v_center:
+            command += SleeveHandler.V_CENTER
+        elif top:
+            command += SleeveHandler.TOP
+            end_point_y -= self.arrow_length
+        elif bottom:
+            command += SleeveHandler.BOTTOM
+            end_point_y += self.arrow_length
+
+        if intensity == SleeveHandler.SOFT:
+            command += SleeveHandler.DECREASE + "10"
+        elif intensity == SleeveHandler.MEDIUM:
+            command += SleeveHandler.DECREASE + "5"
+        elif intensity == SleeveHandler.INTENSE:
+            command += SleeveHandler.DECREASE + "0"
+        elif intensity == SleeveHandler.OFF:
+            command = ""
+
+        return command, intensity, (end_point_x, end_point_y)
+
+    # Sample every decimation-th pixel of each cell, such that the samples stay aligned with the grid
+    def decimate(self, depthFrame):
+        if self.decimation == 1: return depthFrame
+        d = self.decimation
+        cells = depthFrame.reshape(self.grid_rows, self.cell_height, self.grid_columns, self.cell_width)
+        return cells[:, ::d, :, ::d].reshape(self.cellStatistics.shape)
+
+    # Get the value of every cell, equal to applying measure on every block (with the mode measure, unless incremental or decimated)
+    def getValues(self, depthFrame):
+        depthFrame = self.decimate(depthFrame)
+        incremental = self.incremental
+        if incremental is not None:
+            return incremental.modes(depthFrame)
+        return self.cellMeasure.values(depthFrame)
+
+    # Get the danger level of every cell, equal to applying setGridSignals on every value (unless adaptive)
+    def getDangerLevels(self, values):
+        if self.adaptive is not None:
+            return self.adaptive.getDangerLevels(values)
+        return self.level_table[np.asarray(values) + 1]
+
+    # Convert danger_levels into a single output command, equal to getReferenceOutputSignal
+    def getOutputSignal(self, danger_levels, center_point=None):
+        if center_point is None: center_point = self.center_point
+        danger_levels = np.asarray(danger_levels)
+        intensity = int(danger_levels.max())
+
+        # Get the mean value of each horizontal and vertical region (of the cells with a danger level)
+        sums = self.region_membership @ danger_levels
+        counts = self.region_membership @ (danger_levels > SleeveHandler.OFF)
+        means = (sums / np.maximum(counts, 1)).reshape(2, 3)
+
+        # Set the horizontal and vertical region, based on the highest mean
+        h_region, v_region = REGION_SELECTION[(means == means.max(axis=1, keepdims=True)) @ REGION_BITS]
+
+        # Lookup the output signal arrow and command
+        h_offset, v_offset = self.arrow_table[h_region][v_region]
+        command = self.command_table[h_region][v_region][intensity]
+        return command, intensity, (center_point[0] + h_offset, center_point[1] + v_offset)
+
+    # Get all possible output commands
+    def getCommands(self):
+        return sorted({command for v_commands in self.command_table for intensities in v_commands for command in intensities if command != ""})
+
+    # Get the value of every cell using blockshaped and measure (original implementation)
+    def getReferenceValues(self, depthFrame):
+        return list(map(self.measure, self.getBlocks(depthFrame)))
+
+    # Run the complete model on a single depth frame (and the detections of the frame, see DetectionFusion)
+    def process(self, depthFrame, reference=False, detections=None):
+        if reference:
+            values = self.getReferenceValues(depthFrame)
+            danger_levels = list(map(self.setGridSignals, values))
+            command, intensity, endpoint = self.getReferenceOutputSignal(danger_levels)
+        else:
+            start = time.perf_counter()
+            values = self.getValues(depthFrame)
+            if self.adaptive is not None: self.adaptive.update(values)
+            values_time = time.perf_counter()
+            danger_levels = self.getDangerLevels(values)
+            if self.detectionFusion is not None and detections is not None:
+                danger_levels = self.detectionFusion.fuse(danger_levels, detections)
+            levels_time = time.perf_counter()
+            command, intensity, endpoint = self.getOutputSignal(danger_levels)
+            signal_time = time.perf_counter()
+
+            # Missing floor ahead overrides the obstacles, the arrow points to the bottom of the region (like the command)
+            if self.stepDetector is not None:
+                region = self.stepDetector.detect(depthFrame)
+                if region is not None:
+                    command, intensity = self.stepDetector.getOutputSignal(region)
+                    h_offset, v_offset = self.arrow_table[region][2]
+                    endpoint = (self.center_point[0] + h_offset, self.center_point[1] + v_offset)
+
+            if self.latency is not None:
+                self.latency.record("cell_statistics", values_time - start)
+                self.latency.record("classification", levels_time - values_time)
+                self.latency.record("signal", signal_time - levels_time)
+                if self.stepDetector is not None: self.latency.record("step_detection", time.perf_counter() - signal_time)
+        return values, danger_levels, command, intensity, endpoint
@@ -0,0 +1,141 @@
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+
+class LatencyHistogram:
+    """
+    Rolling histogram of latencies with logarithmic buckets.
+
+    Bucket i contains the latencies in [min_latency * ratio^i, min_latency * ratio^(i+1)),
+    so the relative error of a percentile is at most `ratio - 1`. The histogram is split
+    into `slices` time slices of `slice_duration` seconds, the oldest slice is cleared
+    when a new slice starts, such that the percentiles cover the last
+    slices * slice_duration seconds. Recording a latency is a single increment.
+    """
+
+    def __init__(self, min_latency=1e-5, max_latency=10.0, ratio=1.05, slices=10, slice_duration=1.0):
+        self.min_latency = min_latency
+        self.log_ratio = math.log(ratio)
+        self.bucket_count = int(math.ceil(math.log(max_latency / min_latency) / self.log_ratio)) + 1
+        self.slice_duration = slice_duration
+
+        # Upper edge of every bucket (in seconds)
+        self.edges = min_latency * ratio ** np.arange(1, self.bucket_count + 1)
+        self.counts = np.zeros((slices, self.bucket_count), dtype=np.int64)
+        self.slice = 0
+        self.slice_start = time.monotonic()
+
+    # Start a new time slice when the current slice is finished
+    def rotate(self, now):
+        while now - self.slice_start >= self.slice_duration:
+            self.slice = (self.slice + 1) % len(self.counts)
+            self.counts[self.slice] = 0
+            self.slice_start += self.slice_duration
+            # Skip the slices of a long pause at once
+            if now - self.slice_start >= self.slice_duration * len(self.counts):
+                self.counts[:] = 0
+                self.slice_start = now
+
+    def record(self, latency, now):
+        self.rotate(now)
+        bucket = int(math.log(latency / self.min_latency) / self.log_ratio) if latency > self.min_latency else 0
+        self.counts[self.slice, min(bucket, self.bucket_count - 1)] += 1
+
+    # Get the latencies (in seconds) of the percentiles (0-100), and the number of recorded latencies
+    def percentiles(self, percentiles, now):
+        self.rotate(now)
+        cumulative = np.cumsum(self.counts.sum(axis=0))
+        count = int(cumulative[-1])
+        if count == 0: return [math.nan] * len(percentiles), 0
+        buckets = np.searchsorted(cumulative, np.asarray(percentiles) / 100 * count)
+        return list(self.edges[np.minimum(buckets, self.bucket_count - 1)]), count
+
+
+class LatencyMonitor:
+    """
+    Collects the latency of every stage of the model (capture, cell statistics,
+    classification, signal, sleeve send/ack, render) in rolling histograms.
+
+    The stages record their own duration with record(stage, seconds), which is thread
+    safe, as the stages run in different threads. The percentiles can be printed
+    (getReport), drawn on the visualization (getOverlayLines) and exported to a CSV file
+    or a Prometheus text file (export, based on the extension of the path).
+    """
+
+    PERCENTILES = (50, 95, 99)
+
+    def __init__(self, window=10.0, export_path=None, export_interval=10.0):
+        self.window = window
+        self.export_path = export_path
+        self.export_interval = export_interval
+        self.next_export = time.monotonic() + export_interval
+
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        now = time.monotonic()
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = LatencyHistogram(slice_duration=self.window / 10)
+            histogram.record(seconds, now)
+
+    # Get the percentiles (in seconds) and the count of every stage
+    def getPercentiles(self):
+        now = time.monotonic()
+        with self.lock:
+            return {stage: histogram.percentiles(self.PERCENTILES, now) for stage, histogram in self.histograms.items()}
+
+    # Get a line for every stage: count per second and the percentiles (in milliseconds)
+    def getOverlayLines(self):
+        lines = []
+        for stage, (latencies, count) in self.getPercentiles().items():
+            lines.append("{:16s} {:6.1f}/s ".format(stage, count / self.window)
+                         + " ".join("p{} {:7.2f}ms".format(p, latency * 1000) for p, latency in zip(self.PERCENTILES, latencies)))
+        return lines
+
+    def getReport(self):
+        return "Latency (last {:.0f}s):\n  ".format(self.window) + "\n  ".join(self.getOverlayLines())
+
+    # Export the percentiles, when the export interval has passed
+    def update(self):
+        if self.export_path is None or time.monotonic() < self.next_export: return
+        self.next_export = time.monotonic() + self.export_interval
+        self.export(self.export_path)
+
+    def export(self, path):
+        if path.endswith(".csv"):
+            self.exportCSV(path)
+        else:
+            self.exportPrometheus(path)
+
+    # Append a row per stage to a CSV file
+    def exportCSV(self, path):
+        header = not os.path.exists(path)
+        with open(path, "a") as file:
+            if header:
+                file.write("time,stage,count," + ",".join("p{}_ms".format(p) for p in self.PERCENTILES) + "\n")
+            timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
+            for stage, (latencies, count) in self.getPercentiles().items():
+                file.write("{},{},{},".format(timestamp, stage, count) + ",".join("{:.3f}".format(latency * 1000) for latency in latencies) + "\n")
+
+    # Replace a text file with the percentiles in the Prometheus exposition format (a summary per stage)
+    def exportPrometheus(self, path):
+        lines = [
+            "# HELP depth_model_latency_seconds Latency of the stages of the depth model (last {:.0f} seconds)".format(self.window),
+            "# TYPE depth_model_latency_seconds summary",
+        ]
+        for stage, (latencies, count) in self.getPercentiles().items():
+            for p, latency in zip(self.PERCENTILES, latencies):
+                lines.append('depth_model_latency_seconds{{stage="{}",quantile="{}"}} {:.6f}'.format(stage, p / 100, latency))
+            lines.append('depth_model_latency_seconds_count{{stage="{}"}} {}'.format(stage, count))
+
+        # Write to a temporary file first, such that a reader never sees a partial file
+        with open(path + ".tmp", "w") as file:
+            file.write("\n".join(lines) + "\n")
+        os.replace(path + ".tmp", path)
@@ -0,0 +1,194 @@
+from collections import deque, namedtuple
+import threading
+import traceback
+
+
+# The output of the model for a single frame
+ModelResult = namedtuple("ModelResult", ["depthFrame", "timestamp", "values", "danger_levels", "command", "intensity", "endpoint"])
+
+
+class LatestQueue:
+    """
+    Bounded queue between two pipeline stages, where the newest item always wins.
+    When the queue is full, the oldest item is dropped (and counted in `dropped`).
+    """
+
+    def __init__(self, maxsize=1):
+        self.items = deque(maxlen=maxsize)
+        self.condition = threading.Condition()
+        self.closed = False
+        self.dropped = 0
+
+    def put(self, item):
+        with self.condition:
+            if len(self.items) == self.items.maxlen: self.dropped += 1
+            self.items.append(item)
+            self.condition.notify()
+
+    # Get the oldest item in the queue, returns None on timeout or when the queue is closed
+    def get(self, timeout=None):
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.items or self.closed, timeout):
+                return None
+            return self.items.popleft() if self.items else None
+
+    def clear(self):
+        with self.condition:
+            self.items.clear()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class ModelPipeline:
+    """
+    Runs the capture, model and sleeve stages in separate worker threads.
+
+    The stages are connected by LatestQueues, so a slow stage never delays the
+    stages before it, it only causes older frames to be dropped. Frames that are
+    older than `max_frame_age` seconds (based on the timestamp of the depth
+    message) are dropped before they are processed and before they reach the sleeve.
+    With a LatencyMonitor, the age of the frames is recorded when they are captured
+    ("capture") and when their command is passed to the sleeve ("end_to_end").
+    Rendering is left to the caller (OpenCV windows should be used from the main
+    thread), using getResult to obtain the newest result. With a FrameRing (the ring
+    the frame source writes into), the model results of frames whose slot was
+    overwritten while they were processed are discarded (counted as torn). The model can be replaced
+    while running (setModel), the results of the old model are discarded. When a stage
+    raises an exception, the traceback is printed, the pipeline is stopped (all queues
+    are closed, so getResult returns None) and the failure is stored in `error`.
+    """
+
+    def __init__(self, frameSource, model, sleeveHandler=None, max_frame_age=0.1, latency=None, frameRing=None):
+        self.frameSource = frameSource
+        self.frameRing = frameRing
+        self.model = model
+        self.sleeveHandler = sleeveHandler
+        self.max_frame_age = max_frame_age
+        self.latency = latency
+        self.modelLock = threading.Lock()
+
+        # Functions called with (depthFrame, timestamp) for every captured frame, e.g. to record the frames
+        self.captureHandlers = []
+
+        self.modelQueue = LatestQueue()
+        self.sleeveQueue = LatestQueue()
+        self.renderQueue = LatestQueue()
+
+        self.running = False
+        self.finished = threading.Event()
+        self.error = None
+        self.threads = [
+            threading.Thread(target=self._runStage, args=(self._capture,), name="capture", daemon=True),
+            threading.Thread(target=self._runStage, args=(self._process,), name="model", daemon=True),
+            threading.Thread(target=self._runStage, args=(self._sleeve,), name="sleeve", daemon=True),
+        ]
+
+        # Statistics
+        self.captured = self.processed = self.sent = 0
+        self.stale = self.torn = 0
+
+    def start(self):
+        self.running = True
+        for thread in self.threads: thread.start()
+
+    def stop(self):
+        self.running = False
+        for q in (self.modelQueue, self.sleeveQueue, self.renderQueue): q.close()
+
+    # Replace the model between two frames (e.g. with a model built from reloaded settings)
+    def setModel(self, model):
+        with self.modelLock:
+            self.model = model
+            self.sleeveQueue.clear()
+            self.renderQueue.clear()
+
+    # Get the newest model result for rendering (None on timeout or when the pipeline is finished)
+    def getResult(self, timeout=None):
+        return self.renderQueue.get(timeout)
+
+    # Get the number of dropped frames (overwritten by newer frames) and stale frames
+    def getStatistics(self):
+        return {
+            "captured": self.captured,
+            "processed": self.processed,
+            "sent": self.sent,
+            "stale": self.stale,
+            "torn": self.torn,
+            "dropped": self.modelQueue.dropped + self.sleeveQueue.dropped,
+        }
+
+    # Run a stage in its thread, a failing stage stops the whole pipeline
+    def _runStage(self, stage):
+        try:
+            stage()
+        except Exception as e:
+            self.error = "{} stage failed: {}: {}".format(threading.current_thread().name, type(e).__name__, e)
+            print("\n" + self.error)
+            traceback.print_exc()
+            self.stop()
+            self.finished.set()
+
+    def _isStale(self, timestamp):
+        if self.max_frame_age is None: return False
+        return self.frameSource.now() - timestamp > self.max_frame_age
+
+    # Stage 1: capture the frames
+    def _capture(self):
+        while self.running:
+            frame = self.frameSource.read()
+            if frame is None: break
+            if self.latency is not None: self.latency.record("capture", self.frameSource.now() - frame[1])
+
+            for handler in self.captureHandlers: handler(*frame)
+            self.modelQueue.put(frame)
+            self.captured += 1
+
+        self.modelQueue.close()
+
+    # Stage 2: run the model on the newest frame
+    def _process(self):
+        while self.running:
+            frame = self.modelQueue.get()
+            if frame is None: break
+
+            depthFrame, timestamp = frame
+            if self._isStale(timestamp):
+                self.stale += 1
+                continue
+
+            # Number of the frame in the ring, the slot should not be overwritten while the frame is processed
+            number = None if self.frameRing is None else self.frameRing.getNumber(depthFrame, timestamp)
+
+            model = self.model
+            result = ModelResult(depthFrame, timestamp, *model.process(depthFrame))
+            self.processed += 1
+            if number is not None and not self.frameRing.isValid(number):
+                self.torn += 1
+                continue
+            with self.modelLock:
+                # Discard the result when the model was replaced while processing
+                if model is not self.model: continue
+                if result.command != "": self.sleeveQueue.put(result)
+                self.renderQueue.put(result)
+
+        self.sleeveQueue.close()
+        self.renderQueue.close()
+        self.finished.set()
+
+    # Stage 3: send the newest command to the sleeve
+    def _sleeve(self):
+        while self.running:
+            result = self.sleeveQueue.get()
+            if result is None: break
+
+            if self._isStale(result.timestamp):
+                self.stale += 1
+                continue
+
+            if self.sleeveHandler is not None:
+                self.sleeveHandler.processSignal(result.command, result.intensity)
+            if self.latency is not None: self.latency.record("end_to_end", self.frameSource.now() - result.timestamp)
+            self.sent += 1
@@ -0,0 +1,143 @@
+from GridModel import GridModel, checkGrid
+from StepDetector import StepDetector
+
+'''
+Setup of the depth model, shared by Depth Model.py, the multi-user host mode and the tools
+  Contains the default settings of the camera, sleeve, grid and model (overridden by the settings file), and creates
+  the camera pipeline and the model from the settings, such that every entry point runs the same configuration.
+'''
+
+# Resolution of the depth frames of the camera (400P mono cameras)
+DEVICE_RESOLUTION = (640, 400)
+
+
+############################## Settings ##############################
+
+DEFAULT_SETTINGS = {
+    # Camera settings
+    "USB_2_MODE": True,
+
+    # Pipeline settings
+    "MAX_FRAME_AGE": 0.1,   # Frames older than this (in seconds) are dropped before they reach the sleeve
+
+    # Output settings
+    "LEFT_HANDED": False,
+    "SLEEVE_COMMANDS_DIR": None,    # Directory of the sleeve command files (None: Sleeve/commands)
+    "ARROW_LENGTH": 100,
+
+    # Grid settings
+    "GRID_ROWS": 5,
+    "GRID_COLUMNS": 8,
+    # Horizontal grouping
+    "H_LEFT_GROUP": [0,1,2],
+    "H_CENTER_GROUP": [3,4],
+    "H_RIGHT_GROUP": [5,6,7],
+    # Vertical grouping
+    "V_TOP_GROUP": [0,1],
+    "V_CENTER_GROUP": [2],
+    "V_BOTTOM_GROUP": [3,4],
+
+    # Model settings
+    "BIN_SIZE": 125,
+    "CELL_MEASURE": "mode",         # Measure of the cells: mode, median, percentile, trimmed_min or mean (see CellMeasures.py)
+    "SOFT_TRESHOLD": 20,
+    "MEDIUM_TRESHOLD": 10,
+    "INTENSE_TRESHOLD": 6,
+    "ADAPTIVE_TRESHOLDS": False,    # Adapt the tresholds to the environment (the tresholds above are the base values)
+    "INCREMENTAL_MODEL": False,     # Only recompute the cells whose depth changed
+    "REFRESH_INTERVAL": 15,         # Number of frames after which every cell is recomputed (incremental model)
+    "DECIMATION_FACTOR": 1,         # Only every n-th pixel (in both directions) is used by the model
+    "DECIMATE_ON_DEVICE": False,    # Decimate the depth frame on the camera (smaller frames) instead of on the host
+    "STEP_DETECTION": False,        # Detect missing floor ahead (steps going down, drop-offs)
+}
+
+
+############################## Camera Pipeline ##############################
+
+# Get the decimation factor of the camera (1 when the frames are decimated on the host)
+def getDeviceDecimation(settings):
+    return settings["DECIMATION_FACTOR"] if settings["DECIMATE_ON_DEVICE"] else 1
+
+# Get the resolution of the depth frames of the camera (after the decimation filter of the camera)
+def getDeviceResolution(settings):
+    decimation = getDeviceDecimation(settings)
+    return DEVICE_RESOLUTION[0] // decimation, DEVICE_RESOLUTION[1] // decimation
+
+# Check that the frames of the camera fit the grid after the decimation filter of the camera, raises ValueError otherwise
+# (on the host, the cells are decimated separately, so every factor fits)
+def checkDeviceDecimation(settings):
+    factor = getDeviceDecimation(settings)
+    if not 1 <= factor <= 4:
+        raise ValueError("DECIMATION_FACTOR {} is not supported by the decimation filter of the camera (1 to 4)".format(factor))
+    try:
+        checkGrid(getDeviceResolution(settings), settings["GRID_ROWS"], settings["GRID_COLUMNS"])
+    except ValueError as e:
+        raise ValueError("DECIMATION_FACTOR {} on the camera: {} (use DECIMATE_ON_DEVICE = False, or another factor or grid)".format(factor, e))
+
+# Create the DepthAI pipeline with the stereo depth output (stream "depth")
+def createDepthPipeline(settings):
+    import depthai as dai
+
+    # Setup camera pipelines
+    pipeline = dai.Pipeline()
+    left = pipeline.create(dai.node.MonoCamera)
+    left.setBoardSocket(dai.CameraBoardSocket.LEFT)
+    left.setResolution(dai.MonoCameraProperties.SensorResolution.THE_400_P)
+    right = pipeline.create(dai.node.MonoCamera)
+    right.setResolution(dai.MonoCameraProperties.SensorResolution.THE_400_P)
+    right.setBoardSocket(dai.CameraBoardSocket.RIGHT)
+
+    # Setup stereodepth pipeline (with left and right camera as input)
+    stereo = pipeline.create(dai.node.StereoDepth)
+    left.out.link(stereo.left)
+    right.out.link(stereo.right)
+
+    # Set settings to get a better depth image
+    stereo.setLeftRightCheck(True)
+    stereo.setExtendedDisparity(False)
+    stereo.setSubpixel(False)
+    stereo.setDefaultProfilePreset(dai.node.StereoDepth.PresetMode.HIGH_ACCURACY)
+    stereo.initialConfig.setMedianFilter(dai.MedianFilter.KERNEL_7x7)
+
+    # Configure stereo pipeline
+    config = stereo.initialConfig.get()
+    config.postProcessing.speckleFilter.enable = False
+    config.postProcessing.speckleFilter.speckleRange = 50
+    config.postProcessing.temporalFilter.enable = True
+    config.postProcessing.spatialFilter.enable = True
+    config.postProcessing.spatialFilter.holeFillingRadius = 2
+    config.postProcessing.spatialFilter.numIterations = 1
+    config.postProcessing.thresholdFilter.minRange = 400
+    config.postProcessing.thresholdFilter.maxRange = 15000
+    config.postProcessing.decimationFilter.decimationFactor = getDeviceDecimation(settings)
+    stereo.initialConfig.set(config)
+
+    # Setup output pipeline (with stereodepth as input)
+    depthOut = pipeline.create(dai.node.XLinkOut)
+    depthOut.setStreamName("depth")
+    stereo.depth.link(depthOut.input)
+    return pipeline
+
+
+############################## Model ##############################
+
+# Create the model (and grid) from the settings, for frames of the given resolution
+# With device_decimation, the frames are already decimated by the camera (see getDeviceDecimation)
+def createModel(settings, resolution, device_decimation=1, intrinsics=None):
+    model = GridModel(resolution, settings["GRID_ROWS"], settings["GRID_COLUMNS"],
+                      (settings["H_LEFT_GROUP"], settings["H_CENTER_GROUP"], settings["H_RIGHT_GROUP"]),
+                      (settings["V_TOP_GROUP"], settings["V_CENTER_GROUP"], settings["V_BOTTOM_GROUP"]),
+                      settings["BIN_SIZE"], settings["SOFT_TRESHOLD"], settings["MEDIUM_TRESHOLD"], settings["INTENSE_TRESHOLD"],
+                      settings["ARROW_LENGTH"] // device_decimation, settings["INCREMENTAL_MODEL"], settings["REFRESH_INTERVAL"],
+                      settings["ADAPTIVE_TRESHOLDS"], settings["DECIMATION_FACTOR"] if device_decimation == 1 else 1,
+                      settings["CELL_MEASURE"])
+    if settings["STEP_DETECTION"]:
+        model.stepDetector = StepDetector(resolution, intrinsics)
+    return model
+
+# Get all output commands of the model (to encode them in advance)
+def getCommands(model):
+    commands = model.getCommands()
+    if model.stepDetector is not None:
+        commands += model.stepDetector.commands
+    return commands
@@ -0,0 +1,78 @@
+import argparse
+import json
+import os
+import time
+
+from MultiSession import SessionSupervisor, STATE_STOPPED, STATE_FAILED
+
+'''
+Multi-user host mode
+  Runs several sessions (camera + sleeve pairs) on one machine, each in its own worker process (see MultiSession.py),
+  and prints the health and frame rate of every session. The sessions are read from a JSON file, created for every
+  connected device (--devices), or created with synthetic frames and stand-in sleeve servers (--synthetic) to test the
+  host without devices:
+    python "Own code/Multi Session.py" --synthetic 3 --duration 20
+'''
+
+# The sessions run in spawned worker processes, which import this script again
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve several camera + sleeve pairs from one machine")
+    parser.add_argument("--config", help='JSON file with the sessions: {"sessions": [{"name": ..., "device": ..., "sleeve": "ip:port", ...}]}')
+    parser.add_argument("--devices", action="store_true", help="Start a session for every connected device")
+    parser.add_argument("--synthetic", type=int, default=0, help="Number of sessions with synthetic frames and a stand-in sleeve server")
+    parser.add_argument("--sleeve-port", type=int, default=50000, help="UDP port of the sleeve of the first device (--devices), the next devices use the next ports")
+    parser.add_argument("--rate", type=float, default=30, help="Frame rate of the synthetic sessions")
+    parser.add_argument("--cpus", type=int, default=0, help="Number of CPUs per session (assigned in order), 0 does not set the affinity")
+    parser.add_argument("--duration", type=float, help="Duration in seconds (default: until interrupted)")
+    parser.add_argument("--interval", type=float, default=5, help="Seconds between the printed reports")
+    args = parser.parse_args()
+
+
+    # Collect the sessions
+    configs = []
+    if args.config is not None:
+        with open(args.config, "r") as file:
+            configs += json.load(file)["sessions"]
+
+    if args.devices:
+        import depthai as dai
+        for i, info in enumerate(dai.Device.getAllAvailableDevices()):
+            configs.append({"name": "device{}".format(i), "device": info.getMxId(), "sleeve": "127.0.0.1:{}".format(args.sleeve_port + i)})
+
+    servers = []
+    if args.synthetic > 0:
+        from SleeveServer import SleeveServer
+        for i in range(args.synthetic):
+            server = SleeveServer(port=0, seed=i).start()
+            servers.append(server)
+            configs.append({"name": "synthetic{}".format(i), "synthetic": 30, "seed": i, "rate": args.rate,
+                            "sleeve": "{}:{}".format(*server.address[:2])})
+
+    if len(configs) == 0:
+        parser.error("No sessions, use --config, --devices or --synthetic")
+
+    # Assign the CPUs in order to the sessions without affinity
+    if args.cpus > 0:
+        cpu_count = os.cpu_count()
+        for i, config in enumerate(configs):
+            config.setdefault("cpus", [(i * args.cpus + j) % cpu_count for j in range(args.cpus)])
+
+
+    # Run the sessions
+    supervisor = SessionSupervisor(configs).start()
+    print("Started {} sessions".format(len(configs)))
+    start_time = time.monotonic()
+    try:
+        end_time = start_time + (args.duration if args.duration is not None else float("inf"))
+        while time.monotonic() < end_time:
+            time.sleep(max(min(args.interval, end_time - time.monotonic()), 0))
+            print("\n" + supervisor.getReport())
+            if all(state in (STATE_STOPPED, STATE_FAILED) for state in supervisor.getHealth().values()): break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        supervisor.stop()
+        print("\nFinal:\n" + supervisor.getReport())
+        for server in servers:
+            print("{}: received {}, replied {}".format(server.address, server.received, server.replied))
+            server.close()
@@ -0,0 +1,232 @@
+import multiprocessing
+import os
+import queue
+import time
+
+import numpy as np
+
+from ModelSetup import DEFAULT_SETTINGS, DEVICE_RESOLUTION, checkDeviceDecimation, createDepthPipeline, createModel, getCommands, getDeviceDecimation, getDeviceResolution
+from Settings import Settings
+
+'''
+Multi-user host mode: one machine serves several camera + sleeve pairs
+  Every session (one user, with their own OAK-D-Lite and sleeve) runs the depth model in a separate worker process,
+  with its own settings, CPU affinity and sleeve endpoint. The SessionSupervisor starts the workers and collects
+  their health and frame rate. A session reads from a device, recorded frames or synthetic frames:
+    {"name": "user1", "device": "<MxId>", "sleeve": "127.0.0.1:50000", "cpus": [0, 1], "settings": {"LEFT_HANDED": true}}
+    {"name": "test", "recordings": ["stored_depthFrame.bin"], "rate": 30, "sleeve": null}
+    {"name": "test", "synthetic": 30, "resolution": [640, 400], "rate": 30}
+'''
+
+# Session states
+STATE_STARTING = "starting"
+STATE_RUNNING = "running"
+STATE_STALLED = "stalled"
+STATE_STOPPED = "stopped"
+STATE_FAILED = "failed"
+
+
+############################## Session Worker ##############################
+
+# Pin the worker process to the given CPUs (Linux only)
+def setAffinity(cpus):
+    if cpus is None: return
+    if not hasattr(os, "sched_setaffinity"):
+        print("CPU affinity is not supported on this platform")
+        return
+    os.sched_setaffinity(0, cpus)
+
+# Open the frame source of a session, returns the source, its resolution and the device (None without device)
+def openFrameSource(config, settings):
+    from FrameSource import DepthAIFrameSource, PacedFrameSource, RecordedFrameSource, SyntheticFrameSource
+
+    if "recordings" in config:
+        source = PacedFrameSource(RecordedFrameSource(config["recordings"], repeat=None), config.get("rate", 30))
+        return source, source.shape[::-1], None
+    if "synthetic" in config:
+        resolution = tuple(config.get("resolution", DEVICE_RESOLUTION))
+        source = PacedFrameSource(SyntheticFrameSource(resolution, config["synthetic"], config.get("seed", 0), repeat=None), config.get("rate", 30))
+        return source, resolution, None
+
+    import depthai as dai
+    checkDeviceDecimation(settings)
+    device = dai.Device(createDepthPipeline(settings), dai.DeviceInfo(config["device"]), settings["USB_2_MODE"])
+    return DepthAIFrameSource(device.getOutputQueue(name="depth", maxSize=4, blocking=False)), getDeviceResolution(settings), device
+
+# Create a model from the reloaded settings and try it on an empty frame, returns None (and reports) when it fails
+# The running model is kept in that case, like in Depth Model.py
+def reloadModel(settings, resolution, device_decimation, status):
+    previous_values = settings.values
+    try:
+        settings.reload()
+        model = createModel(settings, resolution, device_decimation)
+        model.process(np.zeros((resolution[1], resolution[0]), dtype=np.uint16))
+    except Exception as e:
+        # Keep the running settings, the next reload is compared against them
+        settings.values = previous_values
+        status["settings_error"] = "Settings not applied: {}: {}".format(type(e).__name__, e)
+        print("Session {}: {}".format(status["name"], status["settings_error"]))
+        return None
+    status.pop("settings_error", None)
+    return model
+
+# Run a session until the stop event is set (or the frames run out), the status is reported every report_interval seconds
+def runSession(config, statusQueue, stopEvent, report_interval=1.0):
+    from ModelPipeline import ModelPipeline
+    from SleeveHandler import SleeveHandler
+
+    name = config["name"]
+    status = {"name": name, "pid": os.getpid(), "state": STATE_STARTING, "time": time.time()}
+    statusQueue.put(dict(status))
+
+    frameSource = device = sleeveHandler = modelPipeline = None
+    try:
+        setAffinity(config.get("cpus"))
+        status["cpus"] = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else None
+
+        settings = Settings(Settings(DEFAULT_SETTINGS).merge(config.get("settings", {})), config.get("settings_file"))
+        frameSource, resolution, device = openFrameSource(config, settings)
+        # Recorded and synthetic frames are never decimated by a camera
+        device_decimation = getDeviceDecimation(settings) if device is not None else 1
+        model = createModel(settings, resolution, device_decimation)
+
+        # The sleeve of the session (no sleeve when the endpoint is null)
+        if config.get("sleeve") is not None:
+            ip, port = config["sleeve"].rsplit(":", 1)
+            sleeveHandler = SleeveHandler(ip, int(port), commands_dir=settings["SLEEVE_COMMANDS_DIR"])
+            sleeveHandler.setLeftHandMode(settings["LEFT_HANDED"])
+            sleeveHandler.preloadCommands(getCommands(model))
+
+        modelPipeline = ModelPipeline(frameSource, model, sleeveHandler, settings["MAX_FRAME_AGE"])
+        modelPipeline.start()
+
+        last_time = time.monotonic()
+        last_processed = last_captured = 0
+        while not stopEvent.wait(report_interval):
+            # Frame rates since the last report
+            current_time = time.monotonic()
+            statistics = modelPipeline.getStatistics()
+            elapsed = current_time - last_time
+            status.update(statistics, state=STATE_RUNNING, time=time.time(),
+                          fps=(statistics["processed"] - last_processed) / elapsed,
+                          capture_fps=(statistics["captured"] - last_captured) / elapsed,
+                          dead_threads=[thread.name for thread in modelPipeline.threads if not thread.is_alive()])
+            last_time, last_processed, last_captured = current_time, statistics["processed"], statistics["captured"]
+            if sleeveHandler is not None:
+                transport = sleeveHandler.transport
+                status.update(sleeve_sent=transport.sent, sleeve_replied=transport.replied, sleeve_timeouts=transport.timeouts)
+            statusQueue.put(dict(status))
+
+            # Replace the model when the settings file of the session changed
+            if settings.hasChanged():
+                newModel = reloadModel(settings, resolution, device_decimation, status)
+                if newModel is not None:
+                    model = newModel
+                    if sleeveHandler is not None:
+                        sleeveHandler.setLeftHandMode(settings["LEFT_HANDED"])
+                        sleeveHandler.reloadCommands(getCommands(model), settings["SLEEVE_COMMANDS_DIR"])
+                    modelPipeline.max_frame_age = settings["MAX_FRAME_AGE"]
+                    modelPipeline.setModel(model)
+
+            if modelPipeline.finished.is_set(): break
+
+        # A failed stage stops the pipeline (see ModelPipeline), the session failed
+        if modelPipeline.error is not None:
+            status.update(state=STATE_FAILED, time=time.time(), fps=0.0, capture_fps=0.0, error=modelPipeline.error,
+                          dead_threads=[thread.name for thread in modelPipeline.threads if not thread.is_alive()])
+        else:
+            status.update(state=STATE_STOPPED, time=time.time(), fps=0.0, capture_fps=0.0)
+    except Exception as e:
+        status.update(state=STATE_FAILED, time=time.time(), error="{}: {}".format(type(e).__name__, e))
+        raise
+    finally:
+        if modelPipeline is not None: modelPipeline.stop()
+        if sleeveHandler is not None: sleeveHandler.close()
+        if frameSource is not None: frameSource.close()
+        if device is not None: device.close()
+        statusQueue.put(dict(status))
+
+
+############################## Supervisor ##############################
+
+class SessionSupervisor:
+    """
+    Starts a worker process per session and collects the health and frame rate of the sessions.
+
+    The workers report their status every `report_interval` seconds through a queue,
+    which is read by poll. A session that did not report for `stall_timeout` seconds is
+    marked as stalled, a worker that exited without stopping is marked as failed. The
+    workers are started with spawn, such that every session has its own DepthAI and
+    OpenCV state.
+    """
+
+    def __init__(self, configs, report_interval=1.0, stall_timeout=5.0):
+        names = [config["name"] for config in configs]
+        if len(set(names)) != len(names):
+            raise ValueError("Session names should be unique: {}".format(names))
+
+        self.configs = configs
+        self.report_interval = report_interval
+        self.stall_timeout = stall_timeout
+
+        self.context = multiprocessing.get_context("spawn")
+        self.statusQueue = self.context.Queue()
+        self.stopEvent = self.context.Event()
+        self.processes = {}
+        self.status = {name: {"name": name, "state": STATE_STARTING, "time": time.time()} for name in names}
+
+    def start(self):
+        for config in self.configs:
+            process = self.context.Process(target=runSession, name="session-" + config["name"],
+                                           args=(config, self.statusQueue, self.stopEvent, self.report_interval), daemon=True)
+            process.start()
+            self.processes[config["name"]] = process
+        return self
+
+    # Read the reported status of the sessions and check the health of the workers
+    def poll(self):
+        while True:
+            try:
+                status = self.statusQueue.get_nowait()
+            except queue.Empty:
+                break
+            self.status[status["name"]] = status
+
+        now = time.time()
+        for name, process in self.processes.items():
+            status = self.status[name]
+            if status["state"] in (STATE_STOPPED, STATE_FAILED): continue
+            if not process.is_alive():
+                status.update(state=STATE_FAILED, error=status.get("error", "exit code {}".format(process.exitcode)))
+            elif status["state"] == STATE_RUNNING and now - status["time"] > self.stall_timeout:
+                status["state"] = STATE_STALLED
+        return self.status
+
+    # Get the state of every session
+    def getHealth(self):
+        return {name: status["state"] for name, status in self.poll().items()}
+
+    def getReport(self):
+        lines = ["{:12s} {:9s} {:>6s} {:>8s} {:>9s} {:>8s} {:>6s} {:>12s}  {}".format(
+            "session", "state", "pid", "fps", "capture", "dropped", "stale", "sleeve", "cpus")]
+        for name, status in self.poll().items():
+            sleeve = "{}/{}".format(status["sleeve_replied"], status["sleeve_sent"]) if "sleeve_sent" in status else "-"
+            lines.append("{:12s} {:9s} {:>6} {:8.1f} {:9.1f} {:8d} {:6d} {:>12s}  {}".format(
+                name, status["state"], status.get("pid", "-"), status.get("fps", 0.0), status.get("capture_fps", 0.0),
+                status.get("dropped", 0), status.get("stale", 0), sleeve, status.get("cpus", "-")))
+            if status.get("dead_threads") and status["state"] == STATE_RUNNING:
+                lines.append("  Pipeline threads not running: {}".format(", ".join(status["dead_threads"])))
+            if "settings_error" in status:
+                lines.append("  {}".format(status["settings_error"]))
+            if "error" in status:
+                lines.append("  {}".format(status["error"]))
+        return "\n".join(lines)
+
+    # Stop all sessions (the workers are terminated when they do not stop within the timeout)
+    def stop(self, timeout=5.0):
+        self.stopEvent.set()
+        end_time = time.monotonic() + timeout
+        for process in self.processes.values():
+            process.join(max(end_time - time.monotonic(), 0))
+            if process.is_alive(): process.terminate()
+        self.poll()
@@ -0,0 +1,272 @@
+import argparse
+
+import numpy as np
+
+from DetectionFusion import DEPTH, LABEL, SPATIAL_X, SPATIAL_Y, CONFIDENCE
+
+'''
+Tracker of the detected objects, such that the detection network only has to run on every Nth frame
+  Every track stores the box (normalized) and spatial position (millimeters) of an object at the time of its last
+  detection, and their velocity. Between the detections, the tracks are predicted with a constant velocity to the
+  time of every frame, so the host gets an estimate of every object on every frame, including its approach speed
+  (how fast it comes closer). New detections are associated with the tracks by IoU (all pairs at once) and
+  corrected with an alpha-beta filter, with gains that depend on the time since the previous detection. The tracker reports the detector load it saves and the error of the
+  predictions, measured against the next detection of each object. Simulate the error for several intervals with:
+    python "Own code/ObjectTracker.py" --intervals 1 2 3 5
+'''
+
+# Columns of the state of a track: box and spatial position
+BOX = slice(0, 4)
+POSITION = slice(4, 7)
+STATE_SIZE = 7
+
+
+# Get the IoU of every pair of boxes (xmin, ymin, xmax, ymax), shape (boxes, others)
+def getIoU(boxes, others):
+    width = np.minimum(boxes[:, None, 2], others[None, :, 2]) - np.maximum(boxes[:, None, 0], others[None, :, 0])
+    height = np.minimum(boxes[:, None, 3], others[None, :, 3]) - np.maximum(boxes[:, None, 1], others[None, :, 1])
+    intersection = np.maximum(width, 0) * np.maximum(height, 0)
+
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    other_areas = (others[:, 2] - others[:, 0]) * (others[:, 3] - others[:, 1])
+    union = areas[:, None] + other_areas[None, :] - intersection
+    return intersection / np.maximum(union, 1e-9)
+
+
+class ObjectTracker:
+    """
+    IoU and constant velocity tracker of the spatial detections (arrays, see DetectionFusion.toArray).
+
+    update associates the detections of a detector run with the tracks: the pairs with
+    the same label are matched greedily by the IoU of the predicted box (at the time of
+    the detections), down to `iou_treshold`. A matched track is corrected by alpha of the
+    residual and its velocity by beta of the residual per second (detections without
+    depth do not correct the position). The gains are the steady state gains of Kalata
+    for the time since the previous detection of the track: the tracking index is
+    `tracking_index` at `nominal_interval` seconds and grows with the square of the
+    time, such that frequent (noisy) detections get smaller gains and the velocity
+    noise does not grow when the detector runs more often. Unmatched detections start a new track
+    with a new ID, tracks that were not matched in `max_missed` detector runs in a row
+    are removed. predict returns the tracks at the time of a frame, in the same format
+    as the detections, with their IDs and approach speeds (millimeters per second).
+    """
+
+    def __init__(self, iou_treshold=0.3, tracking_index=0.35, nominal_interval=0.1, max_missed=2, min_hits=1):
+        self.iou_treshold = iou_treshold
+        self.tracking_index = tracking_index
+        self.nominal_interval = nominal_interval
+        self.max_missed = max_missed
+        self.min_hits = min_hits
+
+        # State of the tracks (one row per track)
+        self.ids = np.empty(0, dtype=np.int64)
+        self.labels = np.empty(0, dtype=np.int64)
+        self.confidences = np.empty(0)
+        self.states = np.empty((0, STATE_SIZE))
+        self.velocities = np.empty((0, STATE_SIZE))
+        self.times = np.empty(0)
+        self.missed = np.empty(0, dtype=np.int64)
+        self.hits = np.empty(0, dtype=np.int64)
+        self.next_id = 0
+
+        # Statistics
+        self.frames = self.detector_runs = 0
+        self.matches = self.depth_matches = 0
+        self.iou_sum = self.hold_iou_sum = self.position_error_sum = self.hold_error_sum = self.prediction_time_sum = 0.0
+
+    # Get the state of every track at the given time (constant velocity)
+    def getStates(self, timestamp):
+        return self.states + self.velocities * (timestamp - self.times)[:, None]
+
+    # Get the gains (alpha, beta) of the alpha-beta filter for the time since the previous detection (in seconds)
+    def getGains(self, elapsed):
+        index = self.tracking_index * (elapsed / self.nominal_interval) ** 2
+        r = (4 + index - np.sqrt(8 * index + index ** 2)) / 4
+        alpha = 1 - r ** 2
+        beta = 2 * (2 - alpha) - 4 * np.sqrt(1 - alpha)
+        return alpha, beta
+
+    # Match the detections with the tracks, returns the indices of the matched tracks and detections
+    def associate(self, boxes, measured_boxes, labels):
+        iou = getIoU(boxes, measured_boxes)
+        iou[self.labels[:, None] != labels[None, :]] = 0
+
+        # Greedy matching, starting with the pair with the highest IoU
+        order = np.argsort(iou, axis=None)[::-1]
+        order = order[iou.ravel()[order] >= self.iou_treshold]
+        used_tracks = np.zeros(len(boxes), dtype=bool)
+        used_detections = np.zeros(len(measured_boxes), dtype=bool)
+        tracks, detections = [], []
+        for track, detection in zip(*np.unravel_index(order, iou.shape)):
+            if used_tracks[track] or used_detections[detection]: continue
+            used_tracks[track] = used_detections[detection] = True
+            tracks.append(track)
+            detections.append(detection)
+        return np.array(tracks, dtype=np.int64), np.array(detections, dtype=np.int64)
+
+    # Update the tracks with the detections of a detector run at the given time (in seconds)
+    def update(self, detections, timestamp):
+        self.detector_runs += 1
+        measured = np.concatenate((detections[:, :4], detections[:, [SPATIAL_X, SPATIAL_Y, DEPTH]]), axis=1)
+        labels = detections[:, LABEL].astype(np.int64)
+        predicted = self.getStates(timestamp)
+        tracks, matched = self.associate(predicted[:, BOX], measured[:, BOX], labels)
+
+        if len(tracks) > 0:
+            # Error of the prediction (and of holding the last detection) at this detection
+            has_depth = (measured[matched, 6] > 0) & (self.states[tracks, 6] > 0)
+            self.matches += len(tracks)
+            self.depth_matches += int(has_depth.sum())
+            self.iou_sum += np.diagonal(getIoU(predicted[tracks, BOX], measured[matched, BOX])).sum()
+            self.hold_iou_sum += np.diagonal(getIoU(self.states[tracks, BOX], measured[matched, BOX])).sum()
+            self.position_error_sum += np.linalg.norm(predicted[tracks, POSITION] - measured[matched, POSITION], axis=1)[has_depth].sum()
+            self.hold_error_sum += np.linalg.norm(self.states[tracks, POSITION] - measured[matched, POSITION], axis=1)[has_depth].sum()
+            self.prediction_time_sum += (timestamp - self.times[tracks]).sum()
+
+            # Alpha-beta correction (the position is kept when the detection has no depth)
+            residuals = measured[matched] - predicted[tracks]
+            residuals[measured[matched, 6] <= 0, POSITION] = 0
+            # A track without depth takes the first measured position
+            new_depth = (self.states[tracks, 6] <= 0) & (measured[matched, 6] > 0)
+            elapsed = np.maximum(timestamp - self.times[tracks], 1e-3)
+            alpha, beta = self.getGains(elapsed)
+            self.states[tracks] = predicted[tracks] + alpha[:, None] * residuals
+            self.velocities[tracks] += beta[:, None] * residuals / elapsed[:, None]
+            self.states[tracks[new_depth], POSITION] = measured[matched[new_depth], POSITION]
+            self.velocities[tracks[new_depth], POSITION] = 0
+            self.times[tracks] = timestamp
+            self.confidences[tracks] = detections[matched, CONFIDENCE]
+            self.hits[tracks] += 1
+
+        # Remove the tracks that were missed too often
+        self.missed += 1
+        self.missed[tracks] = 0
+        keep = self.missed <= self.max_missed
+        self.ids, self.labels, self.confidences = self.ids[keep], self.labels[keep], self.confidences[keep]
+        self.states, self.velocities, self.times = self.states[keep], self.velocities[keep], self.times[keep]
+        self.missed, self.hits = self.missed[keep], self.hits[keep]
+
+        # Start a track for every unmatched detection
+        new = np.setdiff1d(np.arange(len(detections)), matched)
+        self.ids = np.concatenate((self.ids, np.arange(self.next_id, self.next_id + len(new))))
+        self.next_id += len(new)
+        self.labels = np.concatenate((self.labels, labels[new]))
+        self.confidences = np.concatenate((self.confidences, detections[new, CONFIDENCE]))
+        self.states = np.concatenate((self.states, measured[new]))
+        self.velocities = np.concatenate((self.velocities, np.zeros((len(new), STATE_SIZE))))
+        self.times = np.concatenate((self.times, np.full(len(new), timestamp)))
+        self.missed = np.concatenate((self.missed, np.zeros(len(new), dtype=np.int64)))
+        self.hits = np.concatenate((self.hits, np.ones(len(new), dtype=np.int64)))
+
+    # Get the tracks at the time of a frame: the detections (see DetectionFusion.toArray), IDs and approach speeds
+    def predict(self, timestamp):
+        self.frames += 1
+        confirmed = self.hits >= self.min_hits
+        states = self.getStates(timestamp)[confirmed]
+
+        detections = np.empty((len(states), 9))
+        detections[:, :4] = np.clip(states[:, BOX], 0, 1)
+        detections[:, [SPATIAL_X, SPATIAL_Y, DEPTH]] = states[:, POSITION]
+        detections[:, LABEL] = self.labels[confirmed]
+        detections[:, CONFIDENCE] = self.confidences[confirmed]
+        # Objects without depth keep a depth of 0 (no depth)
+        detections[self.states[confirmed, 6] <= 0, DEPTH] = 0
+        approach_speeds = -self.velocities[confirmed, 6]
+        return detections, self.ids[confirmed], approach_speeds
+
+    def getStatistics(self):
+        matches, depth_matches = max(self.matches, 1), max(self.depth_matches, 1)
+        return {
+            "frames": self.frames,
+            "detector_runs": self.detector_runs,
+            "load_saved": 1 - self.detector_runs / max(self.frames, 1),
+            "tracks": len(self.ids),
+            "created": self.next_id,
+            "prediction_time": self.prediction_time_sum / matches,
+            "iou": self.iou_sum / matches,
+            "hold_iou": self.hold_iou_sum / matches,
+            "position_error": self.position_error_sum / depth_matches,
+            "hold_position_error": self.hold_error_sum / depth_matches,
+        }
+
+    def getReport(self):
+        statistics = self.getStatistics()
+        return "\n".join([
+            "Frames: {frames}, detector runs: {detector_runs} (detector load saved: {load_saved:.0%})".format(**statistics),
+            "Tracks: {tracks} active, {created} created".format(**statistics),
+            "Prediction error at the next detection (after {:.0f}ms on average):".format(statistics["prediction_time"] * 1000),
+            "  constant velocity: IoU {iou:.2f}, position error {position_error:.0f}mm".format(**statistics),
+            "  last detection:    IoU {hold_iou:.2f}, position error {hold_position_error:.0f}mm".format(**statistics),
+        ])
+
+
+############################## Simulation ##############################
+
+# Simulate objects moving back and forth in view (boxes and spatial positions), returns the states per frame (frames, objects, 7)
+def simulateObjects(count, frames, fps, rng):
+    times = np.arange(frames) / fps
+    size = rng.uniform(0.1, 0.3, (count, 2))
+    # Center and amplitude of the box corner (normalized), spatial x and y, and depth (millimeters)
+    center = np.concatenate((rng.uniform(0.3, 0.5, (count, 2)), rng.uniform(-500, 500, (count, 2)), rng.uniform(3000, 4000, (count, 1))), axis=1)
+    amplitude = np.concatenate((rng.uniform(0, 0.25, (count, 2)), rng.uniform(0, 800, (count, 2)), rng.uniform(500, 2000, (count, 1))), axis=1)
+    frequency = rng.uniform(0.3, 1.2, (count, 5))
+    phase = rng.uniform(0, 2 * np.pi, (count, 5))
+
+    states = center[None] + amplitude[None] * np.sin(times[:, None, None] * frequency[None] + phase[None])
+    boxes = np.concatenate((states[:, :, :2], states[:, :, :2] + size[None]), axis=2)
+    return np.concatenate((boxes, states[:, :, 2:]), axis=2)
+
+# Run the tracker on the simulated objects with the detector on every interval-th frame, returns the per-frame error
+def simulateTracker(objects, interval, fps, rng, box_noise=0.005, position_noise=30, miss_rate=0.05):
+    tracker = ObjectTracker()
+    ious, errors, speed_errors = [], [], []
+    for frame, truth in enumerate(objects):
+        timestamp = frame / fps
+        if frame % interval == 0:
+            detected = truth[rng.random(len(truth)) >= miss_rate]
+            detections = np.zeros((len(detected), 9))
+            detections[:, :4] = detected[:, :4] + rng.normal(0, box_noise, (len(detected), 4))
+            detections[:, [SPATIAL_X, SPATIAL_Y, DEPTH]] = detected[:, 4:] + rng.normal(0, position_noise, (len(detected), 3))
+            detections[:, CONFIDENCE] = 1
+            tracker.update(detections, timestamp)
+
+        detections, _, approach_speeds = tracker.predict(timestamp)
+        if len(detections) == 0 or frame == 0: continue
+        # Compare every object with the track that overlaps it most
+        iou = getIoU(truth[:, :4], detections[:, :4])
+        best = iou.argmax(axis=1)
+        ious.append(iou.max(axis=1).mean())
+        errors.append(np.linalg.norm(truth[:, 4:] - detections[best][:, [SPATIAL_X, SPATIAL_Y, DEPTH]], axis=1).mean())
+        true_speeds = -(objects[frame, :, 6] - objects[frame - 1, :, 6]) * fps
+        speed_errors.append(np.abs(true_speeds - approach_speeds[best]).mean())
+    return tracker, np.mean(ious), np.mean(errors), np.mean(speed_errors)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate the error of the tracker with the detector running on every Nth frame")
+    parser.add_argument("--intervals", type=int, nargs="+", default=[1, 2, 3, 5, 10], help="Detector intervals (in frames)")
+    parser.add_argument("--objects", type=int, default=5, help="Number of simulated objects")
+    parser.add_argument("--frames", type=int, default=600, help="Number of simulated frames")
+    parser.add_argument("--fps", type=float, default=30, help="Frame rate of the camera")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the simulation")
+    args = parser.parse_args()
+
+    objects = simulateObjects(args.objects, args.frames, args.fps, np.random.default_rng(args.seed))
+    print("Objects: {}, frames: {} at {:.0f} fps\n".format(args.objects, args.frames, args.fps))
+    print("{:>8s} {:>11s} {:>9s} {:>11s} {:>13s} {:>7s}".format("Interval", "Load saved", "IoU", "Position", "Approach", "Tracks"))
+    speed_errors = {}
+    for interval in args.intervals:
+        tracker, iou, error, speed_error = simulateTracker(objects, interval, args.fps, np.random.default_rng(args.seed + 1))
+        statistics = tracker.getStatistics()
+        speed_errors[interval] = speed_error
+        print("{:8d} {:11.0%} {:9.3f} {:9.0f}mm {:9.0f}mm/s {:7d}".format(
+            interval, statistics["load_saved"], iou, error, speed_error, statistics["created"]))
+    print("\nPer frame: IoU and position error of the objects, error of the approach speed; tracks: number of created tracks")
+
+    # Running the detector more often should never give worse approach speeds
+    intervals = sorted(speed_errors)
+    worse = [(shorter, longer) for shorter, longer in zip(intervals, intervals[1:]) if speed_errors[shorter] > speed_errors[longer]]
+    for shorter, longer in worse:
+        print("Check failed: approach speed error at interval {} ({:.0f}mm/s) is larger than at interval {} ({:.0f}mm/s)".format(
+            shorter, speed_errors[shorter], longer, speed_errors[longer]))
+    if worse: raise SystemExit(1)
@@ -0,0 +1,156 @@
+import argparse
+import itertools
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from FrameSource import RecordedFrameSource, syntheticFrames
+from GridModel import splitGroups
+from ModelSetup import DEFAULT_SETTINGS, createModel
+from Settings import Settings
+from SleeveHandler import SleeveHandler
+
+'''
+Parameter sweep of the danger model
+  Runs recorded depth frames through the model for every combination of the given settings (the model settings of
+  ModelSetup.py), spread over a pool of worker processes, and ranks the parameter sets by:
+    stability: fraction of consecutive frames with the same sleeve command (higher is calmer)
+    warnings:  fraction of frames with a vibration (and the fraction with the intense vibration)
+    cost:      mean time per frame of the model (in milliseconds)
+  The frames are written once to a .npy file, which the workers memory map (the frames are never pickled).
+  The parameter sets are given as a JSON file with a list of values per setting, e.g.
+    {"BIN_SIZE": [100, 125, 150], "SOFT_TRESHOLD": [15, 20, 25], "GRID_ROWS": [4, 5], "GRID_COLUMNS": [8]}
+  The horizontal and vertical groups are derived from the grid size, unless they are given as well.
+'''
+
+
+############################## Helper Functions ##############################
+
+# Get the settings of every combination of the swept values
+# Skips combinations with unordered tresholds, or a grid that does not fit the frames
+def getParameterSets(sweep, resolution):
+    width, height = resolution
+    names = list(sweep)
+    parameter_sets = []
+    for values in itertools.product(*(sweep[name] for name in names)):
+        parameters = dict(zip(names, values))
+        settings = dict(DEFAULT_SETTINGS, **parameters)
+        if not settings["SOFT_TRESHOLD"] > settings["MEDIUM_TRESHOLD"] > settings["INTENSE_TRESHOLD"]: continue
+        if width % settings["GRID_COLUMNS"] != 0 or height % settings["GRID_ROWS"] != 0: continue
+
+        # Derive the groups from the grid size (the same split as the other tools)
+        if "GRID_COLUMNS" in parameters and "H_LEFT_GROUP" not in parameters:
+            parameters["H_LEFT_GROUP"], parameters["H_CENTER_GROUP"], parameters["H_RIGHT_GROUP"] = splitGroups(settings["GRID_COLUMNS"])
+        if "GRID_ROWS" in parameters and "V_TOP_GROUP" not in parameters:
+            parameters["V_TOP_GROUP"], parameters["V_CENTER_GROUP"], parameters["V_BOTTOM_GROUP"] = splitGroups(settings["GRID_ROWS"])
+        parameter_sets.append(parameters)
+    return parameter_sets
+
+# Write the frames to a .npy file (one frame at a time), which can be memory mapped by the workers
+def storeFrames(frames, path, count, shape):
+    stored = np.lib.format.open_memmap(path, mode="w+", dtype=np.uint16, shape=(count,) + shape)
+    for i, depthFrame in enumerate(frames):
+        stored[i] = depthFrame
+    stored.flush()
+    del stored
+
+
+############################## Worker ##############################
+
+frames = None
+
+# Memory map the frames once per worker
+def initWorker(path):
+    global frames
+    frames = np.load(path, mmap_mode="r")
+
+# Run the model with the given settings on all frames, returns the stability, warning rate and cost
+def evaluate(parameters):
+    settings = Settings(DEFAULT_SETTINGS).merge(parameters)
+    height, width = frames.shape[1:]
+    model = createModel(settings, (width, height))
+
+    commands = []
+    intensities = np.empty(len(frames), dtype=np.int64)
+    start_time = time.perf_counter()
+    for i, depthFrame in enumerate(frames):
+        _, _, command, intensity, _ = model.process(depthFrame)
+        commands.append(command)
+        intensities[i] = intensity
+    elapsed = time.perf_counter() - start_time
+
+    changes = sum(command != previous for command, previous in zip(commands[1:], commands[:-1]))
+    return {
+        "stability": 1 - changes / max(len(commands) - 1, 1),
+        "warnings": float((intensities > 0).mean()),
+        "intense": float((intensities == SleeveHandler.INTENSE).mean()),
+        "cost": elapsed * 1000 / len(frames),
+    }
+
+
+############################## Running the Sweep ##############################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep the settings of the depth model over recorded depth frames")
+    parser.add_argument("recordings", nargs="*", help="Recorded depth frames (.drec recordings or np.save format), synthetic frames are used when omitted")
+    parser.add_argument("--sweep", help="JSON file with a list of values per setting (default: bin size and tresholds around the defaults)")
+    parser.add_argument("--frames", type=int, default=300, help="Number of synthetic frames")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of worker processes")
+    parser.add_argument("--sort", choices=["stability", "warnings", "cost"], default="stability", help="Ranking of the parameter sets")
+    parser.add_argument("--top", type=int, default=20, help="Number of parameter sets in the table")
+    parser.add_argument("--output", help="Store all results as JSON")
+    args = parser.parse_args()
+
+    if args.sweep is not None:
+        with open(args.sweep, "r") as file:
+            sweep = json.load(file)
+    else:
+        sweep = {"BIN_SIZE": [100, 125, 150], "SOFT_TRESHOLD": [15, 20, 25], "MEDIUM_TRESHOLD": [8, 10, 12], "INTENSE_TRESHOLD": [4, 6]}
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "frames.npy")
+        if args.recordings:
+            frameSource = RecordedFrameSource(args.recordings)
+            storeFrames((depthFrame for depthFrame, _ in frameSource), path, len(frameSource.frames), frameSource.shape)
+            frameSource.close()
+        else:
+            depthFrames = syntheticFrames(count=args.frames)
+            storeFrames(depthFrames, path, len(depthFrames), depthFrames.shape[1:])
+        count, height, width = np.load(path, mmap_mode="r").shape
+
+        parameter_sets = getParameterSets(sweep, (width, height))
+        # Check all parameter sets before starting the workers (raises ValueError for unknown settings or wrong types)
+        for parameters in parameter_sets: Settings(DEFAULT_SETTINGS).merge(parameters)
+        # The default settings are evaluated as well, as a baseline
+        parameter_sets.insert(0, {})
+
+        print("Frames: {} ({}x{}), parameter sets: {}, workers: {}".format(count, width, height, len(parameter_sets), args.workers))
+        start_time = time.perf_counter()
+        with ProcessPoolExecutor(args.workers, initializer=initWorker, initargs=(path,)) as executor:
+            results = list(executor.map(evaluate, parameter_sets))
+        print("Sweep time: {:.1f}s\n".format(time.perf_counter() - start_time))
+
+
+    # Print the ranked table (higher stability, fewer warnings, lower cost)
+    order = {
+        "stability": lambda i: (-results[i]["stability"], results[i]["cost"]),
+        "warnings": lambda i: (results[i]["warnings"], -results[i]["stability"]),
+        "cost": lambda i: (results[i]["cost"], -results[i]["stability"]),
+    }[args.sort]
+    ranking = sorted(range(len(parameter_sets)), key=order)
+
+    print("{:>4s} {:>9s} {:>9s} {:>9s} {:>9s}  {}".format("Rank", "Stability", "Warnings", "Intense", "Cost", "Settings"))
+    for rank, i in enumerate(ranking[:args.top], 1):
+        result = results[i]
+        settings = ", ".join("{}={}".format(name, value) for name, value in parameter_sets[i].items() if not name.endswith("_GROUP"))
+        print("{:4d} {:9.1%} {:9.1%} {:9.1%} {:7.3f}ms  {}".format(
+            rank, result["stability"], result["warnings"], result["intense"], result["cost"], settings if i > 0 else "(default settings)"))
+    print("\nDefault settings: rank {} of {}".format(ranking.index(0) + 1, len(ranking)))
+
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump([dict(parameters=parameters, **result) for parameters, result in zip(parameter_sets, results)], file, indent=2)
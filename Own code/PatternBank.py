@@ -0,0 +1,74 @@
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+from os import listdir, path
+
+import numpy as np
+
+# Define Constants
+PATTERNS_DIR = path.join(path.dirname(path.abspath(__file__)), "Sleeve", "patterns")
+MAX_COORDINATE = 1023
+MAX_INTENSITY = 15
+
+
+# The actions of a pattern, every field is an array with a value per action (times and durations in milliseconds)
+Pattern = namedtuple("Pattern", ["times", "durations", "circumference", "vertical", "intensities"])
+
+
+# Read a pattern file into arrays
+def readPattern(filename):
+    actions = ET.parse(filename).getroot().iter("Action")
+    values = np.array([[int(action.findtext(tag)) for tag in ("Time", "Duration", "circumferenceCoor", "verticalCoor", "Intensity")]
+                       for action in actions], dtype=np.int64).reshape(-1, 5)
+    return Pattern(*values.T)
+
+
+class PatternBank:
+    """
+    The sleeve patterns (Sleeve/patterns/*.xml), parsed once into arrays.
+
+    Applies the parameters of a !PlayPattern command (intensityIncrease, coordinate
+    offsets, invertHorizontal and invertVertical) to a pattern like the sleeve server,
+    such that the duration of a command is known without asking the server.
+    Actions whose intensity drops to 0 are not played, so they do not count towards the
+    duration. The durations are cached per command.
+    """
+
+    def __init__(self, pattern_dir=PATTERNS_DIR, tactile_intensity=0):
+        self.tactile_intensity = tactile_intensity
+        self.patterns = {filename[:-len(".xml")]: readPattern(path.join(pattern_dir, filename))
+                         for filename in sorted(listdir(pattern_dir)) if filename.endswith(".xml")}
+        self.durations = {}
+
+    # Parse a command into the pattern name and the parameters, raises ValueError for unknown commands
+    def parseCommand(self, command):
+        parts = command.strip().split(",")
+        if parts[0] != "!PlayPattern" or len(parts) < 2 or parts[1] not in self.patterns:
+            raise ValueError("Unknown command: {}".format(command))
+
+        parameters = {}
+        for part in parts[2:]:
+            key, value = part.split("=", 1)
+            parameters[key] = value
+        return parts[1], parameters
+
+    # Get the actions of a command, with its parameters applied
+    def apply(self, command):
+        name, parameters = self.parseCommand(command)
+        pattern = self.patterns[name]
+
+        intensity_increase = int(parameters.get("intensityIncrease", 0)) + self.tactile_intensity
+        circumference = -pattern.circumference if parameters.get("invertHorizontal", "false") == "true" else pattern.circumference
+        vertical = -pattern.vertical if parameters.get("invertVertical", "false") == "true" else pattern.vertical
+
+        return Pattern(pattern.times, pattern.durations,
+                       (circumference + int(parameters.get("circumferenceCoorOffset", 0))) % (MAX_COORDINATE + 1),
+                       np.clip(vertical + int(parameters.get("verticalCoorOffset", 0)), 0, MAX_COORDINATE),
+                       np.clip(pattern.intensities + intensity_increase, 0, MAX_INTENSITY))
+
+    # Get the duration of a command in seconds (the end of the last played action)
+    def getDuration(self, command):
+        if command not in self.durations:
+            actions = self.apply(command)
+            played = actions.intensities > 0
+            self.durations[command] = (actions.times + actions.durations)[played].max(initial=0) / 1000
+        return self.durations[command]
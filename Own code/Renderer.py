@@ -0,0 +1,170 @@
+import time
+
+import cv2
+import numpy as np
+
+
+class Renderer:
+    """
+    Renders the visualization of the model at its own rate (render_rate frames per second).
+
+    The depth frame is colorized with a single lookup table from depth (millimeters) to
+    color, which combines the normalization, the histogram equalization and the colormap.
+    The lookup table is rebuilt from the current frame every `equalize_interval` rendered
+    frames, instead of equalizing every frame.
+    The grid is drawn once into a table of pixel indices per cell, such that drawing the
+    grid is a single indexed assignment. The labels (cell values) are only redrawn when
+    the value of a cell changes, the pixels of every text are cached. The colors and the
+    image are written into preallocated buffers, so the returned image is reused by the
+    next render.
+    """
+
+    def __init__(self, model, colormap, render_rate=15, equalize_interval=30, colormap_type=cv2.COLORMAP_OCEAN):
+        self.model = model
+        self.colormap = colormap
+        self.render_interval = 1 / render_rate if render_rate else 0
+        self.equalize_interval = equalize_interval
+        self.next_render = 0
+        self.rendered = 0
+
+        # Color of every equalized gray value (BGR), shape (256, 3)
+        self.gray_colors = cv2.applyColorMap(np.arange(256, dtype=np.uint8)[:, None], colormap_type)[:, 0]
+        self.lut = None
+
+        # Buffers of the packed colors and the image (BGR), reused every frame
+        width, height = model.resolution
+        self.packed = np.empty((height, width), dtype=np.uint32)
+        self.image = np.empty((height, width, 3), dtype=np.uint8)
+
+        # Color of every danger level (BGR, and packed like the lookup table)
+        self.palette = np.zeros((len(colormap), 4), dtype=np.uint8)
+        self.palette[:, :3] = [colormap[level] for level in sorted(colormap)]
+        self.packed_palette = self.palette.view(np.uint32).ravel()
+
+        # Pixels of the grid lines, drawn like cv2.rectangle (later cells are drawn over earlier cells)
+        grid_indices, grid_cells = [], []
+        for i, (pos, size) in enumerate(model.grid):
+            mask = np.zeros((height, width), dtype=np.uint8)
+            cv2.rectangle(mask, pos, size, 255, cv2.FONT_HERSHEY_SIMPLEX)
+            indices = np.flatnonzero(mask)
+            grid_indices.append(indices)
+            grid_cells.append(np.full(len(indices), i))
+        self.grid_indices = np.concatenate(grid_indices)
+        self.grid_cells = np.concatenate(grid_cells)
+
+        # Labels of the cells: drawn pixels (indices), their coverage and the cell, redrawn when a cell changes
+        self.labels = [None] * len(model.grid)
+        self.label_pixels = [(np.empty(0, dtype=np.intp), np.empty(0))] * len(model.grid)
+        self.opaque_indices = self.opaque_cells = None
+        self.blend_indices = self.blend_alpha = self.blend_cells = None
+        # Pixels of every text (relative to the text origin), cached per text
+        self.texts = {}
+
+    # Check whether the next frame should be rendered
+    def isDue(self):
+        return time.monotonic() >= self.next_render
+
+    # Wait until the next frame should be rendered
+    def wait(self):
+        delay = self.next_render - time.monotonic()
+        if delay > 0: time.sleep(delay)
+
+    # Build the lookup table from depth to color, equal to normalize, equalizeHist and applyColorMap on the frame
+    def updateLookupTable(self, depthFrame):
+        # Equalized value of every gray value in the frame
+        gray = cv2.normalize(depthFrame, None, 255, 0, cv2.NORM_INF, cv2.CV_8UC1)
+        equalized = np.zeros(256, dtype=np.uint8)
+        equalized[gray.ravel()] = cv2.equalizeHist(gray).ravel()
+        # Gray values that are not in the frame get the equalized value of the next lower gray value
+        present = np.zeros(256, dtype=bool)
+        present[gray.ravel()] = True
+        equalized = equalized[np.maximum.accumulate(np.where(present, np.arange(256), 0))]
+
+        # Gray value of every depth (normalized to the maximum depth of the frame)
+        depths = np.arange(np.iinfo(np.uint16).max + 1)
+        depth_gray = np.minimum(np.round(depths * 255 / max(int(depthFrame.max()), 1)), 255).astype(np.uint8)
+        # Store the colors (BGR + padding) packed in 32 bits, such that the lookup is a single take
+        colors = np.zeros((len(depths), 4), dtype=np.uint8)
+        colors[:, :3] = self.gray_colors[equalized[depth_gray]]
+        self.lut = colors.view(np.uint32).ravel()
+
+    # Colorize the depth frame using the lookup table, returns the packed colors (in the reused buffer)
+    def colorize(self, depthFrame):
+        if self.lut is None or self.rendered % self.equalize_interval == 0:
+            self.updateLookupTable(depthFrame)
+        # Every depth is in the table, clip avoids the buffered copy of the bounds check
+        return np.take(self.lut, depthFrame, out=self.packed, mode="clip")
+
+    # Convert the packed colors into an image (BGR, in the reused buffer)
+    def unpack(self, packed):
+        return cv2.cvtColor(packed.view(np.uint8).reshape(*packed.shape, 4), cv2.COLOR_BGRA2BGR, dst=self.image)
+
+    # Get the pixels (rows, columns relative to the origin) and their coverage of a text
+    def getText(self, text):
+        if text not in self.texts:
+            (width, height), baseline = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 1)
+            patch = np.zeros((height + baseline + 2, width + 2), dtype=np.uint8)
+            cv2.putText(patch, text, (1, height + 1), cv2.FONT_HERSHEY_SIMPLEX, 0.5, 255)
+            rows, columns = np.nonzero(patch)
+            self.texts[text] = (rows - height - 1, columns - 1, patch[rows, columns] / 255)
+        return self.texts[text]
+
+    # Redraw the labels of the cells whose value changed
+    def updateLabels(self, values):
+        width, height = self.model.resolution
+        changed = False
+        for i, (pos, size) in enumerate(self.model.grid):
+            label = str(values[i])
+            if label == self.labels[i]: continue
+            self.labels[i] = label
+            changed = True
+
+            # Place the text in the cell (like cv2.putText, the pixels outside the frame are dropped)
+            rows, columns, alpha = self.getText(label)
+            rows, columns = rows + size[1] - 5, columns + pos[0] + 5
+            inside = (rows >= 0) & (rows < height) & (columns >= 0) & (columns < width)
+            self.label_pixels[i] = (rows[inside] * width + columns[inside], alpha[inside])
+
+        if changed or self.opaque_indices is None:
+            indices = np.concatenate([indices for indices, _ in self.label_pixels])
+            alpha = np.concatenate([alpha for _, alpha in self.label_pixels])
+            cells = np.concatenate([np.full(len(indices), i) for i, (indices, _) in enumerate(self.label_pixels)])
+
+            # Fully covered pixels are set, the anti-aliased edges are blended with the frame
+            opaque = alpha == 1
+            self.opaque_indices, self.opaque_cells = indices[opaque], cells[opaque]
+            self.blend_indices, self.blend_alpha, self.blend_cells = indices[~opaque], alpha[~opaque, None], cells[~opaque]
+
+    # Draw lines of text in the top left corner of the image (e.g. the latency report)
+    def drawLines(self, image, lines, color=(255, 255, 255)):
+        for i, line in enumerate(lines):
+            cv2.putText(image, line, (5, 15 + 15 * i), cv2.FONT_HERSHEY_PLAIN, 0.9, color)
+
+    # Render the result of the model, returns the image
+    def render(self, depthFrame, values, danger_levels, command, intensity, endpoint, show_grid=False, show_arrow=True):
+        self.next_render = max(self.next_render + self.render_interval, time.monotonic())
+        packed = self.colorize(depthFrame)
+        self.rendered += 1
+
+        # Display the grid layout and information
+        if show_grid:
+            danger_levels = np.asarray(danger_levels)
+            pixels = packed.ravel()
+            pixels[self.grid_indices] = self.packed_palette[danger_levels[self.grid_cells]]
+
+            self.updateLabels(values)
+            pixels[self.opaque_indices] = self.packed_palette[danger_levels[self.opaque_cells]]
+            channels = pixels.view(np.uint8).reshape(-1, 4)
+            background = channels[self.blend_indices, :3].astype(np.float64)
+            colors = self.palette[danger_levels[self.blend_cells], :3]
+            channels[self.blend_indices, :3] = np.round(background + self.blend_alpha * (colors - background))
+        image = self.unpack(packed)
+
+        # Display the output arrow
+        if show_arrow:
+            center_point = self.model.center_point
+            if endpoint != center_point:
+                cv2.arrowedLine(image, center_point, endpoint, self.colormap[intensity], 3)
+            elif command != "":
+                cv2.circle(image, center_point, 10, self.colormap[intensity], 3)
+        return image
@@ -0,0 +1,66 @@
+import argparse
+import time
+
+import numpy as np
+
+from FrameSource import RecordedFrameSource
+from ModelSetup import DEFAULT_SETTINGS, createModel, getDeviceDecimation, getDeviceResolution
+from Settings import Settings
+
+'''
+Headless replay of the depth model
+  Runs recorded depth frames (recorded sessions or the stored_depthFrame.bin snapshots) through the model as fast as possible,
+  without visualization or sleeve, and reports the throughput of the model in frames per second. The model is created
+  from the same settings as the live model (DEFAULT_SETTINGS of ModelSetup.py, overridden by the settings file).
+'''
+
+parser = argparse.ArgumentParser(description="Replay recorded depth frames through the depth model (headless)")
+parser.add_argument("recordings", nargs="*", default=["stored_depthFrame.bin"], help="Recorded depth frames (.drec recordings or np.save format)")
+parser.add_argument("--settings", default="settings.json", help="Settings file (JSON) overriding the default settings, like in Depth Model.py")
+parser.add_argument("--repeat", type=int, default=100, help="Number of times the recorded frames are replayed")
+parser.add_argument("--reference", action="store_true", help="Use the original blockshaped/measure implementation")
+parser.add_argument("--incremental", action="store_true", help="Only recompute the cells whose depth changed")
+parser.add_argument("--adaptive", action="store_true", help="Adapt the tresholds to the environment")
+parser.add_argument("--steps", action="store_true", help="Detect missing floor ahead (steps going down) and report its cost")
+parser.add_argument("--verbose", action="store_true", help="Print the output command of every frame")
+args = parser.parse_args()
+
+
+frameSource = RecordedFrameSource(args.recordings, repeat=args.repeat)
+height, width = frameSource.shape
+
+# The options override the settings
+settings = dict(Settings(DEFAULT_SETTINGS, args.settings).values)
+if args.incremental: settings["INCREMENTAL_MODEL"] = True
+if args.adaptive: settings["ADAPTIVE_TRESHOLDS"] = True
+if args.steps: settings["STEP_DETECTION"] = True
+# Frames recorded with DECIMATE_ON_DEVICE were already decimated by the camera
+device_decimation = getDeviceDecimation(settings) if (width, height) == getDeviceResolution(settings) else 1
+model = createModel(settings, (width, height), device_decimation)
+
+frame_count = 0
+commands = {}
+start_time = time.perf_counter()
+
+for depthFrame, timestamp in frameSource:
+    values, danger_levels, command, intensity, endpoint = model.process(depthFrame, reference=args.reference)
+
+    commands[command] = commands.get(command, 0) + 1
+    if args.verbose:
+        print("{:6d} {}".format(frame_count, command if command != "" else "NONE"))
+
+    frame_count += 1
+
+elapsed = time.perf_counter() - start_time
+
+
+# Print the results
+print("Frames: {} ({}x{}), Time: {:.3f}s, FPS: {:.2f}".format(frame_count, width, height, elapsed, frame_count / elapsed))
+if model.adaptive is not None:
+    print("Adaptive tresholds (soft, medium, intense): scale {:.2f}, mean per cell {}".format(model.adaptive.scale, np.round(model.adaptive.tresholds.mean(axis=1), 1)))
+if model.incremental is not None:
+    print("Recomputed cells: {:.1%}".format(model.incremental.getRecomputeRate()))
+if model.stepDetector is not None:
+    print(model.stepDetector.getCostReport())
+for command, count in sorted(commands.items(), key=lambda item: -item[1]):
+    print("{:6d}x {}".format(count, command if command != "" else "NONE"))
@@ -8,6 +8,12 @@ import depthai as dai
 import numpy as np
 import time
 
+from DetectionFusion import DetectionFusion, toArray, XMIN, YMIN, XMAX, YMAX, DEPTH, LABEL, SPATIAL_X
+from GridModel import GridModel
+from ObjectTracker import ObjectTracker
+from SleeveHandler import SleeveHandler
+from StreamSync import StreamSync
+
 '''
 Spatial Tiny-yolo example
   Performs inference on RGB camera and retrieves spatial location coordinates: x,y,z relative to the center of depth map.
@@ -53,6 +59,17 @@ nn_preview_resolution = (1024, 576)
 nn_resolution = (416, 416)
 IOU = 0.3
 CONF = 0.3
+NN_INTERVAL = 3 # Run the detection network on every NN_INTERVAL-th frame, the objects are tracked in between
+resolution = (640, 360) # Resolution of the depth frames (aligned to the rgb camera, same aspect ratio as the preview), used to create the grid
+CLASS_BOOSTS = {"person": 4} # Danger boost of a class in bins of the model (4 bins of 125mm: a person counts as 0.5m closer)
+SEND_TO_SLEEVE = True # Send the output signal of the model (with the fused detections) to the sleeve
+
+colormap = {
+    SleeveHandler.OFF:     (255, 255, 255),
+    SleeveHandler.SOFT:    (0, 255, 0),
+    SleeveHandler.MEDIUM:  (0, 204, 255),
+    SleeveHandler.INTENSE: (0, 0, 255)
+}
 
 
 
@@ -83,11 +100,23 @@ camRgb.setInterleaved(False)
 camRgb.setColorOrder(dai.ColorCameraProperties.ColorOrder.BGR)
 
 
+# Only pass every NN_INTERVAL-th frame on to the detection network
+frameSkip = pipeline.create(dai.node.Script)
+frameSkip.inputs['in'].setBlocking(False)
+frameSkip.inputs['in'].setQueueSize(1)
+frameSkip.setScript(f"""
+while True:
+    frame = node.io['in'].get()
+    if frame.getSequenceNum() % {NN_INTERVAL} == 0:
+        node.io['out'].send(frame)
+""")
+
 # Squeeze the frame
 manip = pipeline.create(dai.node.ImageManip)
 manip.setMaxOutputFrameSize(prod(nn_resolution) * 3) # 416x416x3
 manip.initialConfig.setResizeThumbnail(nn_resolution)
-camRgb.preview.link(manip.inputImage)
+camRgb.preview.link(frameSkip.inputs['in'])
+frameSkip.outputs['out'].link(manip.inputImage)
 camRgb.preview.link(xoutRgb.input)
 
 
@@ -98,6 +127,11 @@ monoRight.setBoardSocket(dai.CameraBoardSocket.RIGHT)
 
 # setting node configs
 stereo.setDefaultProfilePreset(dai.node.StereoDepth.PresetMode.HIGH_DENSITY)
+# Align the depth frames to the rgb camera, such that the detections (normalized to the rgb frame) map onto the same
+# part of the depth frame and the grid, the mono cameras have a different field of view and aspect ratio
+stereo.setLeftRightCheck(True)
+stereo.setDepthAlign(dai.CameraBoardSocket.RGB)
+stereo.setOutputSize(*resolution)
 
 spatialDetectionNetwork.setBlobPath(nnBlobPath)
 spatialDetectionNetwork.setConfidenceThreshold(CONF)
@@ -123,7 +157,8 @@ spatialDetectionNetwork.out.link(xoutNN.input)
 spatialDetectionNetwork.boundingBoxMapping.link(xoutBoundingBoxDepthMapping.input)
 
 stereo.depth.link(spatialDetectionNetwork.inputDepth)
-spatialDetectionNetwork.passthroughDepth.link(xoutDepth.input)
+# The depth frames are sent directly (the passthrough of the network only sends the frames that were detected on)
+stereo.depth.link(xoutDepth.input)
 
 # Function to show the relative position of a mouse press in the rgb view
 def showPos(event, x, y, flags, param, height, width, layers):
@@ -144,6 +179,19 @@ def correctBlackBars(y):
 
 init_iter = True
 
+# Danger model of the depth frames, with the detections fused into the danger levels of the grid
+model = GridModel(resolution)
+model.detectionFusion = DetectionFusion(model, CLASS_BOOSTS, labelMap, letterbox=nn_preview_resolution)
+
+# Tracker of the detected objects, predicts the objects on the frames between the detections
+tracker = ObjectTracker()
+
+# Sleeve that receives the output signal of the model
+sleeveHandler = None
+if SEND_TO_SLEEVE:
+    sleeveHandler = SleeveHandler()
+    sleeveHandler.preloadCommands(model.getCommands())
+
 
 # Connect to device and start pipeline
 with dai.Device(pipeline, usb2Mode=True) as device:
@@ -154,15 +202,35 @@ with dai.Device(pipeline, usb2Mode=True) as device:
     xoutBoundingBoxDepthMappingQueue = device.getOutputQueue(name="boundingBoxDepthMapping", maxSize=4, blocking=False)
     depthQueue = device.getOutputQueue(name="depth", maxSize=4, blocking=False)
 
+    # Match the messages of the queues by timestamp (the bounding box mapping is only sent when there are detections)
+    # The frames are matched separately from the detections, which only arrive for every NN_INTERVAL-th frame
+    streamSync = StreamSync({"rgb": previewQueue, "depth": depthQueue})
+    detectionSync = StreamSync(
+        {"detections": detectionNNQueue, "boundingBoxDepthMapping": xoutBoundingBoxDepthMappingQueue},
+        conditional={"boundingBoxDepthMapping": lambda bundle: len(bundle["detections"].detections) != 0})
+    roiDatas = []
+
     startTime = time.monotonic()
     counter = 0
     fps = 0
     color = (255, 255, 255)
 
     while True:
-        inPreview = previewQueue.get()
-        inDet = detectionNNQueue.get()
-        depth = depthQueue.get()
+        # Update the tracker with the detections of the last network run
+        detectionBundle = detectionSync.tryGet()
+        if detectionBundle is not None:
+            inDet = detectionBundle["detections"]
+            tracker.update(toArray(inDet.detections), inDet.getTimestamp().total_seconds())
+            boundingBoxMapping = detectionBundle["boundingBoxDepthMapping"]
+            roiDatas = [] if boundingBoxMapping is None else boundingBoxMapping.getConfigData()
+
+        bundle = streamSync.get(timeout=0.1)
+        if bundle is None:
+            # Keep the windows responsive while waiting for matching messages
+            if cv2.waitKey(1) == ord('q'):
+                break
+            continue
+        inPreview, depth = bundle["rgb"], bundle["depth"]
 
         frame = inPreview.getCvFrame()
         depthFrame = depth.getFrame() # depthFrame values are in millimeters
@@ -178,42 +246,51 @@ with dai.Device(pipeline, usb2Mode=True) as device:
             counter = 0
             startTime = current_time
 
-        detections = inDet.detections
-        if len(detections) != 0:
-            boundingBoxMapping = xoutBoundingBoxDepthMappingQueue.get()
-            roiDatas = boundingBoxMapping.getConfigData()
-
-            for roiData in roiDatas:
-                roi = roiData.roi
-                roi = roi.denormalize(depthFrameColor.shape[1], depthFrameColor.shape[0])
-                topLeft = roi.topLeft()
-                bottomRight = roi.bottomRight()
-                xmin = int(topLeft.x)
-                ymin = int(topLeft.y)
-                xmax = int(bottomRight.x)
-                ymax = int(bottomRight.y)
-
-                cv2.rectangle(depthFrameColor, (xmin, ymin), (xmax, ymax), color, cv2.FONT_HERSHEY_SCRIPT_SIMPLEX)
-
+        # Predict the tracked objects at the time of the frame
+        detections, ids, approach_speeds = tracker.predict(inPreview.getTimestamp().total_seconds())
+
+        # Draw the depth regions of the last network run
+        for roiData in roiDatas:
+            roi = roiData.roi
+            roi = roi.denormalize(depthFrameColor.shape[1], depthFrameColor.shape[0])
+            topLeft = roi.topLeft()
+            bottomRight = roi.bottomRight()
+            xmin = int(topLeft.x)
+            ymin = int(topLeft.y)
+            xmax = int(bottomRight.x)
+            ymax = int(bottomRight.y)
+
+            cv2.rectangle(depthFrameColor, (xmin, ymin), (xmax, ymax), color, cv2.FONT_HERSHEY_SCRIPT_SIMPLEX)
+
+        # Fuse the detections into the grid model and draw the danger levels and output signal on the depth frame
+        values, danger_levels, command, intensity, endpoint = model.process(depthFrame, detections=detections)
+        if sleeveHandler is not None and command != "":
+            sleeveHandler.processSignal(command, intensity)
+        for (topLeft, bottomRight), level in zip(model.grid, danger_levels):
+            if level > SleeveHandler.OFF:
+                cv2.rectangle(depthFrameColor, topLeft, bottomRight, colormap[level], 2)
+        if endpoint != model.center_point:
+            cv2.arrowedLine(depthFrameColor, model.center_point, endpoint, colormap[intensity], 3)
+        elif command != "":
+            cv2.circle(depthFrameColor, model.center_point, 10, colormap[intensity], 3)
 
         # If the frame is available, draw bounding boxes on it and show the frame      
         height, width, _ = frame.shape
-        for detection in detections:
+        for detection, object_id, approach_speed in zip(detections, ids, approach_speeds):
             # Denormalize bounding box
-            x1 = int(detection.xmin * width)
-            x2 = int(detection.xmax * width)
+            x1 = int(detection[XMIN] * width)
+            x2 = int(detection[XMAX] * width)
 
-            y1 = int(correctBlackBars(detection.ymin) * height)
-            y2 = int(correctBlackBars(detection.ymax) * height)
+            y1 = int(correctBlackBars(detection[YMIN]) * height)
+            y2 = int(correctBlackBars(detection[YMAX]) * height)
 
             try:
-                label = labelMap[detection.label]
+                label = labelMap[int(detection[LABEL])]
             except:
-                label = detection.label
+                label = int(detection[LABEL])
 
 
-            coords = detection.spatialCoordinates
-            x,y,z = int(coords.x), int(coords.y), int(coords.z)
+            x, z = int(detection[SPATIAL_X]), int(detection[DEPTH])
             if x < -150:
                 pos_color = (255,0,0)
             elif x > 150:
@@ -229,13 +306,14 @@ with dai.Device(pipeline, usb2Mode=True) as device:
                 thickness = cv2.FONT_HERSHEY_SIMPLEX
 
 
-            cv2.putText(frame, str(label), (x1 + 10, y1 + 20), cv2.FONT_HERSHEY_TRIPLEX, 0.5, 255)
+            cv2.putText(frame, f"{label} {object_id}", (x1 + 10, y1 + 20), cv2.FONT_HERSHEY_TRIPLEX, 0.5, 255)
             cv2.putText(frame, f"X: {x} mm", (x1 + 10, y1 + 40), cv2.FONT_HERSHEY_TRIPLEX, 0.5, pos_color)
             cv2.putText(frame, f"Z: {z} mm", (x1 + 10, y1 + 60), cv2.FONT_HERSHEY_TRIPLEX, 0.5, det_color)
+            cv2.putText(frame, f"Approach: {int(approach_speed)} mm/s", (x1 + 10, y1 + 80), cv2.FONT_HERSHEY_TRIPLEX, 0.5, det_color)
 
             cv2.rectangle(frame, (x1, y1), (x2, y2), det_color, thickness)
 
-        cv2.putText(frame, "NN fps: {:.2f}".format(fps), (2, frame.shape[0] - 4), cv2.FONT_HERSHEY_TRIPLEX, 0.4, color)
+        cv2.putText(frame, "fps: {:.2f} (NN on every {} frames)".format(fps, NN_INTERVAL), (2, frame.shape[0] - 4), cv2.FONT_HERSHEY_TRIPLEX, 0.4, color)
         cv2.imshow("depth", depthFrameColor)
         cv2.imshow("rgb", frame)
 
@@ -245,3 +323,10 @@ with dai.Device(pipeline, usb2Mode=True) as device:
 
         if cv2.waitKey(1) == ord('q'):
             break
+
+    print(streamSync.getReport())
+    print(detectionSync.getReport())
+    print(tracker.getReport())
+
+if sleeveHandler is not None:
+    sleeveHandler.close()
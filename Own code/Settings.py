@@ -0,0 +1,70 @@
+import json
+import os
+
+
+class Settings:
+    """
+    Settings store: the default settings (e.g. DEFAULT_SETTINGS of ModelSetup.py) overridden
+    by the settings in a JSON file, which can be reloaded while running.
+
+    The file only has to contain the changed settings. Unknown settings and values of a
+    different type than the default are rejected (ValueError), such that a typo in the
+    file never replaces a working configuration. Only settings with a default of None
+    accept None (and any other value), booleans are not accepted as numbers. Reloading returns the names of the
+    settings that changed, so the caller only rebuilds what depends on them.
+    """
+
+    def __init__(self, defaults, path=None):
+        self.defaults = dict(defaults)
+        self.path = path
+        self.mtime = self.getModifiedTime()
+        self.values = self.load()
+
+    def __getitem__(self, name):
+        return self.values[name]
+
+    def getModifiedTime(self):
+        if self.path is None or not os.path.exists(self.path): return None
+        return os.stat(self.path).st_mtime
+
+    # Check whether the file was changed (or created/removed) since it was last loaded
+    def hasChanged(self):
+        return self.getModifiedTime() != self.mtime
+
+    # Get the defaults overridden by the settings in the file
+    def load(self):
+        if self.path is None or not os.path.exists(self.path): return dict(self.defaults)
+
+        try:
+            with open(self.path, "r") as file:
+                overrides = json.load(file)
+        except json.JSONDecodeError as e:
+            raise ValueError("Invalid settings file {}: {}".format(self.path, e))
+        return self.merge(overrides)
+
+    # Get the defaults overridden by the given settings (checked like the settings in the file)
+    def merge(self, overrides):
+        values = dict(self.defaults)
+        for name, value in overrides.items():
+            if name not in self.defaults:
+                raise ValueError("Unknown setting: {}".format(name))
+            default = self.defaults[name]
+            # Optional settings (default None) accept any value, integers are accepted for floats, booleans are no numbers
+            if default is not None and not self.isValid(value, default):
+                raise ValueError("Invalid value for {}: {!r} (expected {})".format(name, value, type(default).__name__))
+            values[name] = value
+        return values
+
+    # Check whether a value has the type of the default value
+    def isValid(self, value, default):
+        if isinstance(value, bool) != isinstance(default, bool): return False
+        if isinstance(default, float) and isinstance(value, int): return True
+        return isinstance(value, type(default))
+
+    # Reload the file, returns the names of the changed settings (the settings are unchanged when the file is invalid)
+    def reload(self):
+        self.mtime = self.getModifiedTime()
+        values = self.load()
+        changed = {name for name, value in values.items() if value != self.values[name]}
+        self.values = values
+        return changed
@@ -0,0 +1,85 @@
+import argparse
+import random
+import time
+
+from SleeveHandler import SleeveHandler, STATUS_ERROR
+from SleeveServer import SleeveServer, BUSY_INTERRUPT, BUSY_QUEUE, BUSY_REJECT
+from GridModel import GridModel
+from LatencyMonitor import LatencyMonitor
+
+'''
+Load test of the SleeveHandler
+  Sends commands to a sleeve server (the SleeveServer stand-in, or a running server with --address) and reports the
+  command throughput and the latency percentiles of the replies.
+    roundtrip: every command waits for its reply before the next command is sent (maximum command throughput)
+    stream:    the output commands of the model are passed to processSignal at a fixed rate, like Depth Model.py
+'''
+
+parser = argparse.ArgumentParser(description="Benchmark the command throughput and latency of the SleeveHandler")
+parser.add_argument("--mode", choices=["roundtrip", "stream"], default="stream", help="Benchmark mode")
+parser.add_argument("--address", help="Address (ip:port) of a running sleeve server, a stand-in server is started when omitted")
+parser.add_argument("--duration", type=float, default=10, help="Duration of the benchmark in seconds")
+parser.add_argument("--rate", type=float, default=30, help="Number of signals per second (stream mode)")
+parser.add_argument("--latency", type=float, default=0.005, help="Delay (in seconds) before every reply of the stand-in server")
+parser.add_argument("--jitter", type=float, default=0.01, help="Random extra delay (in seconds) of the stand-in server")
+parser.add_argument("--loss", type=float, default=0.0, help="Probability that the stand-in server drops a command")
+parser.add_argument("--busy", choices=[BUSY_INTERRUPT, BUSY_QUEUE, BUSY_REJECT], default=BUSY_INTERRUPT, help="Busy behaviour of the stand-in server")
+parser.add_argument("--seed", type=int, default=0, help="Seed of the random commands and faults")
+args = parser.parse_args()
+
+
+# Start the stand-in server (on a free port)
+server = None
+if args.address is None:
+    server = SleeveServer(port=0, latency=args.latency, jitter=args.jitter, loss=args.loss, busy=args.busy, seed=args.seed).start()
+    ip, port = server.address[:2]
+else:
+    ip, port = args.address.split(":")
+    port = int(port)
+
+sleeveHandler = SleeveHandler(ip, port)
+sleeveHandler.latency = latency = LatencyMonitor(window=args.duration + 5)
+# All output commands of the model, with their intensity
+model = GridModel()
+commands = model.getCommands()
+outputs = sorted({(command, intensity) for v_commands in model.command_table for intensities in v_commands
+                  for intensity, command in enumerate(intensities) if command != ""})
+sleeveHandler.preloadCommands(commands)
+rng = random.Random(args.seed)
+
+signals = errors = 0
+start_time = time.monotonic()
+end_time = start_time + args.duration
+
+if args.mode == "roundtrip":
+    while time.monotonic() < end_time:
+        status, _ = sleeveHandler.sendCommand(rng.choice(commands), wait=True, force=True)
+        signals += 1
+        errors += status == STATUS_ERROR
+        # Back off like the transport, when the server does not respond
+        if sleeveHandler.transport.isBackingOff(): time.sleep(0.1)
+else:
+    next_time = start_time
+    while time.monotonic() < end_time:
+        sleeveHandler.processSignal(*rng.choice(outputs))
+        signals += 1
+        next_time += 1 / args.rate
+        time.sleep(max(next_time - time.monotonic(), 0))
+
+# Wait for the last replies
+time.sleep(sleeveHandler.transport.timeout)
+elapsed = time.monotonic() - start_time
+sleeveHandler.close()
+if server is not None: server.close()
+
+
+# Print the results
+transport = sleeveHandler.transport
+print("Mode: {}, duration: {:.1f}s, signals: {}".format(args.mode, elapsed, signals))
+print("Commands sent: {} ({:.1f}/s), replied: {}, timeouts: {}, late: {}, lost: {}, uncertain: {}, skipped (backing off): {}, errors: {}".format(
+    transport.sent, transport.sent / elapsed, transport.replied, transport.timeouts, transport.late, transport.lost, transport.uncertain, transport.skipped, errors))
+print("Replies with a different duration than predicted: {}".format(sleeveHandler.mispredicted))
+if server is not None:
+    print("Server received: {}, replied: {}, dropped: {}, rejected: {}, played: {}".format(
+        server.received, server.replied, server.dropped, server.rejected, server.received - server.dropped - server.rejected - server.errors))
+print(latency.getReport())
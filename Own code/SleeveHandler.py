@@ -1,16 +1,22 @@
-import socket
+import threading
 import time
-from os import listdir
+from os import listdir, path
+
+from SleeveTransport import SleeveTransport
+from PatternBank import PatternBank
 
 # Define Constants
-COMMANDS_DIR = "./Own Code/Sleeve/commands/"
+COMMANDS_DIR = path.join(path.dirname(path.abspath(__file__)), "Sleeve", "commands", "")
 UDP_IP = "127.0.0.1"
 UDP_PORT = 50000
+REPLY_TIMEOUT = 0.5
+MAX_PENDING_AGE = 0.5   # Pending commands older than this (in seconds) are not played anymore
 
 
 # Define Status Codes
 STATUS_ERROR = -1
 STATUS_BUSY = -2
+STATUS_PENDING = -3
 
 class SleeveHandler:
     BASE_COMMAND = "!PlayPattern"
@@ -20,6 +26,7 @@ class SleeveHandler:
     SOFT    = 1
     MEDIUM  = 2
     INTENSE = 3
+    STEP_DOWN = 4   # Missing floor ahead (see StepDetector.py)
 
     # Intensity decrease
     DECREASE = ",intensityIncrease=-"
@@ -47,68 +54,147 @@ class SleeveHandler:
     V_CENTER        = ",circumferenceCoorOffset=1023"
     TOP             = ",circumferenceCoorOffset=256"
 
-    # Extra delay dependent on intensity
-    delays = {OFF: 0, SOFT:1, MEDIUM:0.5, INTENSE:0.1}
+    # Minimum delay before an identical command is repeated, dependent on intensity
+    delays = {OFF: 0, SOFT:1, MEDIUM:0.5, INTENSE:0.1, STEP_DOWN:0.5}
 
     # Define global variables
-    def __init__(self):
+    def __init__(self, ip=UDP_IP, port=UDP_PORT, timeout=REPLY_TIMEOUT, commands_dir=None):
+        self.commands_dir = COMMANDS_DIR if commands_dir is None else commands_dir
         self.cmd_dict = {}
         self.readCommandFiles()
-        # Initialize connection
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # Initialize connection (non-blocking, replies are handled in the background)
+        self.transport = SleeveTransport((ip, port), timeout)
 
         self.busyUntil = time.time()
         self.leftHanded = False
 
+        # Lookup table of the encoded commands
+        self.encoded = {}
+
+        # Patterns to predict the duration of the commands, and the number of replies that differed from the prediction
+        self.patternBank = PatternBank()
+        self.lastRequest = None
+        self.mispredicted = 0
+
+        # Monitor of the latency of the commands (LatencyMonitor), set by the caller
+        self.latency = None
+
+        # Scheduler state: the newest pending command per region and the last sent command
+        self.lock = threading.RLock()
+        self.pending = {}
+        self.lastCommand = None
+        self.lastIntensity = self.OFF
+        self.dispatchScheduled = False
+
     def setLeftHandMode(self, enabled):
         self.leftHanded = enabled
+        self.encoded = {}
 
-    # Define helper functions
-    def sendCommand(self, command, pattern=True):
-        # Make sure the previous pattern is finished
-        if (self.busyUntil > time.time()): return STATUS_BUSY, "STATUS: BUSY"
+    # Get the command as bytes, prepared for left handed use if enabled (cached in a lookup table)
+    def encodeCommand(self, command, pattern=True):
+        key = (command, pattern)
+        if key not in self.encoded:
+            self.encoded[key] = self.toBytes(command, pattern)
+        return self.encoded[key]
 
-        # Prepare the command for left handed use
+    def toBytes(self, command, pattern=True):
         # TODO: Implement working approach of this
         #       It seems that invertHorizontal has no effect
         if self.leftHanded and pattern:
             command += ",invertHorizontal=true"
-        
-        # Send pattern command
+        return bytes(command, "utf-8")
+
+    # Encode the commands in advance, e.g. all output commands of the model
+    def preloadCommands(self, commands):
+        for command in commands:
+            self.encodeCommand(command)
+
+    # Define helper functions
+    def sendCommand(self, command, pattern=True, wait=False, force=False):
+        # Make sure the previous pattern is finished (unless it is preempted)
+        if (self.busyUntil > time.time() and not force): return STATUS_BUSY, "STATUS: BUSY"
+
+        # Send pattern command (prepared for left handed use), the reply is handled by the transport thread
+        duration = self.predictDuration(command)
+        request = self.transport.send(self.encodeCommand(command, pattern), lambda request, response: self.handleReply(command, request, response, duration))
+        if request is None:
+            return STATUS_ERROR, "STATUS: UNREACHABLE"
+
+        # Stay busy until the pattern is finished (or until the reply arrives, when the duration is unknown)
+        self.lastRequest = request
+        self.busyUntil = time.time() + (self.transport.timeout if duration is None else duration + 0.05)
+        if not wait:
+            return STATUS_PENDING, "STATUS: PENDING"
+
+        response = request.future.result()
+        if response is None:
+            return STATUS_ERROR, "STATUS: ERROR!"
+        return self.parseDuration(response), response
+
+    # Get the duration (in seconds) of a command from the pattern bank, None for unknown patterns
+    def predictDuration(self, command):
         try:
-            self.socket.sendto(bytes(command, "utf-8"), (UDP_IP, UDP_PORT))
-            response = self.socket.recvfrom(4096)[0].decode("utf-8")
+            return self.patternBank.getDuration(command)
+        except ValueError:
+            return None
+
+    # Get the duration (in seconds) from the reply of the server
+    def parseDuration(self, response):
+        return int(response.split(",")[1]) / 1000
+
+    # Handle the reply to a command (called by the transport thread), checks the predicted duration
+    def handleReply(self, command, request, response, predicted=None):
+        if self.latency is not None and request.sent is not None:
+            self.latency.record("sleeve_send", request.sent - request.created)
+            if response is not None: self.latency.record("sleeve_ack", time.monotonic() - request.sent)
+
+        # The busy state is shared with the scheduler (see dispatch)
+        with self.lock:
+            # Only the reply to the newest command affects the busy state
+            latest = request is self.lastRequest
 
-            # Update the busyUntil tracker
-            duration = int(response.split(",")[1]) / 1000
-            self.busyUntil = time.time() + duration + 0.05
+            if response is None:
+                print("Command failed: no reply to {}".format(command))
+                if latest: self.busyUntil = time.time()
+                return
+
+            try:
+                duration = self.parseDuration(response)
+            except (IndexError, ValueError) as e:
+                print("Command failed: {}".format(e))
+                if latest: self.busyUntil = time.time()
+                return
 
             # Print issue
             if duration < 0:
                 print("Issue occured with command: {}".format(command))
+                if latest: self.busyUntil = time.time()
+                return
 
-            return duration, response
-        
-        # Error handling
-        except Exception as e:
-            print("Command failed: {}".format(e))
-            return STATUS_ERROR, "STATUS: ERROR!"
+            # An uncertain reply may belong to an older (lost) command, the prediction is kept
+            if predicted is not None and request.uncertain: return
 
+            # Correct the busyUntil tracker when the prediction was wrong (or missing)
+            if predicted is not None and abs(duration - predicted) < 0.001: return
+            if predicted is not None: self.mispredicted += 1
+            if latest:
+                elapsed = time.monotonic() - request.sent
+                self.busyUntil = time.time() - elapsed + duration + 0.05
 
     # Process command files
     def readCommandFiles(self):
-        # Reset current dictionary
-        self.cmd_dict = {}
+        # Build a new dictionary, which replaces the current dictionary at once (it can be reloaded while running)
+        cmd_dict = {}
         # Read folder
-        cmd_filenames = listdir(COMMANDS_DIR)
+        cmd_filenames = sorted(listdir(self.commands_dir))
 
         for filename in cmd_filenames:
-            with open(COMMANDS_DIR + filename, "r") as file:
+            with open(path.join(self.commands_dir, filename), "r") as file:
                 # Process the files
                 lines = file.read().split("\n")
                 description, command = [line for line in lines if len(line) > 0]
                 # Add command and description
-                self.cmd_dict[filename] = {
+                cmd_dict[filename] = {
                     "description":description,
                     "command":command
                 }
@@ -117,20 +203,29 @@ class SleeveHandler:
                 if "stroke_down_slow" in command:
                     description = description + (" snel")
                     command = command.replace("stroke_down_slow", "stroke_down_fast")
-                    self.cmd_dict[filename + "s"] = {
+                    cmd_dict[filename + "s"] = {
                         "description":description,
                         "command":command
                     }
 
+        self.cmd_dict = cmd_dict
+
+    # Reload the command files (None for the default directory) and encode the commands again, e.g. after the settings changed
+    def reloadCommands(self, commands, commands_dir=None):
+        self.commands_dir = COMMANDS_DIR if commands_dir is None else commands_dir
+        self.readCommandFiles()
+
+        self.encoded = {(command, True): self.toBytes(command) for command in commands}
+
 
     # Show all the command ids and descriptions
     def showCommands(self):
         for id, cmd_data in self.cmd_dict.items():
             print(f"{id:10}: {cmd_data['description']}")
 
-    # Run a command based on the id
+    # Run a command based on the id (waits for the reply, at most the reply timeout)
     def runCommand(self, id):
-        return self.sendCommand(self.cmd_dict[id]["command"])
+        return self.sendCommand(self.cmd_dict[id]["command"], wait=True)
 
     # Test all commands
     def testCommands(self):
@@ -139,8 +234,52 @@ class SleeveHandler:
             print("{:10s} {}".format(cmd_id, cmd_obj["description"]))
             time.sleep(duration + 5)
 
-    # Process signals that are sent continuously
+    # Process signals that are sent continuously (never waits for the server)
     def processSignal(self, command, intensity):
-        duration, _ = self.sendCommand(command, pattern=True)
-        # If it is executed, add the delay based on intensity
-        if duration > 0: self.busyUntil += self.delays[intensity]
+        with self.lock:
+            # Keep only the newest command per region
+            self.pending[self.getRegion(command)] = (command, intensity, time.time())
+            self.dispatch()
+
+    # Get the region of a command (the command without the intensity)
+    def getRegion(self, command):
+        return command.split(self.DECREASE)[0]
+
+    # Send the most urgent pending command, when the sleeve is free or it preempts the current pattern
+    def dispatch(self):
+        with self.lock:
+            self.dispatchScheduled = False
+            now = time.time()
+
+            # Drop outdated commands
+            self.pending = {region: cmd for region, cmd in self.pending.items() if now - cmd[2] <= MAX_PENDING_AGE}
+            if len(self.pending) == 0: return
+
+            # Select the highest intensity (newest first)
+            region, (command, intensity, _) = max(self.pending.items(), key=lambda item: (item[1][1], item[1][2]))
+
+            # Wait for the current pattern, unless the command has a higher intensity
+            busy = self.busyUntil > now
+            if busy and intensity <= self.lastIntensity:
+                self.scheduleDispatch(self.busyUntil - now)
+                return
+
+            # Rate limit identical commands
+            del self.pending[region]
+            if command == self.lastCommand and now < self.busyUntil + self.delays[intensity]:
+                return
+
+            status, _ = self.sendCommand(command, pattern=True, force=busy)
+            if status != STATUS_ERROR:
+                self.lastCommand, self.lastIntensity = command, intensity
+
+    # Dispatch the pending commands once the current pattern is finished
+    def scheduleDispatch(self, delay):
+        if self.dispatchScheduled: return
+        self.dispatchScheduled = True
+        self.transport.callLater(delay, self.dispatch)
+
+    # Close the connection
+    def close(self):
+        self.transport.close()
+
@@ -0,0 +1,166 @@
+import argparse
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from os import path
+
+from PatternBank import PatternBank
+
+'''
+Stand-in for the Elitac UDP server (Elitac_HIDCOM jar), to test the SleeveHandler without the sleeve
+  Reads Sleeve/config.properties and the patterns in Sleeve/patterns, and answers !PlayPattern commands like the
+  server: "status,durationMs" (a negative duration on errors). The intensityIncrease, offset and invert parameters
+  are applied to the pattern. Latency, packet loss and busy behaviour can be injected. Run standalone with:
+    python "Own code/SleeveServer.py" --latency 0.02 --loss 0.05
+'''
+
+# Define Constants
+CONFIG_FILE = path.join(path.dirname(path.abspath(__file__)), "Sleeve", "config.properties")
+
+# Replies
+STATUS_OK = "OK"
+STATUS_ERROR = "ERROR"
+STATUS_BUSY = "BUSY"
+
+# Busy behaviour: a new pattern interrupts the current pattern, waits for it, or is rejected
+BUSY_INTERRUPT = "interrupt"
+BUSY_QUEUE = "queue"
+BUSY_REJECT = "reject"
+
+
+# Read a properties file (key=value lines, # for comments)
+def readProperties(filename):
+    properties = {}
+    with open(filename, "r") as file:
+        for line in file:
+            line = line.strip()
+            if len(line) == 0 or line.startswith("#") or "=" not in line: continue
+            key, value = line.split("=", 1)
+            properties[key.strip()] = value.strip()
+    return properties
+
+
+class SleeveServer(asyncio.DatagramProtocol):
+    """
+    UDP server answering the sleeve commands like the Elitac server, running in a background thread.
+
+    Every command is applied to its pattern by the PatternBank (the last played actions are
+    stored in `played`), the reply contains the duration of the pattern in milliseconds. Faults can
+    be injected: `latency` (+ uniform `jitter`) seconds before the reply, a probability
+    `loss` that the command is dropped without reply, and the `busy` behaviour for
+    commands that arrive while a pattern is playing.
+    """
+
+    def __init__(self, config_file=CONFIG_FILE, host="127.0.0.1", port=None, latency=0.0, jitter=0.0,
+                 loss=0.0, busy=BUSY_INTERRUPT, seed=None, verbose=False):
+        self.config = readProperties(config_file)
+        self.address = (host, int(self.config.get("udp.port", 50000)) if port is None else port)
+        self.tactile_intensity = int(self.config.get("systemsettings.tactileIntensity", 0))
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.busy = busy
+        self.random = random.Random(seed)
+        self.verbose = verbose
+
+        # Read all patterns (relative to the config file)
+        pattern_dir = path.join(path.dirname(path.abspath(config_file)), self.config.get("xml.dir", "./patterns"))
+        self.patternBank = PatternBank(pattern_dir, self.tactile_intensity)
+
+        self.busy_until = 0
+        self.played = deque(maxlen=1000)
+        self.transport = None
+
+        # Statistics
+        self.received = self.replied = self.dropped = self.rejected = self.errors = 0
+
+    # Start the server in a background thread
+    def start(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="SleeveServer", daemon=True)
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self._bind(), self.loop).result()
+        return self
+
+    async def _bind(self):
+        self.transport, _ = await self.loop.create_datagram_endpoint(lambda: self, local_addr=self.address)
+        self.address = self.transport.get_extra_info("sockname")
+
+    def close(self):
+        if self.transport is None: return
+        self.loop.call_soon_threadsafe(self.transport.close)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.transport = None
+
+    # Handle a command, returns the reply
+    def handleCommand(self, command):
+        try:
+            actions = self.patternBank.apply(command)
+            duration = self.patternBank.getDuration(command)
+        except ValueError:
+            self.errors += 1
+            return "{},-1".format(STATUS_ERROR)
+
+        now = time.monotonic()
+        start = now
+        if self.busy_until > now:
+            if self.busy == BUSY_REJECT:
+                self.rejected += 1
+                return "{},-1".format(STATUS_BUSY)
+            if self.busy == BUSY_QUEUE:
+                start = self.busy_until
+
+        self.busy_until = start + duration
+        self.played.append((start, command, actions))
+        if self.verbose: print("{:.3f} {} ({} actions, {}ms)".format(start, command.strip(), len(actions.times), round(duration * 1000)))
+        return "{},{}".format(STATUS_OK, round((self.busy_until - now) * 1000))
+
+    ############################## Protocol callbacks ##############################
+
+    def datagram_received(self, data, addr):
+        self.received += 1
+        if self.random.random() < self.loss:
+            self.dropped += 1
+            return
+
+        reply = self.handleCommand(data.decode("utf-8"))
+        delay = self.latency + self.random.uniform(0, self.jitter)
+        if delay > 0:
+            self.loop.call_later(delay, self._reply, reply, addr)
+        else:
+            self._reply(reply, addr)
+
+    def _reply(self, reply, addr):
+        if self.transport is None or self.transport.is_closing(): return
+        self.transport.sendto(reply.encode("utf-8"), addr)
+        self.replied += 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stand-in for the Elitac sleeve UDP server")
+    parser.add_argument("--config", default=CONFIG_FILE, help="Server config file (config.properties)")
+    parser.add_argument("--port", type=int, help="UDP port (default: udp.port of the config file)")
+    parser.add_argument("--latency", type=float, default=0.0, help="Delay (in seconds) before every reply")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random extra delay (in seconds) before every reply")
+    parser.add_argument("--loss", type=float, default=0.0, help="Probability that a command is dropped without reply")
+    parser.add_argument("--busy", choices=[BUSY_INTERRUPT, BUSY_QUEUE, BUSY_REJECT], default=BUSY_INTERRUPT,
+                        help="Behaviour for commands that arrive while a pattern is playing")
+    parser.add_argument("--verbose", action="store_true", help="Print every played pattern")
+    args = parser.parse_args()
+
+    server = SleeveServer(args.config, port=args.port, latency=args.latency, jitter=args.jitter, loss=args.loss,
+                          busy=args.busy, verbose=args.verbose).start()
+    print("Sleeve server listening on {}:{} ({} patterns)".format(*server.address[:2], len(server.patternBank.patterns)))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        print("\nReceived: {}, replied: {}, dropped: {}, rejected: {}, errors: {}".format(
+            server.received, server.replied, server.dropped, server.rejected, server.errors))
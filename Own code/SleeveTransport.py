@@ -0,0 +1,162 @@
+import asyncio
+from collections import deque
+from concurrent.futures import Future
+import threading
+import time
+
+
+class SleeveRequest:
+    """
+    A command sent to the sleeve server, waiting for its reply.
+    The future is resolved with the reply (string), or None when the request failed. The
+    reply is uncertain when it may be the late reply of an older request (see SleeveTransport).
+    """
+
+    def __init__(self, data, callback=None):
+        self.data = data
+        self.callback = callback
+        self.future = Future()
+        self.created = time.monotonic()
+        self.sent = None
+        self.expired = False
+        self.uncertain = False
+
+
+class SleeveTransport(asyncio.DatagramProtocol):
+    """
+    Non-blocking UDP transport to the sleeve server, running an asyncio event loop in a background thread.
+
+    The server replies to every command in order (the protocol has no sequence numbers), so
+    a reply is matched to the oldest request in flight that is still waiting. Requests
+    without a reply before their deadline fail, but stay in flight (expired) for a grace
+    period: a reply that arrives while only expired requests are in flight is the late
+    reply of the oldest one, and is discarded. When a newer request is still waiting, the
+    expired requests ahead of it are dropped as lost (the reply of a lost command never
+    arrives and would otherwise shift every following reply onto the request before it)
+    and the reply is matched to the waiting request. The reply may still be the late reply
+    of a dropped request, so that request is marked uncertain and its handler should not
+    trust the reply beyond the acknowledgement. After `max_failures` failed requests in a
+    row, no commands are sent for a backoff period, which doubles on every new failure (up
+    to `max_backoff` seconds).
+    """
+
+    def __init__(self, address, timeout=0.5, max_failures=3, backoff=1.0, max_backoff=30.0, grace=2.0):
+        self.address = address
+        self.timeout = timeout
+        self.max_failures = max_failures
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.grace = grace
+
+        self.in_flight = deque()
+        self.failures = 0
+        self.backoff_until = 0
+        self.transport = None
+
+        # Statistics
+        self.sent = self.replied = self.timeouts = self.late = self.lost = self.uncertain = self.skipped = 0
+
+        # Start the event loop and connect
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="SleeveTransport", daemon=True)
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self._connect(), self.loop).result()
+
+    async def _connect(self):
+        await self.loop.create_datagram_endpoint(lambda: self, remote_addr=self.address)
+
+    # Send a command (bytes) without waiting, returns the request or None while backing off
+    def send(self, data, callback=None):
+        if self.isBackingOff():
+            self.skipped += 1
+            return None
+
+        request = SleeveRequest(data, callback)
+        self.loop.call_soon_threadsafe(self._send, request)
+        return request
+
+    # Call a function after a delay (in seconds) on the transport thread
+    def callLater(self, delay, callback):
+        self.loop.call_soon_threadsafe(self.loop.call_later, delay, callback)
+
+    def isBackingOff(self):
+        return time.monotonic() < self.backoff_until
+
+    def close(self):
+        if not self.loop.is_running(): return
+        self.loop.call_soon_threadsafe(self._close)
+        self.thread.join()
+        self.loop.close()
+
+    def _close(self):
+        if self.transport is not None: self.transport.close()
+        for request in self.in_flight:
+            self._resolve(request, None)
+        self.loop.stop()
+
+    def _send(self, request):
+        request.sent = time.monotonic()
+        self.in_flight.append(request)
+        self.transport.sendto(request.data)
+        self.sent += 1
+        self.loop.call_later(self.timeout, self._expire, request)
+
+    def _resolve(self, request, response):
+        if request.future.done(): return
+        request.future.set_result(response)
+        if request.callback is not None:
+            request.callback(request, response)
+
+    # Deadline of a request has passed without reply
+    def _expire(self, request):
+        if request.future.done(): return
+        request.expired = True
+        self.timeouts += 1
+        self._fail(request)
+        self.loop.call_later(self.grace, self._purge, request)
+
+    # Remove an expired request, its reply is not expected anymore
+    def _purge(self, request):
+        if request in self.in_flight: self.in_flight.remove(request)
+
+    def _fail(self, request):
+        self._resolve(request, None)
+
+        # Back off after repeated failures
+        self.failures += 1
+        if self.failures >= self.max_failures:
+            delay = min(self.backoff * 2 ** (self.failures - self.max_failures), self.max_backoff)
+            self.backoff_until = time.monotonic() + delay
+
+    ############################## Protocol callbacks ##############################
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if not self.in_flight: return
+        # Expired requests ahead of a waiting request are dropped as lost, the reply is matched to the waiting request
+        dropped = False
+        if not all(request.expired for request in self.in_flight):
+            while self.in_flight[0].expired:
+                self.in_flight.popleft()
+                self.lost += 1
+                dropped = True
+        request = self.in_flight.popleft()
+        if request.expired:
+            self.late += 1
+            return
+        # The reply may be the late reply of a dropped request
+        if dropped:
+            request.uncertain = True
+            self.uncertain += 1
+
+        self.failures = 0
+        self.replied += 1
+        self._resolve(request, data.decode("utf-8"))
+
+    # The server is not reachable (e.g. ICMP port unreachable), fail the oldest request
+    def error_received(self, exc):
+        if not self.in_flight: return
+        request = self.in_flight.popleft()
+        if not request.expired: self._fail(request)
@@ -0,0 +1,186 @@
+import time
+
+import numpy as np
+
+from SleeveHandler import SleeveHandler
+
+
+# Horizontal field of view of the mono cameras (in degrees), used when the intrinsics of the device are unknown
+DEFAULT_HFOV = 71.9
+
+
+class StepDetector:
+    """
+    Detects steps and drop-offs (missing floor ahead) in the depth frame.
+
+    The depth frame is converted to 3D points (camera coordinates in millimeters: x right,
+    y down, z forward) on a subsampled grid of pixels (every `step` pixel), using ray
+    tables that are precomputed from the camera intrinsics. The floor plane is fitted on
+    the points in the lower part of the frame with a vectorized RANSAC (all hypotheses are
+    scored at once), followed by a least squares refinement on the inliers. While the
+    previous plane still fits (at least `track_ratio` of the points are inliers), it is
+    tracked by the refinement only, without new hypotheses.
+
+    Ahead of the user (where the plane is expected within `look_ahead` millimeters), the
+    points that are more than `drop_height` below the plane are counted per horizontal
+    region (left, center, right). A region with missing floor for `confirm_frames`
+    frames in a row raises the STEP_DOWN danger level.
+    """
+
+    def __init__(self, resolution=(640, 400), intrinsics=None, step=8, floor_start=0.5,
+                 hypotheses=64, inlier_distance=60, track_ratio=0.5, max_tilt=45,
+                 camera_height=(300, 2500), look_ahead=3000, drop_height=150,
+                 min_fraction=0.15, min_points=10, confirm_frames=2, seed=0):
+        self.resolution = resolution
+        self.step = step
+        self.floor_start = floor_start
+        self.hypotheses = hypotheses
+        self.inlier_distance = inlier_distance
+        self.track_ratio = track_ratio
+        self.min_normal = np.cos(np.radians(max_tilt))
+        self.camera_height = camera_height
+        self.look_ahead = look_ahead
+        self.drop_height = drop_height
+        self.min_fraction = min_fraction
+        self.min_points = min_points
+        self.confirm_frames = confirm_frames
+        self.rng = np.random.default_rng(seed)
+
+        # Step down command of every horizontal region
+        self.commands = [SleeveHandler.BASE_COMMAND + SleeveHandler.STROKE_FAST + h_part + SleeveHandler.DECREASE + "0"
+                         for h_part in (SleeveHandler.LEFT, SleeveHandler.H_CENTER, SleeveHandler.RIGHT)]
+
+        self.setIntrinsics(intrinsics)
+
+        # Floor plane (normal pointing up, distance of the camera to the floor) and detection state
+        self.plane = None
+        self.fractions = np.zeros(3)
+        self.detections = np.zeros(3, dtype=int)
+
+        # Cost per stage of the last frame and the running totals (in seconds)
+        self.timings = {"points": 0.0, "floor": 0.0, "step": 0.0}
+        self.total_timings = dict(self.timings)
+        self.frames = self.tracked = 0
+
+    # Set the camera intrinsics (3x3 matrix, e.g. from device.readCalibration()) and precompute the ray tables
+    def setIntrinsics(self, intrinsics=None):
+        width, height = self.resolution
+        if intrinsics is None:
+            f = width / 2 / np.tan(np.radians(DEFAULT_HFOV) / 2)
+            intrinsics = [[f, 0, width / 2], [0, f, height / 2], [0, 0, 1]]
+        (fx, _, cx), (_, fy, cy), _ = np.asarray(intrinsics, dtype=np.float64)
+
+        # Ray (x/z, y/z, 1) of every sampled pixel, shape (sampled rows, sampled columns, 3)
+        rows = np.arange(self.step // 2, height, self.step)
+        columns = np.arange(self.step // 2, width, self.step)
+        self.rays = np.empty((len(rows), len(columns), 3))
+        self.rays[:, :, 0] = ((columns - cx) / fx)[None, :]
+        self.rays[:, :, 1] = ((rows - cy) / fy)[:, None]
+        self.rays[:, :, 2] = 1
+
+        # Floor candidates (lower part of the frame) and the horizontal region of every sampled pixel
+        self.floor_mask = np.broadcast_to((rows >= height * self.floor_start)[:, None], self.rays.shape[:2])
+        self.regions = np.broadcast_to(np.minimum(columns * 3 // width, 2)[None, :], self.rays.shape[:2])
+
+    # Get the sampled depth (in millimeters) and 3D points of the frame
+    def getPoints(self, depthFrame):
+        s = self.step // 2
+        depth = depthFrame[s::self.step, s::self.step].astype(np.float64)
+        return depth, self.rays * depth[:, :, None]
+
+    # Fit planes through random triples of points, returns the normals (pointing up) and distances
+    def getHypotheses(self, points):
+        samples = points[self.rng.integers(len(points), size=(self.hypotheses, 3))]
+        normals = np.cross(samples[:, 1] - samples[:, 0], samples[:, 2] - samples[:, 0])
+        lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+        normals = normals / np.maximum(lengths, 1e-9)
+        normals[normals[:, 1] > 0] *= -1
+        distances = -np.einsum("ij,ij->i", normals, samples[:, 0])
+        return normals, distances
+
+    # Check which planes are plausible floors (not too tilted, camera above the floor)
+    def isFloor(self, normals, distances):
+        return (-normals[..., 1] >= self.min_normal) & (distances >= self.camera_height[0]) & (distances <= self.camera_height[1])
+
+    # Fit a plane through the points using least squares, returns the normal (pointing up) and distance
+    def refinePlane(self, points):
+        center = points.mean(axis=0)
+        normal = np.linalg.svd(points - center, full_matrices=False)[2][-1]
+        if normal[1] > 0: normal = -normal
+        return normal, -normal @ center
+
+    # Fit or track the floor plane, returns the plane or None when no floor is found
+    def fitFloor(self, points):
+        if len(points) < 3: return None
+
+        # Track the previous floor while it still fits
+        if self.plane is not None:
+            normal, distance = self.plane
+            inliers = np.abs(points @ normal + distance) < self.inlier_distance
+            if inliers.sum() >= max(self.track_ratio * len(points), 3):
+                self.tracked += 1
+                plane = self.refinePlane(points[inliers])
+                return plane if self.isFloor(*plane) else None
+
+        # Score all hypotheses at once, shape (points, hypotheses)
+        normals, distances = self.getHypotheses(points)
+        scores = (np.abs(points @ normals.T + distances) < self.inlier_distance).sum(axis=0)
+        scores[~self.isFloor(normals, distances)] = 0
+        best = np.argmax(scores)
+        if scores[best] < 3: return None
+
+        inliers = np.abs(points @ normals[best] + distances[best]) < self.inlier_distance
+        plane = self.refinePlane(points[inliers])
+        return plane if self.isFloor(*plane) else None
+
+    # Detect missing floor ahead, returns the region (0: left, 1: center, 2: right) or None
+    def detect(self, depthFrame):
+        t0 = time.perf_counter()
+        depth, points = self.getPoints(depthFrame)
+        valid = depth > 0
+        t1 = time.perf_counter()
+
+        self.plane = self.fitFloor(points[valid & self.floor_mask])
+        t2 = time.perf_counter()
+
+        region = None
+        self.fractions[:] = 0
+        if self.plane is not None:
+            normal, distance = self.plane
+
+            # Expected depth of the floor along every ray (rays that do not hit the floor are excluded)
+            facing = self.rays @ normal
+            expected = np.where(facing < 0, -distance / np.where(facing < 0, facing, -1), np.inf)
+            ahead = valid & (expected < self.look_ahead)
+
+            # Points below the floor, per horizontal region
+            below = ahead & (points @ normal + distance < -self.drop_height)
+            counts = np.bincount(self.regions[ahead], minlength=3)
+            self.fractions = np.bincount(self.regions[below], minlength=3) / np.maximum(counts, 1)
+            missing = (self.fractions >= self.min_fraction) & (counts >= self.min_points)
+
+            # Confirm the detection over multiple frames
+            self.detections = np.where(missing, self.detections + 1, 0)
+            confirmed = self.detections >= self.confirm_frames
+            if confirmed.any():
+                region = int(np.argmax(np.where(confirmed, self.fractions, -1)))
+        else:
+            self.detections[:] = 0
+        t3 = time.perf_counter()
+
+        self.timings = {"points": t1 - t0, "floor": t2 - t1, "step": t3 - t2}
+        for stage, timing in self.timings.items(): self.total_timings[stage] += timing
+        self.frames += 1
+        return region
+
+    # Get the output command and intensity of a detected region
+    def getOutputSignal(self, region):
+        return self.commands[region], SleeveHandler.STEP_DOWN
+
+    # Get the cost of the detection: last frame and mean per frame (in milliseconds), and the fraction of tracked floors
+    def getCostReport(self):
+        frames = max(self.frames, 1)
+        last = sum(self.timings.values()) * 1000
+        mean = sum(self.total_timings.values()) * 1000 / frames
+        stages = ", ".join("{} {:.3f}ms".format(stage, timing * 1000 / frames) for stage, timing in self.total_timings.items())
+        return "Step detection: {:.3f}ms (mean {:.3f}ms: {}), floor tracked: {:.0%}".format(last, mean, stages, self.tracked / frames)
@@ -0,0 +1,151 @@
+import time
+from collections import deque
+
+'''
+Non-blocking synchronization of the output queues of a DepthAI pipeline
+  The demos read the rgb preview, detections, depth and bounding box mapping queues with blocking get calls, one
+  after the other, so a single slow or missing message stalls the loop and the messages of different frames can be
+  combined. StreamSync polls all queues with tryGet and only hands out bundles of matching messages.
+'''
+
+
+# Match modes
+MATCH_SEQUENCE = "sequence"
+MATCH_TIMESTAMP = "timestamp"
+
+
+class StreamSync:
+    """
+    Matches the messages of multiple DepthAI output queues into bundles, without blocking.
+
+    poll drains every queue with tryGet into a buffer per stream. A bundle contains one
+    message per stream with the same sequence number (MATCH_SEQUENCE) or with timestamps
+    within `tolerance` seconds of the message of the first stream (MATCH_TIMESTAMP), the
+    first stream should be the slowest. Only the newest complete bundle is handed out, the
+    older messages are dropped, as are messages older than `max_age` seconds (relative to
+    the newest message). A conditional stream is only part of the bundle when its
+    condition holds for the other messages, e.g. the bounding box mapping, which is only
+    sent when there are detections. The statistics count the bundles, the dropped messages
+    per stream and the polls without a complete bundle (misses).
+    """
+
+    def __init__(self, queues, conditional=None, match=MATCH_TIMESTAMP, tolerance=0.02, max_age=0.5, max_pending=16):
+        self.queues = queues
+        self.conditional = conditional or {}
+        self.match = match
+        self.tolerance = tolerance
+        self.max_age = max_age
+
+        self.buffers = {name: deque(maxlen=max_pending) for name in queues}
+        self.required = [name for name in queues if name not in self.conditional]
+
+        # Statistics
+        self.bundles = self.misses = 0
+        self.received = {name: 0 for name in queues}
+        self.dropped = {name: 0 for name in queues}
+        self.spread = 0.0
+
+    # Get the key used to match a message (sequence number or timestamp in seconds)
+    def getKey(self, message):
+        if self.match == MATCH_SEQUENCE: return message.getSequenceNum()
+        return message.getTimestamp().total_seconds()
+
+    # Move all available messages from the queues into the buffers
+    def poll(self):
+        for name, q in self.queues.items():
+            buffer = self.buffers[name]
+            while True:
+                message = q.tryGet()
+                if message is None: break
+                if len(buffer) == buffer.maxlen: self.dropped[name] += 1
+                buffer.append((self.getKey(message), message))
+                self.received[name] += 1
+
+    # Find the message of a stream matching the key, returns its index in the buffer (None if there is no match)
+    def findMatch(self, name, key):
+        best, best_distance = None, None
+        for i, (other_key, _) in enumerate(self.buffers[name]):
+            distance = abs(other_key - key)
+            if best_distance is None or distance < best_distance:
+                best, best_distance = i, distance
+        limit = 0 if self.match == MATCH_SEQUENCE else self.tolerance
+        return best if best is not None and best_distance <= limit else None
+
+    # Get the newest complete bundle (name -> message, None for conditional streams that are not part of it)
+    def tryGet(self):
+        self.poll()
+        self.dropStale()
+
+        reference = self.required[0]
+        for index in range(len(self.buffers[reference]) - 1, -1, -1):
+            key = self.buffers[reference][index][0]
+            indices = {reference: index}
+            for name in self.required[1:]:
+                indices[name] = self.findMatch(name, key)
+            if None in indices.values(): continue
+
+            bundle = {name: self.buffers[name][i][1] for name, i in indices.items()}
+            waiting = False
+            for name, condition in self.conditional.items():
+                bundle[name] = None
+                if not condition(bundle): continue
+                indices[name] = self.findMatch(name, key)
+                if indices[name] is None:
+                    waiting = True
+                    break
+                bundle[name] = self.buffers[name][indices[name]][1]
+            # The conditional message may not have arrived yet, older bundles are not used
+            if waiting: break
+
+            # Remove the messages of the bundle and all older messages
+            keys = [self.buffers[name][i][0] for name, i in indices.items()]
+            self.spread += max(keys) - min(keys)
+            for name, i in indices.items():
+                self.discard(name, i + 1, dropped=i)
+            self.bundles += 1
+            return bundle
+
+        self.misses += 1
+        return None
+
+    # Wait for the next complete bundle (None on timeout), polling every poll_interval seconds
+    def get(self, timeout=None, poll_interval=0.001):
+        end_time = None if timeout is None else time.monotonic() + timeout
+        while True:
+            bundle = self.tryGet()
+            if bundle is not None or (end_time is not None and time.monotonic() >= end_time): return bundle
+            time.sleep(poll_interval)
+
+    # Remove the first count messages of a stream, of which `dropped` are counted as dropped
+    def discard(self, name, count, dropped):
+        buffer = self.buffers[name]
+        for _ in range(min(count, len(buffer))):
+            buffer.popleft()
+        self.dropped[name] += dropped
+
+    # Drop the messages that are too old to be matched
+    def dropStale(self):
+        if self.match == MATCH_SEQUENCE: return
+        newest = max((buffer[-1][0] for buffer in self.buffers.values() if buffer), default=None)
+        if newest is None: return
+        for name, buffer in self.buffers.items():
+            stale = sum(1 for key, _ in buffer if newest - key > self.max_age)
+            self.discard(name, stale, stale)
+
+    def getStatistics(self):
+        return {
+            "bundles": self.bundles,
+            "misses": self.misses,
+            "received": dict(self.received),
+            "dropped": dict(self.dropped),
+            "spread": self.spread / max(self.bundles, 1),
+        }
+
+    def getReport(self):
+        lines = ["Bundles: {}, polls without bundle: {}, mean spread: {:.1f}{}".format(
+            self.bundles, self.misses, self.spread / max(self.bundles, 1) * (1000 if self.match == MATCH_TIMESTAMP else 1),
+            "ms" if self.match == MATCH_TIMESTAMP else " frames")]
+        for name in self.queues:
+            lines.append("  {:24s} received {:6d}, dropped {:6d} ({:.1%})".format(
+                name, self.received[name], self.dropped[name], self.dropped[name] / max(self.received[name], 1)))
+        return "\n".join(lines)